@@ -0,0 +1,63 @@
+'''
+Measures how many bytes have to be sent again after small edits to a file, with
+fixed 1024-byte shards (Sharding.shard_data) against content-defined chunks
+(Sharding.cdc_shard_data).
+
+A shard or chunk counts as re-sent when no shard or chunk with the same contents
+was part of the original upload, which is exactly what Main.Upload_Chunks skips,
+since its payloads are deterministic for a given key.
+
+Usage: python Benchmarks/cdc_resend.py [--size BYTES] [--seed N]
+'''
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'File_Processor'))
+import Sharding  # noqa: E402
+
+
+def resent_bytes(original, edited):
+    # Bytes of `edited` whose shard contents were not already in `original`
+    known = {hashlib.sha256(shard).digest() for shard in original}
+    return sum(len(shard) for shard in edited if hashlib.sha256(shard).digest() not in known)
+
+
+def edits(data, rng):
+    # Small edits of the kind that shift every fixed shard boundary after them
+    middle = len(data) // 2
+    yield "insert 1 byte near start", data[:100] + b'x' + data[100:]
+    yield "delete 10 bytes in middle", data[:middle] + data[middle + 10:]
+    yield "overwrite 100 bytes", data[:middle] + rng.randbytes(100) + data[middle + 100:]
+    yield "insert 3000 bytes at 25%", data[:len(data) // 4] + rng.randbytes(3000) + data[len(data) // 4:]
+    yield "append 1 KiB", data + rng.randbytes(1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=16 * 1024 * 1024, help="size of the test file in bytes")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    data = rng.randbytes(args.size)
+
+    start = time.perf_counter()
+    cdc_original = Sharding.cdc_shard_data(data)
+    elapsed = time.perf_counter() - start
+    print(f"{len(data) / 2**20:.0f} MiB file, {len(cdc_original)} CDC chunks "
+          f"(avg {len(data) // max(len(cdc_original), 1)} bytes), chunked at {len(data) / 2**20 / elapsed:.1f} MB/s")
+
+    fixed_original = Sharding.shard_data(data, 1024)
+    print(f"{'edit':<28}{'fixed re-sent':>16}{'CDC re-sent':>16}")
+    for name, edited in edits(data, rng):
+        fixed = resent_bytes(fixed_original, Sharding.shard_data(edited, 1024))
+        cdc = resent_bytes(cdc_original, Sharding.cdc_shard_data(edited))
+        print(f"{name:<28}{fixed:>16,}{cdc:>16,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Loopback benchmark of replicated shard writes: chain replication (the head
+streams to the first replica, each replica forwards cut-through to the next)
+against the head sending a copy to every replica itself.
+
+Every replica runs in its own process. Reports MB/s of shard data written (each
+shard counted once, whatever the replication factor) for each replication
+factor. With chain replication the head's uplink carries each shard once, so
+the rate should stay roughly flat as replicas are added; with per-replica sends
+it falls roughly as 1/r once the head's uplink is the bottleneck.
+
+Usage: python Benchmarks/chain_replication.py [--shards N] [--shard-size BYTES] [--max-replicas R]
+'''
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Distributor.Replication import STORED, ChainReplicator  # noqa: E402
+from Session_Layer.Shard_Store import ShardStore  # noqa: E402
+
+
+def replica(ports, ready):
+    # One replica: serves chain replication into an in-memory store until killed
+    async def serve():
+        replicator = ChainReplicator(ShardStore())
+        await replicator.start_server('127.0.0.1', 0)
+        ports.put(replicator.server_port)
+        ready.wait()
+        await asyncio.Event().wait()
+    asyncio.run(serve())
+
+
+async def chain_run(chain, shards):
+    statuses = await ChainReplicator().replicate(chain, shards)
+    assert all(status == STORED for status in statuses.values())
+
+
+async def star_run(chain, shards):
+    head = ChainReplicator()
+    for statuses in await asyncio.gather(*(head.replicate([node], shards) for node in chain)):
+        assert all(status == STORED for status in statuses.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=256)
+    parser.add_argument('--shard-size', type=int, default=256 * 1024)
+    parser.add_argument('--max-replicas', type=int, default=4)
+    args = parser.parse_args()
+
+    ports, ready = multiprocessing.Queue(), multiprocessing.Event()
+    processes = [multiprocessing.Process(target=replica, args=(ports, ready), daemon=True)
+                 for _ in range(args.max_replicas)]
+    for process in processes:
+        process.start()
+    nodes = [('127.0.0.1', ports.get()) for _ in processes]
+    ready.set()
+
+    total = args.shards * args.shard_size
+    print(f"{args.shards} shards of {args.shard_size} B ({total / 1e6:.1f} MB), one process per replica")
+    print(f"{'replicas':>8} {'chain MB/s':>11} {'per-replica MB/s':>17}")
+    for replicas in range(1, args.max_replicas + 1):
+        rates = []
+        for run in (chain_run, star_run):
+            shards = [os.urandom(args.shard_size) for _ in range(args.shards)]  # Fresh data, no dedup
+            start = time.perf_counter()
+            asyncio.run(run(nodes[:replicas], shards))
+            rates.append(total / (time.perf_counter() - start) / 1e6)
+        print(f"{replicas:>8} {rates[0]:>11.1f} {rates[1]:>17.1f}")
+
+    for process in processes:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Convergence benchmark of chain metadata dissemination: how many network hops
+(and how much time, at a given per-hop latency) it takes for a tail update to
+reach every node, for Distributor.Gossip against relaying it back through the
+chain one node at a time (the old DataChain.update_tail).
+
+The gossip nodes run in-process; every "hop" delivers all messages in flight at
+once, optionally dropping some, and every few hops each node also runs an
+anti-entropy round. Each node only knows a random O(log n) set of peers, as with
+the routing table.
+
+Usage: python Benchmarks/gossip_convergence.py [--sizes N,N,...] [--fanout F] [--loss P] [--hop-ms MS] [--trials T]
+'''
+import argparse
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Distributor.Gossip import Gossip  # noqa: E402
+
+
+def gossip_run(size, fanout, loss, anti_entropy_every, rng):
+    # Returns (hops until every node has the update, messages sent per node)
+    ips = [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(size)]
+    degree = min(size - 1, max(4, 2 * math.ceil(math.log2(size))))
+    links = {ip: set() for ip in ips}
+    for ip in ips:
+        for peer in rng.sample(ips, degree + 1):
+            if peer != ip:
+                links[ip].add(peer)  # Links go both ways, like routing tables learning from lookups
+                links[peer].add(ip)
+    nodes = {ip: Gossip(ip, lambda ip=ip: list(links[ip]), fanout=fanout) for ip in ips}
+
+    in_flight = _stamp(ips[-1], nodes[ips[-1]].set("tail", ips[-1]))
+    hops = 0
+    while any(node.get("tail") is None for node in nodes.values()):
+        hops += 1
+        delivered, in_flight = in_flight, []
+        for peer, message in delivered:
+            if rng.random() >= loss:
+                in_flight += _stamp(peer, nodes[peer].handle(message, message['_from']))
+        if hops % anti_entropy_every == 0:
+            for ip, node in nodes.items():
+                in_flight += _stamp(ip, node.round())
+        if hops > 10 * size:
+            break
+    messages = sum(node.messages_sent for node in nodes.values())
+    return hops, messages / size
+
+
+def _stamp(sender, messages):
+    # Tags messages with their sender, which UDP would tell the receiver
+    return [(peer, dict(message, _from=sender)) for peer, message in messages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='8,32,128,512,2048')
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--anti-entropy-every', type=int, default=5, help='hops between anti-entropy rounds')
+    parser.add_argument('--hop-ms', type=float, default=1.0, help='one-way latency of a hop')
+    parser.add_argument('--trials', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"fanout {args.fanout}, loss {args.loss:.0%}, {args.hop_ms} ms per hop")
+    print(f"{'nodes':>6} {'chain hops':>11} {'chain ms':>9} {'gossip hops':>12} {'gossip ms':>10} {'msgs/node':>10}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        runs = [gossip_run(size, args.fanout, args.loss, args.anti_entropy_every, rng) for _ in range(args.trials)]
+        hops = sum(run[0] for run in runs) / len(runs)
+        messages = sum(run[1] for run in runs) / len(runs)
+        chain = size - 1  # One connection per hop back to the head
+        print(f"{size:>6} {chain:>11} {chain * args.hop_ms:>9.1f} {hops:>12.1f} {hops * args.hop_ms:>10.1f} {messages:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
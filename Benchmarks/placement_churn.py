@@ -0,0 +1,90 @@
+'''
+Churn benchmark of shard placement: how many bytes have to move when a node
+joins or leaves, for the consistent-hash ring (Distributor.Placement.HashRing)
+against placing replicas by shard hash modulo the node count.
+
+Also reports how evenly the ring spreads shards (largest node load over the
+mean) and how long a holder lookup takes.
+
+Usage: python Benchmarks/placement_churn.py [--nodes N] [--shards N] [--shard-size BYTES] [--replicas R] [--vnodes V]
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Distributor.Placement import HashRing  # noqa: E402
+
+
+class ModuloPlacement:
+    # Replica i of a shard goes to node (hash + i) mod n: stateless too, but tied to n
+    def __init__(self, nodes, replicas):
+        self.nodes = list(nodes)
+        self.replicas = replicas
+
+    def holders(self, shard_id):
+        start = int(shard_id[:16], 16) % len(self.nodes)
+        return [self.nodes[(start + i) % len(self.nodes)] for i in range(min(self.replicas, len(self.nodes)))]
+
+
+def moved_bytes(before, after, shard_ids, shard_size):
+    # Every replica a node gains has to be copied to it
+    moved = 0
+    for shard_id in shard_ids:
+        old = set(before.holders(shard_id))
+        moved += len([node for node in after.holders(shard_id) if node not in old]) * shard_size
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=50)
+    parser.add_argument('--shards', type=int, default=100000)
+    parser.add_argument('--shard-size', type=int, default=1024)
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--vnodes', type=int, default=128)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    shard_ids = ['%064x' % rng.getrandbits(256) for _ in range(args.shards)]
+    nodes = [f"10.0.{i // 256}.{i % 256}" for i in range(args.nodes)]
+    joiner = f"10.1.0.{args.nodes % 256}"
+    leaver = nodes[args.nodes // 2]
+    stored = args.shards * args.replicas * args.shard_size
+    ideal = stored / (args.nodes + 1)  # What the joining node should end up holding
+
+    ring = HashRing(nodes, vnodes=args.vnodes, replicas=args.replicas)
+    joined = ring.copy()
+    joined.add(joiner)
+    left = ring.copy()
+    left.remove(leaver)
+
+    start = time.perf_counter()
+    loads = {}
+    for shard_id in shard_ids:
+        for node in ring.holders(shard_id):
+            loads[node] = loads.get(node, 0) + 1
+    lookup = (time.perf_counter() - start) / args.shards
+
+    modulo = ModuloPlacement(nodes, args.replicas)
+    modulo_joined = ModuloPlacement(nodes + [joiner], args.replicas)
+    modulo_left = ModuloPlacement([node for node in nodes if node != leaver], args.replicas)
+
+    print(f"{args.nodes} nodes, {args.shards} shards x {args.replicas} replicas of {args.shard_size} B "
+          f"({stored / 1e6:.1f} MB stored)")
+    print(f"ring: {args.vnodes} vnodes/node, max/mean load {max(loads.values()) * len(loads) / sum(loads.values()):.2f}, "
+          f"lookup {lookup * 1e6:.1f} us")
+    print(f"{'':>8} {'join MB':>10} {'join %':>8} {'leave MB':>10} {'leave %':>8}")
+    for name, before, after_join, after_leave in (('ring', ring, joined, left),
+                                                  ('modulo', modulo, modulo_joined, modulo_left)):
+        join = moved_bytes(before, after_join, shard_ids, args.shard_size)
+        leave = moved_bytes(before, after_leave, shard_ids, args.shard_size)
+        print(f"{name:>8} {join / 1e6:>10.2f} {100 * join / stored:>7.1f}% "
+              f"{leave / 1e6:>10.2f} {100 * leave / stored:>7.1f}%")
+    print(f"ideal join: {ideal / 1e6:.2f} MB ({100 / (args.nodes + 1):.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+'''
+Loopback benchmark of the pong responder: how many pings a second the batched
+Probe.PongResponder answers, against the blocking Protocols.Pong loop.
+
+Several client sockets blast probes at the responder on loopback and count the
+pongs that come back.
+
+Usage: python Benchmarks/pong_throughput.py [--seconds S] [--clients N]
+'''
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Session_Layer'))
+import Probe  # noqa: E402
+import Protocols  # noqa: E402
+
+
+class _Bind:
+    # Stand-in for the node Protocols.Pong reads its bind address from
+    ip = '127.0.0.1'
+
+
+def blast(port, seconds, clients, in_flight=64):
+    # Keeps `in_flight` probes outstanding per client socket and counts the pongs
+    counts = [0] * clients
+
+    def client(slot):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(0.2)
+        probe = Probe.PING + Probe.PROBE.pack(slot, 0.0)
+        for _ in range(in_flight):
+            sock.sendto(probe, ('127.0.0.1', port))
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                sock.recv(64)
+            except socket.timeout:
+                for _ in range(in_flight):  # Lost some to a full buffer; refill the pipeline
+                    sock.sendto(probe, ('127.0.0.1', port))
+                continue
+            counts[slot] += 1
+            sock.sendto(probe, ('127.0.0.1', port))
+        sock.close()
+
+    threads = [threading.Thread(target=client, args=(slot,)) for slot in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_batched_responder(port):
+    responder = Probe.PongResponder('127.0.0.1', port, lambda: (1 << 30, 1000, 0))
+    threading.Thread(target=responder.serve_forever, daemon=True).start()
+
+
+def run_blocking_responder(port):
+    threading.Thread(target=Protocols.Pong, args=(_Bind(), port), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--clients', type=int, default=4)
+    args = parser.parse_args()
+
+    for name, start in (('batched PongResponder', run_batched_responder), ('blocking Protocols.Pong', run_blocking_responder)):
+        port = free_port()
+        start(port)
+        time.sleep(0.2)
+        rate = blast(port, args.seconds, args.clients)
+        print(f"{name:>24}: {rate:>10,.0f} pongs/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+'''
+Large-scale simulation of the Session_Layer and Distributor logic: thousands of
+Nodes in one process on Distributor.Simulator's simulated network, to measure
+what only shows up at scale.
+
+Reports, in simulated time:
+  - routing table size and nodes queried per lookup after bootstrap
+  - ping overhead (probe datagrams per node per second)
+  - failure detection: time until every node that knew a crashed node has dropped it
+  - gossip convergence of a tail update, and of a head update across a healed partition
+  - shard placement balance over the live nodes, and how many shards the crashes moved
+
+Usage: python Benchmarks/simulate_network.py [--nodes N] [--k K] [--latency-ms MS] [--loss P] [--crash FRACTION] [--shards N] [--seed S]
+'''
+import argparse
+import importlib
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Distributor imports Session_Layer relative to the repository package, and Node_Struct imports its siblings directly
+sys.path[:0] = [os.path.dirname(ROOT), os.path.join(ROOT, 'Session_Layer')]
+Simulator = importlib.import_module(os.path.basename(ROOT) + '.Distributor.Simulator')
+
+
+def run_until(sim, condition, limit, step=0.1):
+    # Advances simulated time until condition() holds; returns the seconds it took, or None
+    start = sim.network.now
+    while sim.network.now - start < limit:
+        sim.network.run(until=sim.network.now + step)
+        if condition():
+            return sim.network.now - start
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--k', type=int, default=8, help='routing table bucket size')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='mean one-way latency')
+    parser.add_argument('--loss', type=float, default=0.01)
+    parser.add_argument('--crash', type=float, default=0.01, help='fraction of nodes to crash')
+    parser.add_argument('--warmup', type=float, default=5.0, help='simulated seconds of probing before measuring')
+    parser.add_argument('--shards', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    network = Simulator.SimNetwork(latency=args.latency_ms / 1000, jitter=args.latency_ms / 2000,
+                                   loss=args.loss, seed=args.seed)
+    started = time.perf_counter()
+    sim = Simulator.Simulation(args.nodes, network, k=args.k, seed=args.seed)
+    sim.bootstrap()
+    built = time.perf_counter() - started
+    print(f"{args.nodes} nodes, k={args.k}, {args.latency_ms} ms latency, {args.loss:.0%} loss: built in {built:.1f} s")
+    print(f"routing table: {statistics.mean(len(node.routing) for node in sim.nodes.values()):.1f} contacts, "
+          f"lookup: {sim.lookup_hops / sim.lookups:.1f} nodes queried")
+
+    sim.start_probing()
+    sim.start_gossip()
+    sim.network.run(until=args.warmup)
+
+    # Ping overhead over a steady second
+    probes, messages, started = sim.probes, network.messages, time.perf_counter()
+    sim.network.run(until=args.warmup + 1)
+    ping_rate = (sim.probes - probes) * 2 / args.nodes  # A ping and its pong
+    message_rate = (network.messages - messages) / args.nodes
+    step_time = time.perf_counter() - started
+
+    # Failure detection
+    ring = sim.placement()
+    ips = list(sim.nodes)
+    crashed = sim.random.sample(ips, max(1, int(args.nodes * args.crash)))
+    for ip in crashed:
+        network.crash(ip)
+    watchers = {ip: [node for node in sim.nodes.values() if ip in node.routing and network.is_up(node.ip)]
+                for ip in crashed}
+    detected = {}
+
+    def all_dropped():
+        for ip in crashed:
+            if ip not in detected and not any(ip in node.routing for node in watchers[ip]):
+                detected[ip] = network.now - crash_time
+        return len(detected) == len(crashed)
+
+    crash_time = network.now
+    run_until(sim, all_dropped, 60, step=0.25)
+
+    # Gossip convergence
+    tail = sim.random.choice([ip for ip in ips if network.is_up(ip)])
+    sim.publish(tail, 'tail', tail)
+    converged = run_until(sim, lambda: sim.converged('tail', tail) == 1.0, 60)
+
+    live = [ip for ip in ips if network.is_up(ip)]
+    half = set(live[:len(live) // 2])
+    network.partition(half)
+    head = live[0]
+    sim.publish(head, 'head', head)
+    sim.network.run(until=network.now + 5)
+    split = sim.converged('head', head)
+    network.heal()
+    healed = run_until(sim, lambda: sim.converged('head', head) == 1.0, 60)
+    gossip_messages = sum(gossip.messages_sent for gossip in sim.gossip.values()) / args.nodes / network.now
+
+    print(f"ping overhead: {ping_rate:.1f} datagrams/node/s ({message_rate:.1f} incl. gossip), "
+          f"{step_time:.1f} s wall per simulated second")
+    delays = sorted(detected.values())
+    if delays:
+        print(f"failure detection ({len(crashed)} crashed): median {statistics.median(delays):.1f} s, "
+              f"max {delays[-1]:.1f} s, {len(crashed) - len(delays)} still known after 60 s")
+    print(f"gossip: tail reached every live node in {_seconds(converged)}, "
+          f"{gossip_messages:.1f} messages/node/s on average")
+    print(f"partition: head reached {split:.0%} of live nodes while split, all of them {_seconds(healed)} after healing")
+
+    shard_ids = [f"{sim.random.getrandbits(256):064x}" for _ in range(args.shards)]
+    loads = dict.fromkeys(ring.nodes, 0)
+    for shard_id in shard_ids:
+        for holder in ring.holders(shard_id):
+            loads[holder] += 1
+    after = sim.placement()
+    moved = len(ring.moves(shard_ids, after))
+    print(f"placement: largest node load {max(loads.values()) / statistics.mean(loads.values()):.2f}x the mean, "
+          f"crashes moved {moved / len(shard_ids):.1%} of shards")
+
+
+def _seconds(value):
+    return 'never (60 s limit)' if value is None else f"{value:.1f} s"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+'''
+Benchmark suite: throughput and peak memory of every stage of the pipeline,
+across file sizes, shard sizes and worker counts, written out as JSON so runs
+on two commits can be compared.
+
+Stages:
+  encoder     Encoder.encode_block / decode_block over the file's blocks (MB/s)
+  encryption  Encryption.encrypt_block / decrypt_block over the file's blocks (MB/s)
+  sharding    Sharding.shard_data and reconstruct_data (MB/s)
+  upload      Main.Upload_Stream end to end, per shard size and worker count (MB/s)
+  download    Main.Download_Stream end to end, per shard size and worker count (MB/s)
+  send_shard  DataChain.send_shards to DataChain.serve_transfers on loopback (shards/s, MB/s)
+  ping        Protocols.Ping to Protocols.Pong on loopback (pings/s)
+
+Every case runs in a fresh interpreter, so its peak RSS (from resource.getrusage)
+is its own; workers started by the case are reported separately. The time kept
+is the best of --repeat runs. Test data is generated from --seed and mixes
+compressible text-like blocks with random ones, unless --data says otherwise.
+
+Usage: python Benchmarks/suite.py [--stages S,S,...] [--file-sizes MIB,...] [--shard-sizes BYTES,...]
+                                  [--workers N,...] [--data mixed|text|random] [--repeat N]
+                                  [--output results.json] [--compare baseline.json] [--threshold FRACTION]
+'''
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# File_Processor and Session_Layer modules import their siblings directly; Distributor imports
+# Session_Layer relative to the repository package
+sys.path[:0] = [os.path.join(ROOT, 'File_Processor'), os.path.join(ROOT, 'Session_Layer'), os.path.dirname(ROOT)]
+import Encoder  # noqa: E402
+import Encryption  # noqa: E402
+import Main  # noqa: E402
+import Protocols  # noqa: E402
+import Sharding  # noqa: E402
+
+STAGES = ('encoder', 'encryption', 'sharding', 'upload', 'download', 'send_shard', 'ping')
+MIB = 1024 * 1024
+
+
+def make_data(size, kind, seed):
+    # Deterministic test data; 'mixed' alternates text-like and random 1 MiB pieces
+    rng = np.random.default_rng(seed)
+    if kind == 'random':
+        return rng.bytes(size)
+    text = (rng.integers(0, 16, size, dtype=np.uint8) + ord('a')).tobytes()  # About 4 bits of entropy per byte
+    if kind == 'text':
+        return text
+    pieces = bytearray(text)
+    for start in range(MIB, size, 2 * MIB):
+        end = min(start + MIB, size)
+        pieces[start:end] = rng.bytes(end - start)
+    return bytes(pieces)
+
+
+def best_of(repeat, run):
+    # Runs `run` (which returns the seconds it spent timing) `repeat` times; returns the fastest
+    return min(run() for _ in range(repeat))
+
+
+def bench_encoder(data, params, repeat):
+    blocks = [data[i: i + Encoder.DEFAULT_BLOCK_SIZE] for i in range(0, len(data), Encoder.DEFAULT_BLOCK_SIZE)]
+    encoded = []
+
+    def encode():
+        encoded.clear()
+        start = time.perf_counter()
+        encoded.extend(Encoder.encode_block(block, params['policy']) for block in blocks)
+        return time.perf_counter() - start
+
+    def decode():
+        start = time.perf_counter()
+        for codec, block in encoded:
+            Encoder.decode_block(codec, block)
+        return time.perf_counter() - start
+
+    encode_seconds = best_of(repeat, encode)
+    ratio = sum(len(block) for _, block in encoded) / len(data)
+    return [('encode', encode_seconds, len(data), len(blocks), {'ratio': round(ratio, 4)}),
+            ('decode', best_of(repeat, decode), len(data), len(blocks), {})]
+
+
+def bench_encryption(data, params, repeat):
+    key, nonce = Encryption.generate_symmetric_key(), Encryption.generate_nonce()
+    blocks = [data[i: i + Encoder.DEFAULT_BLOCK_SIZE] for i in range(0, len(data), Encoder.DEFAULT_BLOCK_SIZE)]
+    encrypted = [Encryption.encrypt_block(block, key, nonce, i) for i, block in enumerate(blocks)]
+
+    def encrypt():
+        start = time.perf_counter()
+        for i, block in enumerate(blocks):
+            Encryption.encrypt_block(block, key, nonce, i)
+        return time.perf_counter() - start
+
+    def decrypt():
+        start = time.perf_counter()
+        for i, block in enumerate(encrypted):
+            Encryption.decrypt_block(block, key, nonce, i)
+        return time.perf_counter() - start
+
+    return [('encrypt', best_of(repeat, encrypt), len(data), len(blocks), {}),
+            ('decrypt', best_of(repeat, decrypt), len(data), len(blocks), {})]
+
+
+def bench_sharding(data, params, repeat):
+    shard_size = params['shard_size']
+    shards = Sharding.shard_data(data, shard_size)
+
+    def shard():
+        start = time.perf_counter()
+        Sharding.shard_data(data, shard_size)
+        return time.perf_counter() - start
+
+    def reconstruct():
+        start = time.perf_counter()
+        Sharding.reconstruct_data(shards)
+        return time.perf_counter() - start
+
+    return [('shard', best_of(repeat, shard), len(data), len(shards), {}),
+            ('reconstruct', best_of(repeat, reconstruct), len(data), len(shards), {})]
+
+
+def bench_upload(data, params, repeat):
+    key = Encryption.generate_symmetric_key()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input')
+        with open(path, 'wb') as f:
+            f.write(data)
+        count = [0]
+
+        def upload():
+            start = time.perf_counter()
+            count[0] = sum(1 for _ in Main.Upload_Stream(path, key, shard_size=params['shard_size'],
+                                                         workers=params['workers']))
+            return time.perf_counter() - start
+
+        return [('upload', best_of(repeat, upload), len(data), count[0], {})]
+
+
+def bench_download(data, params, repeat):
+    key = Encryption.generate_symmetric_key()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input')
+        with open(path, 'wb') as f:
+            f.write(data)
+        shards = list(Main.Upload_Stream(path, key, shard_size=params['shard_size'], workers=params['workers']))
+        output = os.path.join(directory, 'output')
+
+        def download():
+            start = time.perf_counter()
+            Main.Download_Stream(shards, key, output, workers=params['workers'])
+            return time.perf_counter() - start
+
+        seconds = best_of(repeat, download)
+        with open(output, 'rb') as f:
+            if f.read() != data:
+                raise AssertionError("Download did not restore the file")
+        return [('download', seconds, len(data), len(shards), {})]
+
+
+def bench_send_shard(data, params, repeat):
+    Data_Chain = importlib.import_module(os.path.basename(ROOT) + '.Distributor.Data_Chain')
+    Shard_Store = importlib.import_module(os.path.basename(ROOT) + '.Session_Layer.Shard_Store')
+
+    server = Data_Chain.DataChain('127.0.0.1', Shard_Store.ShardStore())
+    server.Transfer_Port = _free_port(socket.SOCK_STREAM)
+    server.serve_transfers()
+    client = Data_Chain.DataChain('127.0.0.1')
+    client.Transfer_Port = server.Transfer_Port
+
+    shards = {Shard_Store.ShardStore.shard_id(shard): bytes(shard)
+              for shard in Sharding.shard_data(data, params['shard_size'])}
+
+    def send():
+        server.transport.store = Shard_Store.ShardStore()  # Empty, so no shard is skipped as already held
+        start = time.perf_counter()
+        client.send_shards('127.0.0.1', shards)
+        return time.perf_counter() - start
+
+    try:
+        return [('send_shard', best_of(repeat, send), sum(map(len, shards.values())), len(shards), {})]
+    finally:
+        client.close()
+        server.close()
+
+
+def bench_ping(data, params, repeat):
+    port = _free_port(socket.SOCK_DGRAM)
+    threading.Thread(target=Protocols.Pong, args=(types.SimpleNamespace(ip='127.0.0.1'), port), daemon=True).start()
+    time.sleep(0.1)  # Pong has no way to say it is bound
+
+    def ping():
+        start = time.perf_counter()
+        for _ in range(params['pings']):
+            if not Protocols.Ping('127.0.0.1', port):
+                raise AssertionError("Ping got no pong")
+        return time.perf_counter() - start
+
+    return [('ping', best_of(repeat, ping), 0, params['pings'], {})]
+
+
+BENCHES = {
+    'encoder': bench_encoder,
+    'encryption': bench_encryption,
+    'sharding': bench_sharding,
+    'upload': bench_upload,
+    'download': bench_download,
+    'send_shard': bench_send_shard,
+    'ping': bench_ping,
+}
+
+
+def cases(args):
+    # Every (stage, params) to run; stages only vary over the parameters that matter to them
+    for stage in args.stages:
+        if stage == 'encoder':
+            for file_size in args.file_sizes:
+                yield stage, {'file_size': file_size, 'data': args.data, 'policy': args.policy}
+        elif stage == 'encryption':
+            for file_size in args.file_sizes:
+                yield stage, {'file_size': file_size, 'data': args.data}
+        elif stage == 'sharding':
+            for file_size, shard_size in itertools.product(args.file_sizes, args.shard_sizes):
+                yield stage, {'file_size': file_size, 'data': args.data, 'shard_size': shard_size}
+        elif stage in ('upload', 'download'):
+            for file_size, shard_size, workers in itertools.product(args.file_sizes, args.shard_sizes, args.workers):
+                yield stage, {'file_size': file_size, 'data': args.data, 'shard_size': shard_size, 'workers': workers}
+        elif stage == 'send_shard':
+            for shard_size in args.shard_sizes:
+                yield stage, {'shard_size': shard_size, 'shards': args.shards}
+        elif stage == 'ping':
+            yield stage, {'pings': args.pings}
+
+
+def run_case(stage, params, repeat, seed, connection):
+    # Child process body: generates the data, runs the stage and sends back its results
+    size = params['file_size'] * MIB if 'file_size' in params else params.get('shards', 0) * params.get('shard_size', 0)
+    data = make_data(size, params.get('data', 'random'), seed)
+    baseline = _max_rss(resource.RUSAGE_SELF)
+    measurements = BENCHES[stage](data, params, repeat)
+    connection.send({
+        'measurements': measurements,
+        'baseline_rss_mb': baseline,
+        'peak_rss_mb': _max_rss(resource.RUSAGE_SELF),
+        'workers_peak_rss_mb': _max_rss(resource.RUSAGE_CHILDREN),
+    })
+    connection.close()
+
+
+def run(stage, params, repeat, seed):
+    # Runs one case in a fresh interpreter and returns its result records
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_case, args=(stage, params, repeat, seed, sender))
+    process.start()
+    sender.close()
+    try:
+        outcome = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"{stage} {params} failed (exit code {process.exitcode})")
+    process.join()
+
+    records = []
+    for operation, seconds, size, count, extra in outcome['measurements']:
+        records.append({
+            'stage': stage,
+            'operation': operation,
+            'params': params,
+            'seconds': seconds,
+            'mb_per_s': size / seconds / 1e6 if size else None,
+            'ops_per_s': count / seconds,
+            'baseline_rss_mb': outcome['baseline_rss_mb'],
+            'peak_rss_mb': outcome['peak_rss_mb'],
+            'workers_peak_rss_mb': outcome['workers_peak_rss_mb'],
+            **extra,
+        })
+    return records
+
+
+def case_key(record):
+    params = ','.join(f"{name}={value}" for name, value in sorted(record['params'].items()))
+    return f"{record['stage']}.{record['operation']}[{params}]"
+
+
+def compare(records, baseline_path, threshold):
+    # Prints each case's throughput against the baseline run; returns how many regressed
+    with open(baseline_path) as f:
+        baseline = {case_key(record): record for record in json.load(f)['results']}
+    regressions = 0
+    print(f"\ncompared with {baseline_path}")
+    for record in records:
+        before = baseline.get(case_key(record))
+        if before is None:
+            continue
+        change = record['ops_per_s'] / before['ops_per_s'] - 1
+        slower = change < -threshold
+        regressions += slower
+        print(f"{case_key(record):<90}{change:>+9.1%}{'  REGRESSION' if slower else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--file-sizes', default='4,32', help='MiB')
+    parser.add_argument('--shard-sizes', default='1024,65536', help='bytes')
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}")
+    parser.add_argument('--data', default='mixed', choices=('mixed', 'text', 'random'))
+    parser.add_argument('--policy', default=Encoder.DEFAULT_POLICY, choices=Encoder.POLICIES)
+    parser.add_argument('--shards', type=int, default=2000, help='shards sent per send_shard case')
+    parser.add_argument('--pings', type=int, default=2000, help='pings per ping case')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='an earlier --output file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown that counts as a regression')
+    args = parser.parse_args()
+    args.stages = [stage for stage in args.stages.split(',') if stage]
+    for stage in args.stages:
+        if stage not in BENCHES:
+            parser.error(f"unknown stage {stage!r}; choose from {', '.join(STAGES)}")
+    args.file_sizes = [int(size) for size in args.file_sizes.split(',')]
+    args.shard_sizes = [int(size) for size in args.shard_sizes.split(',')]
+    args.workers = sorted({int(workers) for workers in args.workers.split(',')})
+
+    records = []
+    print(f"{'case':<90}{'MB/s':>10}{'ops/s':>12}{'peak RSS MB':>13}")
+    for stage, params in cases(args):
+        for record in run(stage, params, args.repeat, args.seed):
+            records.append(record)
+            mb_per_s = '-' if record['mb_per_s'] is None else f"{record['mb_per_s']:.1f}"
+            print(f"{case_key(record):<90}{mb_per_s:>10}{record['ops_per_s']:>12,.0f}{record['peak_rss_mb']:>13.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'commit': _commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'results': records,
+        }, f, indent=2)
+    print(f"\nwrote {len(records)} results to {args.output}")
+
+    if args.compare and compare(records, args.compare, args.threshold):
+        sys.exit(1)
+
+
+def _max_rss(who):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (MIB if sys.platform == 'darwin' else 1024)
+
+
+def _free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    main()
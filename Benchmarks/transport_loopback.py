@@ -0,0 +1,87 @@
+'''
+Loopback benchmark of shard transfer: the asyncio transport (pooled connections,
+batched and pipelined frames) against one TCP connection per shard, which is
+what DataChain did before it sent through the transport.
+
+Reports shards/s and MB/s for each.
+
+Usage: python Benchmarks/transport_loopback.py [--shards N] [--shard-size BYTES] [--window N] [--batch-bytes N]
+'''
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Distributor.Transport import ShardTransport  # noqa: E402
+from Session_Layer.Shard_Store import ShardStore  # noqa: E402
+
+
+async def transport_run(shards, window, batch_bytes):
+    # Sends every shard through the transport to a server on loopback
+    server = ShardTransport(ShardStore())
+    await server.start_server('127.0.0.1', 0)
+    client = ShardTransport(window=window, batch_bytes=batch_bytes)
+
+    start = time.perf_counter()
+    await client.send_shards('127.0.0.1', server.server_port, shards)
+    elapsed = time.perf_counter() - start
+
+    await client.close()
+    await server.close()
+    return elapsed
+
+
+def per_connection_run(shards):
+    # Opens a new connection for every shard, the baseline the transport replaced
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    port = listener.getsockname()[1]
+
+    def serve():
+        for _ in shards:
+            conn, _ = listener.accept()
+            with conn:
+                while conn.recv(65536):
+                    pass
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+
+    start = time.perf_counter()
+    for shard in shards:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
+            client_socket.connect(('127.0.0.1', port))
+            client_socket.sendall(shard)
+    server.join()
+    elapsed = time.perf_counter() - start
+    listener.close()
+    return elapsed
+
+
+def report(name, count, size, elapsed):
+    print(f"{name:<24}{count / elapsed:>14,.0f} shards/s{count * size / elapsed / 1e6:>12,.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=20000)
+    parser.add_argument('--shard-size', type=int, default=1024)
+    parser.add_argument('--window', type=int, default=32)
+    parser.add_argument('--batch-bytes', type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    shards = [os.urandom(args.shard_size) for _ in range(args.shards)]
+    report("asyncio transport", len(shards), args.shard_size,
+           asyncio.run(transport_run(shards, args.window, args.batch_bytes)))
+
+    sample = shards[:min(len(shards), 2000)]  # One handshake per shard is slow, time a sample
+    report("connection per shard", len(sample), args.shard_size, per_connection_run(sample))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,96 @@
+import asyncio
+import logging
 import socket
-from ..Session_Layer.Node_Struct import Node
+import threading
+import time
+from ..Session_Layer.Metrics import Registry
+from .Gossip import Gossip
+from .Placement import HashRing
+from .Replication import STORED, ChainReplicator
+from .Transport import ShardTransport, TransportError
+
+logger = logging.getLogger(__name__)
 
 class DataChain:
-    def __init__(self, ip):
+    def __init__(self, ip, store=None, metrics=None, node=None):
         """
         Initialize the DataChain instance.
 
         :param ip: The IP address of this node.
+        :param store: The node's ShardStore, which incoming shards are written to.
+        :param metrics: The Metrics.Registry to record into, e.g. the node's `metrics`; a new one by default.
+        :param node: The Session_Layer Node running alongside, whose health table picks the next alive node.
         """
         self.ip = ip  # IP address of this node
-        self.next = Node.get_next_alive(self)  # Find the next alive node in the chain
+        self.store = store  # Content-addressed store for the shards this node holds
+        self.node = node
+        self.next = node.get_next_alive() if node is not None else None  # Find the next alive node in the chain
         self.Chain_Port = 5003  # Port for chain communication
-        self.Tail_Port = 5004  # Port for tail updates
+        self.Transfer_Port = 5006  # Port for shard transfers and has-shards queries, over pooled connections
+        self.Gossip_Port = 5007  # UDP port for head, tail and membership gossip
+        self.Replication_Port = 5008  # Port for chain-replicated shard writes
+        self.replicator = ChainReplicator(store)  # Relays replicated shards down the chain, storing them here
+        self.transport = ShardTransport(store)  # Asyncio transfer engine, serving from and into the store
+        self.placement = HashRing([ip])  # Which nodes hold which shard, computed from the membership alone
         self.Head = self.ip  # Initially set this node as the head
         self.isHead = False  # Indicates if this node is the head of the chain
         self.prev = None  # Previous node in the chain
         self.tail = None  # Tail node in the chain
+        self.members = set()  # IPs of the nodes in the chain, as learned through gossip
+        # Spreads head, tail and membership changes to every node in O(log n) rounds
+        self.gossip = Gossip(ip, self.gossip_peers, port=self.Gossip_Port, on_change=self._apply_gossip)
+        self._loop = None  # Event loop running self.transport, so its pooled connections outlive each call
+        self._loop_lock = threading.Lock()
+        self._rebalance_lock = threading.Lock()  # One membership change is handed over at a time
+        self.init_metrics(metrics)
+
+    def init_metrics(self, metrics=None):
+        """
+        Register this chain's metrics: batch send latency, plus the counters the transport,
+        replicator and gossip already keep, which are only read at scrape time.
+
+        :param metrics: The Metrics.Registry to record into; a new one if None.
+        """
+        self.metrics = metrics if metrics is not None else Registry()
+        self.shard_send_time = self.metrics.histogram(
+            'shard_batch_send_seconds', 'Time for send_shards to query a batch, send what is missing and get it acked')
+        self.shards_sent = self.metrics.counter('shards_sent_total', 'Shards sent with send_shards')
+        for name, owner, attribute in (('transport_shards_sent_total', 'transport', 'shards_sent'),
+                                       ('transport_bytes_sent_total', 'transport', 'bytes_sent'),
+                                       ('transport_shards_received_total', 'transport', 'shards_received'),
+                                       ('transport_bytes_received_total', 'transport', 'bytes_received'),
+                                       ('transport_shards_rejected_total', 'transport', 'shards_rejected'),
+                                       ('replication_shards_stored_total', 'replicator', 'shards_stored'),
+                                       ('replication_bytes_forwarded_total', 'replicator', 'bytes_forwarded'),
+                                       ('gossip_messages_sent_total', 'gossip', 'messages_sent'),
+                                       ('gossip_updates_applied_total', 'gossip', 'updates_applied')):
+            self.metrics.counter(name, function=lambda owner=owner, attribute=attribute:
+                                 getattr(getattr(self, owner, None), attribute, 0))
 
     def fetch_and_set_next(self):
         """
         Handle requests to fetch and set the next node.
 
-        This method listens for incoming connections on `Chain_Port`. When a connection
-        is received, it sends this node's IP and the head node's IP to the next node
-        and updates `self.next` with the next alive node.
+        This method listens for incoming connections on `Chain_Port` until the program
+        exits. When a FETCH_NEXT request is received, it sends this node's IP and the
+        head node's IP to the next node and updates `self.next` with the next alive node.
+        On the head, SEND_NEXT_TO_HEAD requests on the same port are answered too.
         """
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             server_socket.bind((self.ip, self.Chain_Port))  # Bind to the chain port
             server_socket.listen(5)  # Listen for incoming connections
-            conn, addr = server_socket.accept()  # Accept a connection
-            with conn:
-                data = conn.recv(1024).decode()  # Receive data from the client
-                if data == "FETCH_NEXT":  # Check if the request is to fetch the next node
-                    next_node = Node.get_next_alive(self)  # Get the next alive node
-                    conn.sendall(f"{self.ip},{self.Head}".encode())  # Send back IP and Head
-                    self.next = next_node  # Update the next node
+            while True:
+                conn, addr = server_socket.accept()  # Accept a connection
+                with conn:
+                    data = conn.recv(1024).decode()  # Receive data from the client
+                    if data == "FETCH_NEXT":  # Check if the request is to fetch the next node
+                        # Get the next alive node
+                        next_node = self.node.get_next_alive() if self.node is not None else None
+                        conn.sendall(f"{self.ip},{self.Head}".encode())  # Send back IP and Head
+                        self.next = next_node  # Update the next node
+                    elif data == "SEND_NEXT_TO_HEAD" and self.isHead and self.next is not None:
+                        conn.sendall(self.next.encode())  # Send the next node's IP
 
     def get_and_set_attribute(self, ip, head_ip):
         """
@@ -50,18 +106,11 @@ class DataChain:
         """
         Listen for requests to send the next node's IP to the head.
 
-        This method is active only if `self.isHead` is True. It listens on `Chain_Port`
-        for incoming requests and sends back the next node's IP.
+        This method is active only if `self.isHead` is True. Both kinds of chain request
+        share `Chain_Port`, so it runs the same long-lived listener as `fetch_and_set_next`.
         """
         if self.isHead:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-                server_socket.bind((self.ip, self.Chain_Port))  # Bind to the chain port
-                server_socket.listen(5)  # Listen for incoming connections
-                conn, addr = server_socket.accept()  # Accept a connection
-                with conn:
-                    data = conn.recv(1024).decode()  # Receive data from the client
-                    if data == "SEND_NEXT_TO_HEAD":  # Check if the request is valid
-                        conn.sendall(self.next.encode())  # Send the next node's IP
+            self.fetch_and_set_next()
 
     def send_next_to_head(self):
         """
@@ -73,52 +122,226 @@ class DataChain:
             client_socket.connect((self.Head, self.Chain_Port))  # Connect to the head
             client_socket.sendall("SEND_NEXT_TO_HEAD".encode())  # Request next IP
             response = client_socket.recv(1024).decode()  # Receive the response
-            print(f"Received next IP from head: {response}")  # Print the received IP
+            logger.info("Received next IP from head: %s", response)
 
-    def send_shard(self, target_ip, shard_data):
+    def send_shards(self, target_ip, shards):
         """
-        Send shard data to a specific IP.
+        Send a batch of shards, skipping the ones the target already holds.
+
+        One has-shards query covers the whole batch. The target takes a reference to
+        every shard it already has, so skipping them is as safe as sending them. The rest
+        go out in pipelined batches over the pooled connection (see Transport.ShardTransport).
 
         :param target_ip: IP address of the target node.
-        :param shard_data: Data to be sent as a shard.
+        :param shards: A dict mapping shard IDs to shard data.
+        :return: The IDs of the shards that actually had to be sent.
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-            client_socket.connect((target_ip, self.Chain_Port))  # Connect to the target node
-            client_socket.sendall(shard_data.encode())  # Send the shard data
+        start = time.perf_counter()
+        held = set(self.query_has_shards(target_ip, list(shards), claim=True))
+        missing = [shard_data for shard_id, shard_data in shards.items() if shard_id not in held]
+        sent = self._run(self.transport.send_shards(target_ip, self.Transfer_Port, missing)) if missing else []
+        self.shard_send_time.observe(time.perf_counter() - start)
+        self.shards_sent.inc(len(sent))
+        return sent
+
+    def place_shards(self, shards, alive=None):
+        """
+        Send a batch of shards to the nodes the placement ring assigns them to.
+
+        :param shards: A dict mapping shard IDs to shard data.
+        :param alive: Optional predicate on a node IP; nodes it rejects are passed over for the next ones on the ring.
+        :return: A dict mapping each shard ID to the IPs now holding it.
+        """
+        placed = {}
+        chains = {}  # Holders other than this node, in ring order -> shards to replicate down them
+        for shard_id, shard_data in shards.items():
+            placed[shard_id] = self.placement.holders(shard_id, alive=alive)
+            if self.ip in placed[shard_id]:
+                self.store.put(shard_data)
+            chain = tuple(holder for holder in placed[shard_id] if holder != self.ip)
+            if chain:
+                chains.setdefault(chain, []).append(shard_data)
+
+        for chain, batch in chains.items():
+            self.replicate_shards(list(chain), batch)
+        return placed
+
+    def replicate_shards(self, chain, shards):
+        """
+        Write shards to every node of a chain with chain replication.
+
+        The shards are streamed to the first node only; each node forwards them to the
+        next while still receiving them, and the tail's acknowledgement travels back up
+        (see Replication.ChainReplicator). This node's uplink carries each shard once,
+        however many replicas there are.
+
+        :param chain: IP addresses of the nodes to store the shards on, in chain order.
+        :param shards: A list of shards (bytes-like).
+        :return: The IDs of the shards, now stored on every node of the chain.
+        """
+        statuses = asyncio.run(self.replicator.replicate(
+            [(ip, self.Replication_Port) for ip in chain], shards))
+        failed = [shard_id for shard_id, status in statuses.items() if status != STORED]
+        if failed:
+            raise ConnectionError(f"{len(failed)} shards were not stored on every node of {chain}")
+        return list(statuses)
+
+    def rebalance(self, placement):
+        """
+        Switch to a new membership, handing the shards this node holds to the nodes that gain them.
+
+        Each shard goes with its reference count (see Transport.ShardTransport.hand_over), so
+        the new holders delete it after exactly as many releases as this node would have.
+        Once every gaining node has them, this node drops the shards it is no longer a
+        holder of. If a transfer fails, nothing is dropped and the old membership is kept.
+
+        :param placement: The HashRing after a node joined or left.
+        :return: A dict mapping each shard ID that changed hands to (nodes that gain it, nodes that lose it).
+        """
+        changes = self.placement.moves(self.store.shard_ids(), placement)
+        batches = {}  # Gaining node IP -> {shard ID: (shard, reference count)} to hand it
+        for shard_id, (gained, _) in changes.items():
+            for node in gained:
+                if node != self.ip:
+                    batches.setdefault(node, {})[shard_id] = (self.store.get(shard_id), self.store.ref_count(shard_id))
+
+        for node, batch in batches.items():
+            self._run(self.transport.hand_over(node, self.Transfer_Port, batch))
+        for shard_id, (_, lost) in changes.items():
+            if self.ip in lost:
+                self.store.remove(shard_id)  # Its references moved with it
+        self.placement = placement
+        return changes
+
+    def query_has_shards(self, target_ip, shard_ids, claim=False):
+        """
+        Ask a node which of a batch of shards it already holds.
+
+        :param target_ip: IP address of the target node.
+        :param shard_ids: The shard IDs to look up.
+        :param claim: If True, the target also takes a reference to every shard it holds.
+        :return: The IDs among `shard_ids` that the target holds.
+        """
+        return self._run(self.transport.has_shards(target_ip, self.Transfer_Port, shard_ids, claim))
+
+    def release_shards(self, target_ip, shard_ids):
+        """
+        Drop this upload's reference to a batch of shards on a node; the node deletes
+        a shard once nothing references it any more.
+
+        :param target_ip: IP address of the target node.
+        :param shard_ids: The shard IDs to release.
+        :return: The IDs of the shards the target deleted.
+        """
+        return self._run(self.transport.release_shards(target_ip, self.Transfer_Port, shard_ids))
+
+    def serve_replication(self):
+        """
+        Serve chain-replicated shard writes from the node upstream.
+
+        This method runs the relay on `Replication_Port` until the program exits,
+        storing every shard in `self.store` and forwarding it down the chain.
+        """
+        asyncio.run(self.replicator.serve(self.ip, self.Replication_Port))
+
+    def serve_transfers(self):
+        """
+        Serve pipelined shard transfers from other nodes.
+
+        This method starts the asyncio transfer engine on `Transfer_Port` and returns; it
+        keeps serving from the chain's event loop thread until close(). Shards go through
+        `self.transport` (see Transport.ShardTransport).
+        """
+        self._run(self.transport.start_server(self.ip, self.Transfer_Port))
+
+    def close(self):
+        """Close the transfer server and every pooled connection, and stop the event loop thread."""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.transport.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+    def _run(self, coroutine):
+        # Runs a transport coroutine on the chain's event loop thread, started on first use, and waits for it
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever)
+                thread.daemon = True  # Daemon thread: it will exit when the program exits
+                thread.start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
 
     def update_tail(self):
         """
-        Start the chain update process from the tail.
+        Announce this node as the new tail of the chain.
 
-        This method sends the tail node's IP to the previous node. Each node updates
-        its `tail` attribute upon receiving the message, and the process continues
-        until the head node is reached.
+        The tail IP is gossiped (see Gossip.Gossip) instead of being relayed back through
+        the chain one connection per hop, so it reaches every node in O(log n) rounds.
+        Each node updates its `tail` attribute when the news reaches it.
         """
         if self.tail is None:
-            print("This node is not the tail, skipping update process.")
+            logger.warning("This node is not the tail, skipping update process.")
             return
+        self.gossip.publish("tail", self.tail)
 
-        current_node = self
-        while current_node.prev:
-            # Send the tail IP to the previous node
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-                client_socket.connect((current_node.prev, self.Tail_Port))
-                client_socket.sendall(self.tail.encode())  # Send the tail IP
-                current_node = current_node.prev  # Move to the previous node
+    def announce_head(self):
+        """Announce this node as the head of the chain to every node."""
+        self.Head = self.ip
+        self.gossip.publish("head", self.ip)
 
-    def listen_for_tail_update(self):
-        """
-        Listen for incoming tail update messages.
+    def join(self):
+        """Announce that this node has joined the chain."""
+        self.gossip.publish(f"member:{self.ip}", True)
+
+    def leave(self):
+        """Announce that this node is leaving the chain."""
+        self.gossip.publish(f"member:{self.ip}", False)
 
-        This method listens on `Tail_Port` and updates the `self.tail` attribute
-        when a valid message is received.
+    def start_gossip(self):
+        """Start the long-lived gossip listener and anti-entropy threads on `Gossip_Port`."""
+        self.gossip.start(self.ip)
+
+    def gossip_peers(self):
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-            server_socket.bind((self.ip, self.Tail_Port))  # Bind to the tail update port
-            server_socket.listen(5)  # Listen for incoming connections
-            while True:
-                conn, addr = server_socket.accept()  # Accept a connection
-                with conn:
-                    data = conn.recv(1024).decode()  # Receive the tail update message
-                    self.tail = data  # Update the tail attribute
-                    print(f"Tail updated to: {self.tail}")  # Log the updated tail
+        :return: The IPs to gossip with: every known member and the chain neighbours.
+        """
+        return list(self.members | {node for node in (self.prev, self.next, self.Head, self.tail) if node})
+
+    def _apply_gossip(self, key, value):
+        # Applies a head, tail or membership change that arrived through gossip
+        if key == "tail":
+            self.tail = value
+            logger.info("Tail updated to: %s", self.tail)
+        elif key == "head":
+            self.Head = value
+            self.isHead = value == self.ip
+        elif key.startswith("member:"):
+            ip = key[len("member:"):]
+            if value:
+                self.members.add(ip)
+            else:
+                self.members.discard(ip)
+            # Hand shards over on another thread, so the gossip listener is not held up by the transfers
+            thread = threading.Thread(target=self._rebalance_to_members)
+            thread.daemon = True  # Daemon thread: it will exit when the program exits
+            thread.start()
+
+    def _rebalance_to_members(self):
+        # Rebalances onto a ring of the current members. The ring is built from a copy, so rebalance() can
+        # diff it against the one in use, and a rebalance that fails is retried on the next membership change.
+        with self._rebalance_lock:
+            members = set(self.members)
+            if self.gossip.get(f"member:{self.ip}", True):  # Until this node announces it is leaving
+                members.add(self.ip)
+            placement = self.placement.copy()
+            for node in placement.nodes:
+                if node not in members:
+                    placement.remove(node)
+            for node in members:
+                placement.add(node)
+            try:
+                self.rebalance(placement)
+            except (TransportError, OSError) as e:
+                logger.warning("Rebalance onto %d members failed, keeping the old placement: %s", len(members), e)
@@ -0,0 +1,204 @@
+import asyncio
+from collections import deque
+
+from ..Session_Layer.Health import ALIVE, DEAD
+
+
+class ShardFetcher:
+    """
+    Fetches the shards of a file from their holders in parallel.
+
+    Replicas are tried in order of their recent latency. If a request takes
+    longer than the holder's usual high percentile, a hedged duplicate goes to
+    the next replica and whichever answers first wins, so one slow or dead node
+    no longer holds up a whole download. Each shard is handed to a sink as soon
+    as it arrives, e.g. `Sharding.ShardAssembler.write` to stream it into its
+    offset in the output buffer.
+
+    Shards held by the same nodes are asked for together, `batch_size` to a GET,
+    and only `concurrency` batches are in flight at a time, so a long manifest
+    costs neither one request nor one task per shard.
+    """
+
+    def __init__(self, transport, port=5006, concurrency=64, hedge_percentile=0.95,
+                 default_hedge_delay=0.05, history=64, health=None, batch_size=32):
+        """
+        :param transport: The Transport.ShardTransport to fetch through.
+        :param port: The holders' transfer port.
+        :param concurrency: How many batches to fetch at once.
+        :param hedge_percentile: Latency percentile of a holder after which a hedged request is sent.
+        :param default_hedge_delay: Hedge delay in seconds for holders with no latency history yet.
+        :param history: How many recent latencies to keep per holder.
+        :param health: A Health.HealthTable (e.g. Node.health); holders it reports as suspect or dead are tried last.
+        :param batch_size: The most shards to ask one holder for in one GET.
+        """
+        self.transport = transport
+        self.port = port
+        self.concurrency = concurrency
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.history = history
+        self.health = health
+        self.batch_size = batch_size
+        self._latencies = {}  # Holder IP -> deque of recent latencies in seconds
+        self._failures = {}  # Holder IP -> consecutive failed requests
+
+        # Counters
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.failures = 0
+
+    async def fetch(self, manifest, shard_table, sink):
+        """
+        Fetches every shard of a file.
+
+        :param manifest: The shard IDs of the file, in order.
+        :param shard_table: Maps each shard ID to the IPs of its holders (like Node.shard_table).
+        :param sink: Called as sink(index, shard) for every shard as it arrives, in any order.
+        :return: The indexes of the shards no holder could supply, in order (empty on success).
+        """
+        missing = []
+
+        async def fetch_batch(holders, batch):
+            shards = await self.fetch_batch(list(dict.fromkeys(shard_id for _, shard_id in batch)), holders)
+            for index, shard_id in batch:
+                shard = shards.get(shard_id)
+                if shard is None:
+                    missing.append(index)
+                else:
+                    sink(index, shard)
+
+        # Start batches as the manifest is read, never more than `concurrency` at once
+        running = set()
+        try:
+            for holders, batch in self._batches(manifest, shard_table):
+                if len(running) >= self.concurrency:
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()  # Raises what the sink raised
+                running.add(asyncio.ensure_future(fetch_batch(holders, batch)))
+            if running:
+                done, running = await asyncio.wait(running)
+                for task in done:
+                    task.result()
+        finally:
+            for task in running:
+                task.cancel()
+        return sorted(missing)
+
+    async def fetch_shard(self, shard_id, holders):
+        """
+        Fetches one shard, hedging across its holders.
+
+        :param shard_id: The shard ID.
+        :param holders: The IPs of the nodes holding it.
+        :return: The shard, or None if no holder supplied it.
+        """
+        return (await self.fetch_batch([shard_id], holders)).get(shard_id)
+
+    async def fetch_batch(self, shard_ids, holders):
+        """
+        Fetches shards held by the same nodes with one GET, hedging across the holders.
+        Shards the first holder lacks are asked for from the next one.
+
+        :param shard_ids: The shard IDs.
+        :param holders: The IPs of the nodes holding them.
+        :return: A dict of shard ID -> shard for the shards some holder supplied.
+        """
+        candidates = deque(self.rank(holders))
+        found = {}
+        running = {}  # Task -> holder
+        hedged = set()  # Tasks started as hedges
+        try:
+            while len(found) < len(shard_ids) and (candidates or running):
+                wanted = [shard_id for shard_id in shard_ids if shard_id not in found]
+                if candidates and not running:
+                    holder = candidates.popleft()
+                    running[self._start(holder, wanted)] = holder
+
+                # Wait for an answer, but only as long as the slowest running holder usually takes
+                delay = max(self.hedge_delay(holder) for holder in running.values()) if candidates else None
+                done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:  # Too slow, send a hedged duplicate to the next replica
+                    holder = candidates.popleft()
+                    task = self._start(holder, wanted)
+                    running[task] = holder
+                    hedged.add(task)
+                    self.hedges += 1
+                    continue
+
+                for task in done:
+                    running.pop(task)
+                    shards = task.result()
+                    if task in hedged and any(shard_id not in found for shard_id in shards):
+                        self.hedges_won += 1
+                    found.update(shards)
+            return found
+        finally:
+            for task in running:
+                task.cancel()
+
+    def rank(self, holders):
+        """
+        Orders holders from most to least promising.
+
+        :param holders: Holder IPs.
+        :return: The holders sorted by health (alive, suspect, dead), then by recent failures, then by
+                 recent median latency (holders with no history come right after those known to be fast).
+        """
+        def score(holder):
+            latencies = self._latencies.get(holder)
+            median = sorted(latencies)[len(latencies) // 2] if latencies else self.default_hedge_delay
+            state = self.health.state(holder) if self.health is not None else ALIVE
+            return (state == DEAD, state != ALIVE, self._failures.get(holder, 0), median)
+        return sorted(holders, key=score)
+
+    def hedge_delay(self, holder):
+        """
+        :param holder: A holder IP.
+        :return: Seconds to wait on the holder before hedging: its `hedge_percentile` latency.
+        """
+        latencies = self._latencies.get(holder)
+        if not latencies:
+            return self.default_hedge_delay
+        ordered = sorted(latencies)
+        return ordered[min(int(len(ordered) * self.hedge_percentile), len(ordered) - 1)]
+
+    def _batches(self, manifest, shard_table):
+        # Groups the manifest into (holders, [(index, shard ID), ...]) batches of shards on the same nodes
+        groups = {}
+        for index, shard_id in enumerate(manifest):
+            holders = tuple(sorted(shard_table.get(shard_id, ())))
+            group = groups.setdefault(holders, [])
+            group.append((index, shard_id))
+            if len(group) >= self.batch_size:
+                yield holders, groups.pop(holders)
+        yield from groups.items()
+
+    def _start(self, holder, shard_ids):
+        self.requests += 1
+        return asyncio.ensure_future(self._request(holder, shard_ids))
+
+    async def _request(self, holder, shard_ids):
+        # One GET to one holder; records its latency, returns the shards it had (none if it failed)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            shards = await self.transport.get_shards(holder, self.port, shard_ids)
+        except Exception:  # Refused or dropped connections, bad replies, anything else from the transport
+            self._failures[holder] = self._failures.get(holder, 0) + 1
+            self.failures += 1
+            return {}
+        except asyncio.CancelledError:
+            # Lost to a faster replica; it took at least this long, which still ranks it as slow
+            self._record(holder, loop.time() - start)
+            raise
+
+        self._record(holder, loop.time() - start)
+        self._failures.pop(holder, None)
+        return shards
+
+    def _record(self, holder, latency):
+        self._latencies.setdefault(holder, deque(maxlen=self.history)).append(latency)
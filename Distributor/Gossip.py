@@ -0,0 +1,268 @@
+import json
+import math
+import random
+import socket
+import threading
+import time
+import zlib
+
+
+class Gossip:
+    """
+    Spreads small pieces of chain metadata (head, tail, membership) to every node.
+
+    Each entry carries a version, (timestamp, origin), and the newest version of a
+    key wins everywhere. A fresh update is pushed right away to `fanout` random
+    peers, and each of those that had not seen it passes it on the same way
+    (rumour mongering), so it reaches all n nodes in O(log n) rounds instead of
+    walking the chain hop by hop. On top of that, every `interval` seconds the node
+    swaps digests with one random peer and each side sends the other whatever it
+    is missing (push-pull anti-entropy), which repairs anything a lost datagram or
+    a restart left behind.
+
+    Every message fits in one datagram of `max_datagram` bytes. A digest too big for
+    one is split by a hash of the keys into parts, and each round offers one part
+    picked at random, so a large membership is compared piece by piece over several
+    rounds. Deltas and rumours are split into as many messages as they need.
+
+    The protocol logic (`set`, `round`, `handle`) only returns the messages to send,
+    as (IP, message) pairs; `start` runs it over UDP with long-lived threads, and a
+    simulator can deliver the messages itself.
+    """
+
+    def __init__(self, origin, peers, fanout=3, interval=1.0, port=5007, on_change=None, rng=None,
+                 max_datagram=1400):
+        """
+        :param origin: This node's IP, used to break ties between versions.
+        :param peers: Called with no arguments; returns the IPs to gossip with (e.g. `lambda: node.neighbour`).
+        :param fanout: How many peers a fresh update is pushed to.
+        :param interval: Seconds between anti-entropy rounds.
+        :param port: The UDP port gossip listens on.
+        :param on_change: Called as on_change(key, value) whenever an entry is created or replaced.
+        :param rng: The random.Random that picks peers; a fresh one if None (a simulator passes a seeded one).
+        :param max_datagram: Encoded size messages are kept to, in bytes; about one Ethernet MTU by default.
+        """
+        self.origin = origin
+        self.peers = peers
+        self.fanout = fanout
+        self.interval = interval
+        self.port = port
+        self.on_change = on_change
+        self.max_datagram = max_datagram
+        self.random = rng if rng is not None else random.Random()
+        self.lock = threading.Lock()
+        self._entries = {}  # Key -> [timestamp, origin, value]
+        self.running = False
+        self.sock = None
+        self._pending = []  # Messages published before start(), sent once the socket is open
+
+        # Counters
+        self.messages_sent = 0
+        self.updates_applied = 0
+
+    def set(self, key, value):
+        """
+        Records a new value and starts spreading it.
+
+        :param key: The entry, e.g. 'tail'.
+        :param value: Any JSON-serialisable value.
+        :return: The messages to send, as (IP, message) pairs.
+        """
+        with self.lock:
+            current = self._entries.get(key)
+            timestamp = time.time_ns()
+            if current is not None and current[0] >= timestamp:
+                timestamp = current[0] + 1  # Our clock is behind the last writer's
+            entry = self._entries[key] = [timestamp, self.origin, value]
+        self._changed(key, value)
+        return self._push({key: entry})
+
+    def get(self, key, default=None):
+        """
+        :param key: The entry.
+        :return: Its newest known value, or `default`.
+        """
+        with self.lock:
+            entry = self._entries.get(key)
+        return entry[2] if entry is not None else default
+
+    def items(self):
+        """
+        :return: A dict of every known key and its value.
+        """
+        with self.lock:
+            return {key: entry[2] for key, entry in self._entries.items()}
+
+    def round(self):
+        """
+        One anti-entropy round: offers a digest of the entries to one random peer, or of
+        one random part of them if the whole digest would not fit in a datagram.
+
+        :return: The messages to send, as (IP, message) pairs.
+        """
+        peers = [peer for peer in self.peers() if peer != self.origin]
+        if not peers:
+            return []
+        with self.lock:
+            digest = {key: entry[:2] for key, entry in self._entries.items()}
+        # Aim for parts of half a datagram, so the unevenly sized ones still fit
+        parts = max(1, math.ceil(len(json.dumps(digest)) / (self.max_datagram // 2)))
+        part = self.random.randrange(parts)
+        if parts > 1:
+            digest = {key: version for key, version in digest.items() if _part(key, parts) == part}
+        return self._count([(self.random.choice(peers), {'type': 'digest', 'digest': digest, 'part': [part, parts]})])
+
+    def handle(self, message, sender):
+        """
+        Applies a message from another node.
+
+        :param message: The decoded message.
+        :param sender: The sender's IP.
+        :return: The messages to send in response, as (IP, message) pairs.
+        """
+        kind = message.get('type')
+        if kind == 'digest':
+            # Send what the sender lacks and ask for what we lack, among the keys in the digest's part
+            theirs = message.get('digest', {})
+            part, parts = message.get('part', (0, 1))
+            with self.lock:
+                newer = {key: entry for key, entry in self._entries.items()
+                         if (parts == 1 or _part(key, parts) == part)
+                         and (key not in theirs or entry[:2] > theirs[key])}
+                wanted = [key for key, version in theirs.items()
+                          if key not in self._entries or list(version) > self._entries[key][:2]]
+            return self._count(self._deltas(sender, newer, wanted))
+
+        if kind in ('delta', 'rumour'):
+            fresh = self._merge(message.get('entries', {}))
+            replies = []
+            wanted = message.get('want')
+            if wanted:
+                with self.lock:
+                    entries = {key: self._entries[key] for key in wanted if key in self._entries}
+                replies = self._deltas(sender, entries)
+            if kind == 'rumour' and fresh:
+                return self._count(replies) + self._push(fresh, exclude=sender)  # Pass the rumour on
+            return self._count(replies)
+        return []
+
+    def start(self, host=''):
+        """Starts the listener and the anti-entropy threads."""
+        if self.running:
+            return
+        self.running = True
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, self.port))
+        with self.lock:
+            self.sock = sock
+            pending, self._pending = self._pending, []
+        self._send(pending)
+        self.ListenThread = threading.Thread(target=self._listen)
+        self.ListenThread.daemon = True  # Daemon thread: it will exit when the program exits
+        self.ListenThread.start()
+        self.RoundThread = threading.Thread(target=self._rounds)
+        self.RoundThread.daemon = True
+        self.RoundThread.start()
+
+    def publish(self, key, value):
+        """
+        Records a new value and sends it out over UDP. Before start(), the messages
+        are held back and sent when the socket opens.
+
+        :param key: The entry, e.g. 'tail'.
+        :param value: Any JSON-serialisable value.
+        """
+        messages = self.set(key, value)
+        with self.lock:
+            if self.sock is None:
+                self._pending.extend(messages)
+                return
+        self._send(messages)
+
+    def stop(self):
+        """Stops both threads and closes the socket."""
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+
+    def _merge(self, entries):
+        # Applies the newer of each entry; returns the entries that were news to us
+        fresh = {}
+        with self.lock:
+            for key, entry in entries.items():
+                current = self._entries.get(key)
+                if current is None or entry[:2] > current[:2]:
+                    self._entries[key] = list(entry)
+                    fresh[key] = entry
+        for key, entry in fresh.items():
+            self.updates_applied += 1
+            self._changed(key, entry[2])
+        return fresh
+
+    def _push(self, entries, exclude=None):
+        peers = [peer for peer in self.peers() if peer not in (self.origin, exclude)]
+        targets = self.random.sample(peers, min(self.fanout, len(peers)))
+        return self._count([(peer, {'type': 'rumour', 'entries': dict(chunk)})
+                            for chunk in self._chunks(list(entries.items())) for peer in targets])
+
+    def _deltas(self, peer, entries, wanted=()):
+        # Delta messages carrying `entries` and asking for `wanted`, as many as it takes to fit each in a datagram
+        messages = [(peer, {'type': 'delta', 'entries': dict(chunk)}) for chunk in self._chunks(list(entries.items()))]
+        messages += [(peer, {'type': 'delta', 'entries': {}, 'want': chunk}) for chunk in self._chunks(list(wanted))]
+        return messages
+
+    def _chunks(self, items):
+        # Splits keys or (key, entry) pairs into runs whose JSON fits in a datagram, with room for the rest of it
+        budget = self.max_datagram - 100
+        chunks = []
+        chunk = []
+        size = 0
+        for item in items:
+            item_size = len(json.dumps(item)) + 2  # About its size as a list item or dict member
+            if chunk and size + item_size > budget:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(item)
+            size += item_size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _count(self, messages):
+        self.messages_sent += len(messages)
+        return messages
+
+    def _changed(self, key, value):
+        if self.on_change is not None:
+            self.on_change(key, value)
+
+    def _send(self, messages):
+        for peer, message in messages:
+            try:
+                self.sock.sendto(json.dumps(message).encode(), (peer, self.port))
+            except OSError:
+                pass  # Unreachable peer; anti-entropy will catch it up later
+
+    def _listen(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(65536)
+            except OSError:
+                if not self.running:
+                    return  # Socket closed by stop()
+                continue
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue  # Not a gossip message
+            self._send(self.handle(message, addr[0]))
+
+    def _rounds(self):
+        while self.running:
+            time.sleep(self.interval)
+            self._send(self.round())
+
+
+def _part(key, parts):
+    # Which of `parts` digest parts a key falls in; the same on every node
+    return zlib.crc32(key.encode()) % parts
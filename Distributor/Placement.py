@@ -0,0 +1,155 @@
+from bisect import bisect_left, bisect_right
+import hashlib
+
+
+class HashRing:
+    """
+    Consistent-hash ring deciding which nodes hold which shard.
+
+    Every node is hashed onto the ring at `vnodes` points (virtual nodes), and a
+    shard is held by the first `replicas` distinct nodes found walking clockwise
+    from the shard's own position. Finding them is a binary search plus a short
+    walk, and nothing is stored per shard: any node with the same membership
+    computes the same holders. When a node joins or leaves, only the shards next
+    to its points change hands, about 1/n of them.
+
+    The ring can stand in for `Node.shard_table` where a mapping from shard ID to
+    holders is expected (e.g. `Fetcher.ShardFetcher.fetch`).
+    """
+
+    def __init__(self, nodes=(), vnodes=128, replicas=3):
+        """
+        :param nodes: The initial member IPs.
+        :param vnodes: Ring points per node (per unit of weight); more points spread shards more evenly.
+        :param replicas: How many distinct nodes hold each shard by default.
+        """
+        self.vnodes = vnodes
+        self.replicas = replicas
+        self._points = []  # Sorted ring positions
+        self._owners = []  # Node IP at each position in _points
+        self._weights = {}  # Node IP -> weight
+        points = []  # Sorted once rather than inserted one by one, for rings of thousands of nodes
+        for node in nodes:
+            if node not in self._weights:
+                self._weights[node] = 1
+                points.extend((point, node) for point in self._node_points(node, 1))
+        points.sort()
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def add(self, node, weight=1):
+        """
+        Adds a node to the ring.
+
+        :param node: The node's IP.
+        :param weight: Relative share of shards, e.g. proportional to its free storage.
+        """
+        if node in self._weights:
+            return
+        self._weights[node] = weight
+        for point in self._node_points(node, weight):
+            index = bisect_left(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        """
+        Removes a node from the ring.
+
+        :param node: The node's IP.
+        """
+        if self._weights.pop(node, None) is None:
+            return
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def holders(self, shard_id, replicas=None, alive=None):
+        """
+        Returns the nodes that hold a shard.
+
+        :param shard_id: The shard ID (a hex SHA-256 digest).
+        :param replicas: How many holders to return; defaults to the ring's `replicas`.
+        :param alive: Optional predicate on a node IP (e.g. `lambda ip: health.state(ip) == Health.ALIVE`);
+                      nodes it rejects are skipped and the walk carries on to the next ones.
+        :return: The holder IPs, primary first.
+        """
+        replicas = self.replicas if replicas is None else replicas
+        holders = []
+        count = len(self._points)
+        if not count:
+            return holders
+
+        start = bisect_right(self._points, _shard_position(shard_id))
+        for step in range(count):
+            node = self._owners[(start + step) % count]
+            if node in holders or (alive is not None and not alive(node)):
+                continue
+            holders.append(node)
+            if len(holders) == replicas:
+                break
+        return holders
+
+    def primary(self, shard_id):
+        """
+        :param shard_id: The shard ID.
+        :return: The IP of the shard's first holder, or None if the ring is empty.
+        """
+        holders = self.holders(shard_id, 1)
+        return holders[0] if holders else None
+
+    def moves(self, shard_ids, other):
+        """
+        Works out which shards change hands between this membership and another one.
+
+        :param shard_ids: The shard IDs to check, e.g. every shard this node holds.
+        :param other: The HashRing after the membership change.
+        :return: A dict from each shard ID whose holders differ to (nodes that gain it, nodes that lose it).
+        """
+        changes = {}
+        for shard_id in shard_ids:
+            before = self.holders(shard_id)
+            after = other.holders(shard_id)
+            if before != after:
+                gained = [node for node in after if node not in before]
+                lost = [node for node in before if node not in after]
+                if gained or lost:
+                    changes[shard_id] = (gained, lost)
+        return changes
+
+    def copy(self):
+        """
+        :return: A new ring with the same members, e.g. to apply a membership change to and compare with moves().
+        """
+        ring = HashRing(vnodes=self.vnodes, replicas=self.replicas)
+        ring._points = list(self._points)
+        ring._owners = list(self._owners)
+        ring._weights = dict(self._weights)
+        return ring
+
+    @property
+    def nodes(self):
+        """The member IPs."""
+        return list(self._weights)
+
+    def get(self, shard_id, default=None):
+        holders = self.holders(shard_id)
+        return holders if holders else default
+
+    def __getitem__(self, shard_id):
+        holders = self.holders(shard_id)
+        if not holders:
+            raise KeyError(shard_id)
+        return holders
+
+    def _node_points(self, node, weight):
+        points = []
+        for i in range(max(1, round(self.vnodes * weight))):
+            digest = hashlib.blake2b(f"{node}#{i}".encode(), digest_size=8).digest()
+            points.append(int.from_bytes(digest, 'big'))
+        return points
+
+
+def _shard_position(shard_id):
+    # Shard IDs are already uniform SHA-256 digests, so their first 64 bits are a ring position
+    return int(shard_id[:16], 16)
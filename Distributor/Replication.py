@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import struct
+
+from .Transport import TransportError
+
+# A replication connection carries, downstream:
+#
+#   ROUTE_HEADER | HOP * n | (SHARD_HEADER | data) * ...
+#
+# where the hops are the rest of the chain after the receiving node, and,
+# upstream, one ACK per shard in the order the shards were sent. Every node
+# forwards each piece of a shard downstream as soon as it has read it and only
+# acknowledges a shard once it has stored it and the rest of the chain has
+# acknowledged it too, so an ACK reaching the head means every replica is stored.
+
+ROUTE_HEADER = struct.Struct('>B')  # number of hops that follow
+HOP = struct.Struct('>B')  # host length, then the host (UTF-8) and PORT
+PORT = struct.Struct('>H')
+SHARD_HEADER = struct.Struct('>32sI')  # raw shard digest, data length
+ACK = struct.Struct('>32sB')  # raw shard digest, status
+
+STORED = 0  # Stored on every node from here to the tail
+CORRUPT = 1  # Did not match its digest on some node
+BROKEN = 2  # Stored up to some node, but the chain after it could not be reached
+
+
+class ChainReplicator:
+    """
+    Chain replication of shard writes.
+
+    The head streams shards to the first node of the chain, which passes each
+    piece on to the next node while it is still receiving the rest (cut-through
+    rather than store-and-forward), and so on down to the tail. Acknowledgements
+    travel back up the chain. Every link carries every shard exactly once, so the
+    head's uplink sends each shard once whatever the replication factor, and
+    throughput stays close to that of a single link.
+
+    The same object is both ends: `replicate()` is the head's side and `serve()`
+    accepts connections from upstream, storing into `store` (a `Shard_Store.ShardStore`
+    or anything with the same put method).
+    """
+
+    def __init__(self, store=None, chunk_size=64 * 1024):
+        """
+        :param store: Where shards passing through this node are stored.
+        :param chunk_size: Largest piece of a shard read before it is forwarded downstream.
+        """
+        self.store = store
+        self.chunk_size = chunk_size
+        self._server = None
+
+        # Counters
+        self.shards_stored = 0
+        self.bytes_forwarded = 0
+
+    async def replicate(self, chain, shards):
+        """
+        Writes shards to every node of a chain.
+
+        :param chain: The (host, port) of each node in the chain, head's successor first and tail last.
+        :param shards: An iterable of shards (bytes-like); IDs are their SHA-256 digests.
+        :return: A dict from each shard ID to its status: STORED, CORRUPT or BROKEN.
+        """
+        reader, writer = await asyncio.open_connection(*chain[0])
+        try:
+            writer.write(_pack_route(chain[1:]))
+            sent = []
+            acks = asyncio.ensure_future(_read_acks(reader, sent))
+            for shard in shards:
+                digest = hashlib.sha256(shard).digest()
+                sent.append(digest)
+                writer.write(SHARD_HEADER.pack(digest, len(shard)))
+                writer.write(shard)
+                await writer.drain()  # Backpressure from the chain
+            writer.write_eof()  # No more shards
+            return await acks
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """
+        Accepts replication connections and relays their shards until cancelled.
+
+        :param host: The IP address to bind.
+        :param port: The port to bind (0 picks a free one, see `server_port`).
+        """
+        await self.start_server(host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def start_server(self, host, port):
+        """
+        Starts accepting replication connections in the background.
+
+        :param host: The IP address to bind.
+        :param port: The port to bind (0 picks a free one, see `server_port`).
+        """
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    @property
+    def server_port(self):
+        """The port the server is bound to."""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Closes the server."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        # One upstream connection: relay its shards down the rest of the chain, acks back up
+        downstream = None
+        try:
+            rest = await _read_route(reader)
+            if rest:
+                try:
+                    downstream = _Downstream(*await asyncio.open_connection(*rest[0]))
+                    await downstream.forward(_pack_route(rest[1:]))
+                except OSError:
+                    pass  # Store here and report the chain as broken
+            broken = bool(rest) and downstream is None
+
+            local = asyncio.Queue()  # Digest and local status of each shard, in order
+            relay = asyncio.ensure_future(self._relay_acks(downstream, broken, local, writer))
+            try:
+                await self._relay_shards(reader, downstream, local)
+            finally:
+                await local.put(None)  # End of shards
+                if downstream is not None:
+                    downstream.finish()
+            await relay
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # Upstream went away; it will not see the acks anyway
+        finally:
+            if downstream is not None:
+                downstream.close()
+            writer.close()
+
+    async def _relay_shards(self, reader, downstream, local):
+        # Reads each shard piece by piece, forwarding every piece before reading the next
+        while True:
+            header = await reader.read(SHARD_HEADER.size)
+            if not header:
+                return
+            if len(header) < SHARD_HEADER.size:
+                header += await reader.readexactly(SHARD_HEADER.size - len(header))
+            digest, length = SHARD_HEADER.unpack(header)
+            if downstream is not None:
+                await downstream.forward(header)
+
+            pieces = []
+            remaining = length
+            while remaining:
+                piece = await reader.read(min(remaining, self.chunk_size))
+                if not piece:
+                    raise asyncio.IncompleteReadError(b''.join(pieces), length)
+                remaining -= len(piece)
+                pieces.append(piece)
+                if downstream is not None:
+                    await downstream.forward(piece)  # Cut-through: on its way before the rest arrives
+                    self.bytes_forwarded += len(piece)
+
+            try:
+                self.store.put(b''.join(pieces), digest.hex())
+                self.shards_stored += 1
+                await local.put((digest, STORED))
+            except ValueError:
+                await local.put((digest, CORRUPT))
+
+    async def _relay_acks(self, downstream, broken, local, writer):
+        # Acks each shard upstream once it is stored here and acked by the rest of the chain
+        while True:
+            entry = await local.get()
+            if entry is None:
+                return
+            digest, status = entry
+            if downstream is not None:
+                try:
+                    down_status = await downstream.ack(digest)  # Read even for a corrupt shard, to stay in step
+                except TransportError:
+                    downstream.fail()  # Its acks no longer match our shards; this and every later shard is BROKEN
+                    down_status = None
+                status = max(status, BROKEN if down_status is None else down_status)
+            elif broken:
+                status = max(status, BROKEN)
+            writer.write(ACK.pack(digest, status))
+            await writer.drain()
+
+
+class _Downstream:
+    # The connection to the next node; once it fails, shards are only stored here and acked as BROKEN
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.alive = True
+
+    async def forward(self, data):
+        if not self.alive:
+            return
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except ConnectionError:
+            self.alive = False
+
+    async def ack(self, digest):
+        # The next node's status for a shard, or None if the rest of the chain is gone
+        if not self.alive:
+            return None
+        try:
+            down_digest, status = ACK.unpack(await self.reader.readexactly(ACK.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.alive = False
+            return None
+        if down_digest != digest:
+            raise TransportError("Acks out of order")
+        return status
+
+    def fail(self):
+        # Stops using the connection, e.g. once the next node is out of step
+        self.alive = False
+        self.writer.close()
+
+    def finish(self):
+        if self.alive and not self.writer.is_closing():
+            self.writer.write_eof()  # No more shards
+
+    def close(self):
+        self.writer.close()
+
+
+def _pack_route(hops):
+    parts = [ROUTE_HEADER.pack(len(hops))]
+    for host, port in hops:
+        encoded = host.encode()
+        parts.append(HOP.pack(len(encoded)) + encoded + PORT.pack(port))
+    return b''.join(parts)
+
+
+async def _read_route(reader):
+    count, = ROUTE_HEADER.unpack(await reader.readexactly(ROUTE_HEADER.size))
+    hops = []
+    for _ in range(count):
+        length, = HOP.unpack(await reader.readexactly(HOP.size))
+        host = (await reader.readexactly(length)).decode()
+        port, = PORT.unpack(await reader.readexactly(PORT.size))
+        hops.append((host, port))
+    return hops
+
+
+async def _read_acks(reader, sent):
+    # Collects one ack per shard sent; shards left unacked when the chain drops are BROKEN
+    statuses = {}
+    index = 0
+    try:
+        while True:
+            data = await reader.readexactly(ACK.size)
+            digest, status = ACK.unpack(data)
+            statuses[digest.hex()] = status
+            index += 1
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    for digest in sent[index:]:
+        statuses.setdefault(digest.hex(), BROKEN)
+    return statuses
@@ -0,0 +1,293 @@
+import heapq
+import itertools
+import random
+import uuid
+
+from ..Session_Layer import Routing
+from ..Session_Layer.Node_Struct import Node
+from .Gossip import Gossip
+from .Placement import HashRing
+
+
+class SimNetwork:
+    """
+    Simulated datagram network with a virtual clock.
+
+    Nothing is sent over a real socket: a message is a callback scheduled to run
+    after a simulated one-way latency, unless it is lost, its destination has
+    crashed, or a partition separates the two ends. Events run in time order on
+    one thread, so thousands of nodes fit in one process and a run is repeatable
+    for a given seed.
+    """
+
+    def __init__(self, latency=0.005, jitter=0.002, loss=0.0, seed=0):
+        """
+        :param latency: Mean one-way latency in seconds.
+        :param jitter: Latency varies uniformly by up to this much either way, in seconds.
+        :param loss: Probability that any one message is lost.
+        :param seed: Seed for latency, loss and everything else random in the simulation.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.now = 0.0  # Simulated time in seconds
+        self._events = []  # Heap of (time, sequence number, callback, args)
+        self._sequence = itertools.count()
+        self._down = set()  # IPs of crashed nodes
+        self._groups = {}  # IP -> partition it is in; unlisted IPs are together in one more partition
+
+        # Counters
+        self.messages = 0
+        self.dropped = 0
+
+    def schedule(self, delay, callback, *args):
+        """
+        Runs callback(*args) after `delay` simulated seconds.
+
+        :param delay: Seconds from now.
+        :param callback: The function to call.
+        """
+        heapq.heappush(self._events, (self.now + delay, next(self._sequence), callback, args))
+
+    def run(self, until=None):
+        """
+        Runs events in time order.
+
+        :param until: Simulated time to stop at; runs until no events are left if None.
+        :return: The number of events run.
+        """
+        count = 0
+        while self._events and (until is None or self._events[0][0] <= until):
+            self.now, _, callback, args = heapq.heappop(self._events)
+            callback(*args)
+            count += 1
+        if until is not None:
+            self.now = max(self.now, until)
+        return count
+
+    def crash(self, ip):
+        """Stops a node from sending or receiving anything."""
+        self._down.add(ip)
+
+    def recover(self, ip):
+        """Brings a crashed node back."""
+        self._down.discard(ip)
+
+    def is_up(self, ip):
+        """
+        :param ip: A node IP.
+        :return: False if the node has crashed.
+        """
+        return ip not in self._down
+
+    def partition(self, *groups):
+        """
+        Splits the network: nodes can only reach nodes in the same group.
+
+        :param groups: Iterables of IPs; IPs in none of them form one more group.
+        """
+        self._groups = {ip: number for number, group in enumerate(groups) for ip in group}
+
+    def heal(self):
+        """Removes every partition."""
+        self._groups = {}
+
+    def reachable(self, source, destination):
+        """
+        :return: True if both nodes are up and on the same side of every partition.
+        """
+        return (source not in self._down and destination not in self._down
+                and self._groups.get(source) == self._groups.get(destination))
+
+    def transit(self, source, destination):
+        """
+        Sends one simulated message.
+
+        :return: Its one-way latency in seconds, or None if it was lost or could not be delivered.
+        """
+        self.messages += 1
+        if not self.reachable(source, destination) or (self.loss and self.random.random() < self.loss):
+            self.dropped += 1
+            return None
+        return max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def round_trip(self, source, destination):
+        """
+        Sends a request and its reply.
+
+        :return: The round trip time in seconds, or None if either message did not arrive.
+        """
+        there = self.transit(source, destination)
+        if there is None:
+            return None
+        back = self.transit(destination, source)
+        return None if back is None else there + back
+
+    def send(self, source, destination, callback, *args):
+        """
+        Delivers a message by running callback(*args) once it arrives, unless it is lost.
+        """
+        delay = self.transit(source, destination)
+        if delay is not None:
+            self.schedule(delay, callback, *args)
+
+
+class Simulation:
+    """
+    Runs many Nodes in one process on a SimNetwork.
+
+    Every Node is created without threads or sockets and driven from the event
+    loop instead: its probe sweeps are simulated round trips fed to
+    `Node.apply_sweep`, its lookups query the other nodes' routing tables
+    directly (counting hops), and its gossip messages are delivered by the
+    network. Everything above the socket is the real Session_Layer and
+    Distributor code, so ping overhead, failure detection, chain metadata
+    convergence and shard placement can be measured at scale.
+    """
+
+    def __init__(self, size, network=None, k=8, ping_interval=1.0, probe_timeout=0.5,
+                 gossip_interval=1.0, fanout=3, seed=0):
+        """
+        :param size: How many nodes to run.
+        :param network: The SimNetwork to run on; a default one is created if None.
+        :param k: Routing table bucket size.
+        :param ping_interval: Seconds between a node's probe sweeps, as in Node.session_ping.
+        :param probe_timeout: Seconds a sweep waits for pongs.
+        :param gossip_interval: Seconds between a node's anti-entropy rounds.
+        :param fanout: How many peers a fresh gossip update is pushed to.
+        :param seed: Seed for node IDs and peer choices.
+        """
+        self.network = network if network is not None else SimNetwork(seed=seed)
+        self.ping_interval = ping_interval
+        self.probe_timeout = probe_timeout
+        self.gossip_interval = gossip_interval
+        self.random = random.Random(seed)
+
+        self.nodes = {}  # IP -> Node
+        self.gossip = {}  # IP -> Gossip
+        clock = lambda: self.network.now  # noqa: E731
+        for i in range(size):
+            ip = f"10.{i // 65536}.{i // 256 % 256}.{i % 256}"
+            node = Node(cache_size=0, start_threads=False, clock=clock)
+            node.ip = ip
+            node.id = uuid.UUID(int=self.random.getrandbits(128))
+            node.routing = Routing.RoutingTable(node.id.int, k)
+            self.nodes[ip] = node
+            self.gossip[ip] = Gossip(ip, lambda node=node: node.neighbour, fanout=fanout, interval=gossip_interval,
+                                     rng=random.Random(self.random.getrandbits(64)))
+
+        # Counters
+        self.sweeps = 0
+        self.probes = 0
+        self.lookup_hops = 0
+        self.lookups = 0
+
+    def bootstrap(self, contacts=3):
+        """
+        Joins every node to the network: it learns a few random nodes, then looks up its own ID,
+        which fills its routing table and puts it in the tables of the nodes it asks.
+
+        :param contacts: How many random nodes each node starts out knowing.
+        """
+        ips = list(self.nodes)
+        for ip, node in self.nodes.items():
+            for peer in self.random.sample(ips, contacts + 1):
+                if peer != ip:
+                    node.routing.update(self.nodes[peer].id.int, peer)
+        for ip, node in self.nodes.items():
+            self.lookup(ip, node.id.int)
+        for ip, node in self.nodes.items():
+            for peer in node.neighbour:
+                node.health.track(peer)
+
+    def lookup(self, ip, target_id):
+        """
+        Runs a node's iterative lookup against the other nodes' routing tables.
+
+        :param ip: The IP of the node looking.
+        :param target_id: The ID to look for, as an integer.
+        :return: The (node ID, IP) pairs found closest to the target, and the number of nodes queried.
+        """
+        node = self.nodes[ip]
+        queried = [0]
+
+        def find_node(peer, target):
+            queried[0] += 1
+            if self.network.round_trip(ip, peer) is None:
+                return None
+            other = self.nodes[peer].routing
+            other.update(node.id.int, ip)  # The asked node learns about the asker
+            return other.closest(target)
+
+        found = node.routing.lookup(target_id, find_node)
+        self.lookups += 1
+        self.lookup_hops += queried[0]
+        return found, queried[0]
+
+    def start_probing(self):
+        """Starts every node's probe sweeps, at random offsets within one interval."""
+        for ip in self.nodes:
+            self.network.schedule(self.random.uniform(0, self.ping_interval), self._sweep, ip)
+
+    def start_gossip(self):
+        """Starts every node's anti-entropy rounds, at random offsets within one interval."""
+        for ip in self.nodes:
+            self.network.schedule(self.random.uniform(0, self.gossip_interval), self._gossip_round, ip)
+
+    def publish(self, ip, key, value):
+        """
+        Has a node publish a gossip entry, e.g. a new tail.
+
+        :param ip: The publishing node's IP.
+        :param key: The entry.
+        :param value: Its value.
+        """
+        self._deliver(ip, self.gossip[ip].set(key, value))
+
+    def converged(self, key, value):
+        """
+        :return: The fraction of running nodes whose gossip has `value` for `key`.
+        """
+        up = [ip for ip in self.nodes if self.network.is_up(ip)]
+        return sum(self.gossip[ip].get(key) == value for ip in up) / len(up)
+
+    def placement(self, vnodes=128, replicas=3):
+        """
+        :return: A HashRing over every running node.
+        """
+        return HashRing([ip for ip in self.nodes if self.network.is_up(ip)], vnodes, replicas)
+
+    def _sweep(self, ip):
+        # One probe sweep of a node: simulated round trips, applied once the sweep's timeout passes.
+        # A crashed node skips its sweeps but keeps its schedule, so it probes again once it recovers.
+        if not self.network.is_up(ip):
+            self.network.schedule(self.ping_interval, self._sweep, ip)
+            return
+        node = self.nodes[ip]
+        neighbours = node.neighbour
+        results = {}
+        for peer in neighbours:
+            rtt = self.network.round_trip(ip, peer)
+            results[peer] = rtt if rtt is not None and rtt <= self.probe_timeout else None
+        self.sweeps += 1
+        self.probes += len(neighbours)
+        self.network.schedule(self.probe_timeout, self._finish_sweep, ip, neighbours, results)
+
+    def _finish_sweep(self, ip, neighbours, results):
+        node = self.nodes[ip]
+        if self.network.is_up(ip) and node.apply_sweep(neighbours, results):
+            node.get_next_alive()
+        self.network.schedule(self.ping_interval, self._sweep, ip)
+
+    def _gossip_round(self, ip):
+        if self.network.is_up(ip):  # Like _sweep, a crashed node keeps its schedule and skips the round
+            self._deliver(ip, self.gossip[ip].round())
+        self.network.schedule(self.gossip_interval, self._gossip_round, ip)
+
+    def _deliver(self, source, messages):
+        for destination, message in messages:
+            self.network.send(source, destination, self._receive, destination, message, source)
+
+    def _receive(self, ip, message, source):
+        self._deliver(ip, self.gossip[ip].handle(message, source))
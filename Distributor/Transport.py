@@ -0,0 +1,419 @@
+import asyncio
+import hashlib
+import itertools
+import struct
+
+# Every message on a transfer connection is a frame:
+#
+#   FRAME (type, sequence number, payload length) | payload
+#
+# Requests carry a sequence number that the matching reply echoes, so many
+# requests can be in flight on one connection and replies can be matched up
+# whatever order they come back in. Shards travel in batches of records:
+#
+#   SHARD_RECORD (raw SHA-256 digest, data length) | data
+#
+# A GET reply uses MISSING as the length of a shard the node does not hold.
+# Shards handed over to a new holder carry their reference count as well:
+#
+#   HANDOFF_RECORD (raw SHA-256 digest, data length, reference count) | data
+#
+# where MISSING as the length means the receiver already holds the data.
+
+FRAME = struct.Struct('>BII')  # type, sequence number, payload length
+SHARD_RECORD = struct.Struct('>32sI')  # raw shard digest, data length
+HANDOFF_RECORD = struct.Struct('>32sII')  # raw shard digest, data length, reference count
+DIGEST_SIZE = 32
+MISSING = 0xFFFFFFFF
+
+BATCH = 1  # Shards to store; answered with ACK
+ACK = 2  # Payload: number of shards in the batch that were rejected (4 bytes)
+GET = 3  # Payload: digests; answered with DATA
+DATA = 4  # Payload: shard records in the order asked for
+HAS = 5  # Payload: digests; answered with HAVE
+CLAIM = 6  # Like HAS, and the node takes a reference to every shard it holds
+HAVE = 7  # Payload: the digests among those asked about that the node holds
+ERROR = 8  # Payload: a UTF-8 message
+HANDOFF = 9  # Handoff records to store with their reference counts; answered with ACK
+RELEASE = 10  # Payload: digests to drop a reference to; answered with HAVE listing the shards deleted
+
+
+class TransportError(Exception):
+    """Raised when a peer rejects a request or the connection to it fails."""
+
+
+class ShardTransport:
+    """
+    Asyncio shard transfer engine.
+
+    Keeps persistent connections to every peer it talks to and pipelines
+    requests over them. Shards are packed into batches of up to `batch_bytes`,
+    and up to `window` batches may be unacknowledged on a connection at once;
+    beyond that, senders wait for acknowledgements (backpressure), and the
+    socket's own flow control is respected through `drain()`.
+
+    The same object also serves the other side: `serve()` accepts connections
+    and answers requests from `store` (a `Shard_Store.ShardStore` or anything
+    with the same put/get/has_shards/claim/release/adopt methods).
+    """
+
+    def __init__(self, store=None, window=32, batch_bytes=256 * 1024, connections_per_peer=1):
+        """
+        :param store: Where incoming shards are stored and requested ones read from.
+        :param window: How many requests may be unanswered per connection.
+        :param batch_bytes: Target payload size of a batch of shards.
+        :param connections_per_peer: How many pooled connections to open to each peer.
+        """
+        self.store = store
+        self.window = window
+        self.batch_bytes = batch_bytes
+        self.connections_per_peer = connections_per_peer
+        self._pools = {}  # (host, port) -> list of _Connection
+        self._round_robin = {}  # (host, port) -> iterator over the pool
+        self._opening = {}  # (host, port) -> lock held while its pool is being opened
+        self._server = None
+
+        # Counters
+        self.shards_sent = 0
+        self.bytes_sent = 0
+        self.shards_received = 0
+        self.bytes_received = 0
+        self.shards_rejected = 0
+
+    async def send_shards(self, host, port, shards):
+        """
+        Sends shards to a peer in pipelined batches.
+
+        :param host: The peer's IP address.
+        :param port: The peer's transfer port.
+        :param shards: An iterable of shards (bytes-like); IDs are their SHA-256 digests.
+        :return: The hex IDs of the shards sent, in order.
+        """
+        shard_ids = []
+
+        def records():
+            for shard in shards:
+                digest = hashlib.sha256(shard).digest()
+                shard_ids.append(digest.hex())
+                yield SHARD_RECORD.pack(digest, len(shard)), shard
+
+        rejected = await self._send_records(host, port, BATCH, records())
+        if rejected:
+            raise TransportError(f"{host} rejected {rejected} shards")
+        return shard_ids
+
+    async def hand_over(self, host, port, shards):
+        """
+        Moves shards to a new holder along with their reference counts, e.g. after a placement change.
+
+        The data of shards the peer already holds is not sent again, only their counts. The peer
+        raises each count to the one sent (see `Shard_Store.ShardStore.adopt`), so every old
+        holder may hand the same shard over.
+
+        :param host: The peer's IP address.
+        :param port: The peer's transfer port.
+        :param shards: A dict from shard ID to (shard data, reference count).
+        :return: The IDs of the shards whose data had to be sent.
+        """
+        held = set(await self.has_shards(host, port, list(shards)))
+        records = []
+        for shard_id, (shard, count) in shards.items():
+            if shard_id in held:
+                records.append((HANDOFF_RECORD.pack(bytes.fromhex(shard_id), MISSING, count), b''))
+            else:
+                records.append((HANDOFF_RECORD.pack(bytes.fromhex(shard_id), len(shard), count), shard))
+
+        rejected = await self._send_records(host, port, HANDOFF, records)
+        if rejected:
+            raise TransportError(f"{host} rejected {rejected} shards")
+        return [shard_id for shard_id in shards if shard_id not in held]
+
+    async def get_shards(self, host, port, shard_ids):
+        """
+        Fetches shards from a peer in one request.
+
+        :param host: The peer's IP address.
+        :param port: The peer's transfer port.
+        :param shard_ids: The hex IDs of the shards wanted.
+        :return: A dict from shard ID to data for the shards the peer holds.
+        """
+        payload = b''.join(bytes.fromhex(shard_id) for shard_id in shard_ids)
+        reply = await (await self._request(host, port, GET, [payload], len(payload)))
+
+        shards = {}
+        view = memoryview(reply)
+        offset = 0
+        while offset < len(view):
+            digest, length = SHARD_RECORD.unpack_from(view, offset)
+            offset += SHARD_RECORD.size
+            if length == MISSING:
+                continue
+            shard = bytes(view[offset: offset + length])
+            offset += length
+            if hashlib.sha256(shard).digest() != digest:
+                raise TransportError(f"{host} sent a shard that does not match its ID")
+            shards[digest.hex()] = shard
+        return shards
+
+    async def has_shards(self, host, port, shard_ids, claim=False):
+        """
+        Batched has-shards query.
+
+        :param host: The peer's IP address.
+        :param port: The peer's transfer port.
+        :param shard_ids: The hex IDs to look up.
+        :param claim: If True, the peer also takes a reference to every shard it holds.
+        :return: The IDs among `shard_ids` that the peer holds.
+        """
+        payload = b''.join(bytes.fromhex(shard_id) for shard_id in shard_ids)
+        reply = await (await self._request(host, port, CLAIM if claim else HAS, [payload], len(payload)))
+        return [reply[i: i + DIGEST_SIZE].hex() for i in range(0, len(reply), DIGEST_SIZE)]
+
+    async def release_shards(self, host, port, shard_ids):
+        """
+        Drops one reference to each of a batch of shards on a peer, which deletes a shard
+        once nothing references it any more.
+
+        :param host: The peer's IP address.
+        :param port: The peer's transfer port.
+        :param shard_ids: The hex IDs to release.
+        :return: The IDs among `shard_ids` that the peer deleted.
+        """
+        payload = b''.join(bytes.fromhex(shard_id) for shard_id in shard_ids)
+        reply = await (await self._request(host, port, RELEASE, [payload], len(payload)))
+        return [reply[i: i + DIGEST_SIZE].hex() for i in range(0, len(reply), DIGEST_SIZE)]
+
+    async def serve(self, host, port):
+        """
+        Accepts transfer connections and answers their requests until cancelled.
+
+        :param host: The IP address to bind.
+        :param port: The port to bind (0 picks a free one, see `server_port`).
+        """
+        await self.start_server(host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def start_server(self, host, port):
+        """
+        Starts accepting transfer connections in the background.
+
+        :param host: The IP address to bind.
+        :param port: The port to bind (0 picks a free one, see `server_port`).
+        """
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    @property
+    def server_port(self):
+        """The port the server is bound to."""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Closes every pooled connection and the server."""
+        for pool in self._pools.values():
+            for connection in pool:
+                await connection.close()
+        self._pools.clear()
+        self._round_robin.clear()
+        self._opening.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _send_records(self, host, port, kind, records):
+        # Packs (header, data) records into pipelined batches of about batch_bytes; returns how many were rejected
+        pending = []
+        batch = []
+        batch_size = 0
+        for header, data in records:
+            batch.append(header)
+            batch.append(data)
+            batch_size += len(header) + len(data)
+            if batch_size >= self.batch_bytes:
+                pending.append(await self._send_batch(host, port, kind, batch, batch_size))
+                batch, batch_size = [], 0
+        if batch:
+            pending.append(await self._send_batch(host, port, kind, batch, batch_size))
+        return sum(struct.unpack('>I', payload)[0] for payload in await asyncio.gather(*pending))
+
+    async def _send_batch(self, host, port, kind, batch, batch_size):
+        # Writes one batch and returns the future of its acknowledgement
+        self.shards_sent += len(batch) // 2
+        self.bytes_sent += batch_size
+        return await self._request(host, port, kind, batch, batch_size)
+
+    async def _request(self, host, port, kind, parts, length):
+        # Sends a request on a pooled connection once the window allows, returning the reply's future
+        connection = await self._connection(host, port)
+        return await connection.request(kind, parts, length)
+
+    async def _connection(self, host, port):
+        key = (host, port)
+        if key not in self._round_robin:
+            # Only one request opens a new peer's pool; the others wait for it and then share it
+            async with self._opening.setdefault(key, asyncio.Lock()):
+                if key not in self._round_robin:
+                    await self._open_pool(host, port)
+
+        connection = next(self._round_robin[key])
+        if connection.closed:  # Reconnect in place if the peer dropped it
+            reader, writer = await asyncio.open_connection(host, port)
+            connection.reset(reader, writer)
+        return connection
+
+    async def _open_pool(self, host, port):
+        # Opens every pooled connection to a peer and registers the pool only once all of them are up
+        pool = []
+        try:
+            for _ in range(self.connections_per_peer):
+                reader, writer = await asyncio.open_connection(host, port)
+                pool.append(_Connection(reader, writer, self.window))
+        except BaseException:
+            for connection in pool:
+                await connection.close()
+            raise
+        self._pools[(host, port)] = pool
+        self._round_robin[(host, port)] = itertools.cycle(pool)
+
+    async def _handle_connection(self, reader, writer):
+        # Serves requests on one incoming connection, in order
+        try:
+            while True:
+                kind, sequence, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+                payload = await reader.readexactly(length)
+                try:
+                    reply_kind, reply = self._answer(kind, payload)
+                except Exception as e:
+                    reply_kind, reply = ERROR, str(e).encode()
+                writer.write(FRAME.pack(reply_kind, sequence, len(reply)))
+                writer.write(reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # Peer closed the connection
+        finally:
+            writer.close()
+
+    def _answer(self, kind, payload):
+        # Returns the (type, payload) of the reply to one request
+        if kind == BATCH:
+            rejected = 0
+            view = memoryview(payload)
+            offset = 0
+            while offset < len(view):
+                digest, length = SHARD_RECORD.unpack_from(view, offset)
+                offset += SHARD_RECORD.size
+                try:
+                    self.store.put(view[offset: offset + length], digest.hex())
+                except ValueError:
+                    rejected += 1  # Corrupted in transit
+                    self.shards_rejected += 1
+                offset += length
+                self.shards_received += 1
+                self.bytes_received += length
+            return ACK, struct.pack('>I', rejected)
+
+        if kind == HANDOFF:
+            rejected = 0
+            view = memoryview(payload)
+            offset = 0
+            while offset < len(view):
+                digest, length, count = HANDOFF_RECORD.unpack_from(view, offset)
+                offset += HANDOFF_RECORD.size
+                shard = None
+                if length != MISSING:
+                    shard = view[offset: offset + length]
+                    offset += length
+                    self.shards_received += 1
+                    self.bytes_received += length
+                try:
+                    adopted = self.store.adopt(digest.hex(), count, shard)
+                except ValueError:
+                    adopted = False  # Corrupted in transit
+                if not adopted:  # Or only the count was sent, but the shard is no longer here
+                    rejected += 1
+                    self.shards_rejected += 1
+            return ACK, struct.pack('>I', rejected)
+
+        digests = [payload[i: i + DIGEST_SIZE] for i in range(0, len(payload), DIGEST_SIZE)]
+        if kind == GET:
+            records = []
+            for digest in digests:
+                shard = self.store.get(digest.hex())
+                if shard is None:
+                    records.append(SHARD_RECORD.pack(digest, MISSING))
+                else:
+                    records.append(SHARD_RECORD.pack(digest, len(shard)))
+                    records.append(shard)
+            return DATA, b''.join(records)
+        if kind in (HAS, CLAIM):
+            shard_ids = [digest.hex() for digest in digests]
+            held = self.store.claim(shard_ids) if kind == CLAIM else self.store.has_shards(shard_ids)
+            return HAVE, b''.join(bytes.fromhex(shard_id) for shard_id in held)
+        if kind == RELEASE:
+            deleted = [digest for digest in digests if self.store.release(digest.hex())]
+            return HAVE, b''.join(deleted)
+        raise TransportError(f"Unknown request type {kind}")
+
+
+class _Connection:
+    # One pooled connection: a window of in-flight requests and a task matching replies to them
+
+    def __init__(self, reader, writer, window):
+        self._window = asyncio.Semaphore(window)
+        self._sequence = itertools.count(1)
+        self.reset(reader, writer)
+
+    def reset(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._pending = {}  # Sequence number -> future of the reply payload
+        self.closed = False
+        self._reply_task = asyncio.ensure_future(self._read_replies())
+
+    async def request(self, kind, parts, length):
+        # Waits for room in the window, writes the frame and returns the future of the reply
+        await self._window.acquire()
+        if self.closed:
+            self._window.release()
+            raise TransportError("Connection closed")
+
+        sequence = next(self._sequence) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda _: self._window.release())
+        self._pending[sequence] = future
+
+        self._writer.write(FRAME.pack(kind, sequence, length))
+        self._writer.writelines(parts)
+        await self._writer.drain()  # Backpressure from the socket buffer
+        return future
+
+    async def _read_replies(self):
+        try:
+            while True:
+                kind, sequence, length = FRAME.unpack(await self._reader.readexactly(FRAME.size))
+                payload = await self._reader.readexactly(length)
+                future = self._pending.pop(sequence, None)
+                if future is None or future.done():
+                    continue
+                if kind == ERROR:
+                    future.set_exception(TransportError(payload.decode()))
+                else:
+                    future.set_result(payload)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self._fail(TransportError(f"Connection lost: {e}"))
+
+    def _fail(self, error):
+        self.closed = True
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    async def close(self):
+        self._reply_task.cancel()
+        self._fail(TransportError("Connection closed"))
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
@@ -0,0 +1,167 @@
+import struct
+
+# Layout of an uploaded stream (before it is cut into shards):
+#
+#   HEADER | FRAME_HEADER + payload | FRAME_HEADER + payload | ... | END_FRAME | INDEX | TRAILER
+#
+# Each payload is one compressed and encrypted block of the original file, and
+# its frame header records the codec it was compressed with (see Encoder.encode_block).
+# Blocks are independent of each other, so a reader only ever needs to hold
+# one of them in memory at a time. The INDEX records where every payload sits
+# in the stream and the fixed size TRAILER says where the INDEX is, so a range
+# of the file can be read by fetching just the trailer, the index and the
+# blocks that cover the range.
+
+MAGIC = b'DNET'  # Identifies a D_Net stream
+VERSION = 3  # Bumped whenever the layout below changes (2: block index and trailer, 3: codec per block)
+
+HEADER = struct.Struct('>4sB16sI')  # magic, version, nonce, plaintext block size
+FRAME_HEADER = struct.Struct('>IB')  # Length of the payload that follows, codec of the block
+END_FRAME = FRAME_HEADER.pack(0, 0)  # A zero length frame marks the end of the stream
+INDEX_ENTRY = struct.Struct('>QIB')  # Offset of a payload in the stream, its length and its codec
+TRAILER = struct.Struct('>QQI4s')  # plaintext size, index offset, number of blocks, magic
+
+# A content-defined chunk (see Main.Upload_Chunks) is stored on its own rather than in a stream:
+#
+#   CHUNK_HEADER | encrypted chunk
+CHUNK_HEADER = struct.Struct('>16sB')  # Nonce the chunk is encrypted under, codec it was compressed with
+
+
+def pack_header(nonce, block_size):
+    """
+    Builds the stream header.
+
+    Args:
+        nonce (bytes): The 16-byte CTR nonce the blocks were encrypted with.
+        block_size (int): The size of the plaintext blocks the file was read in.
+
+    Returns:
+        bytes: The packed header.
+    """
+    return HEADER.pack(MAGIC, VERSION, nonce, block_size)
+
+
+def read_header(reader):
+    """
+    Reads and validates the stream header.
+
+    Args:
+        reader: Any object with a `read(size)` method returning bytes.
+
+    Returns:
+        tuple: The nonce and the plaintext block size.
+    """
+    data = reader.read(HEADER.size)
+    if len(data) != HEADER.size:
+        raise ValueError("Stream is too short to contain a header")
+
+    magic, version, nonce, block_size = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("Stream is not a D_Net stream")
+    if version != VERSION:
+        raise ValueError(f"Unsupported stream version {version}")
+    return nonce, block_size
+
+
+def pack_frame_header(payload, codec):
+    """
+    Builds the header that precedes a payload in the stream.
+
+    Args:
+        payload (bytes): The compressed and encrypted block.
+        codec (int): The codec the block was compressed with (one of Encoder's CODEC_* values).
+
+    Returns:
+        bytes: The packed frame header.
+    """
+    if not payload:
+        raise ValueError("Payloads may not be empty, a zero length frame ends the stream")
+    return FRAME_HEADER.pack(len(payload), codec)
+
+
+def iter_frames(reader):
+    """
+    Yields the payloads of a stream one at a time, stopping at the end frame.
+
+    Args:
+        reader: Any object with a `read(size)` method, positioned just after the header.
+
+    Yields:
+        tuple: The codec and the payload (compressed and encrypted block) of each frame, in upload order.
+    """
+    while True:
+        data = reader.read(FRAME_HEADER.size)
+        if len(data) != FRAME_HEADER.size:
+            raise ValueError("Stream ended before its end frame")
+
+        length, codec = FRAME_HEADER.unpack(data)
+        if length == 0:  # End of stream
+            return
+
+        payload = reader.read(length)
+        if len(payload) != length:
+            raise ValueError("Stream ended in the middle of a frame")
+        yield codec, payload
+
+
+def pack_index(entries):
+    """
+    Builds the block index.
+
+    Args:
+        entries (list of tuple): (offset, length, codec) of every payload in the stream, in block order.
+
+    Returns:
+        bytes: The packed index.
+    """
+    return b''.join(INDEX_ENTRY.pack(offset, length, codec) for offset, length, codec in entries)
+
+
+def unpack_index(data, block_count):
+    """
+    Parses the block index.
+
+    Args:
+        data (bytes): The packed index.
+        block_count (int): The number of blocks, from the trailer.
+
+    Returns:
+        list of tuple: (offset, length, codec) of every payload in the stream, in block order.
+    """
+    if len(data) != block_count * INDEX_ENTRY.size:
+        raise ValueError("Index does not match the number of blocks")
+    return list(INDEX_ENTRY.iter_unpack(data))
+
+
+def pack_trailer(plaintext_size, index_offset, block_count):
+    """
+    Builds the trailer that ends the stream.
+
+    Args:
+        plaintext_size (int): The size of the original file.
+        index_offset (int): Where the index starts in the stream.
+        block_count (int): The number of blocks in the stream.
+
+    Returns:
+        bytes: The packed trailer.
+    """
+    return TRAILER.pack(plaintext_size, index_offset, block_count, MAGIC)
+
+
+def read_trailer(data):
+    """
+    Parses and validates the trailer.
+
+    Args:
+        data (bytes): The last `TRAILER.size` bytes of the stream.
+
+    Returns:
+        tuple: The plaintext size, the index offset and the number of blocks.
+    """
+    if len(data) != TRAILER.size:
+        raise ValueError("Stream is too short to contain a trailer")
+
+    plaintext_size, index_offset, block_count, magic = TRAILER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("Stream has no valid trailer")
+    return plaintext_size, index_offset, block_count
@@ -1,6 +1,15 @@
+import logging
 import lzo
+import numpy as np
 import os
 
+try:
+    import zstandard  # Optional: higher ratio codec for compressible blocks
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
 def compress_file(file_path):
     """
     Compresses a file using LZO and saves it with a .lzo extension.
@@ -34,12 +43,12 @@ def compress_file(file_path):
         # Extract file extension
         file_extension = os.path.splitext(file_name_with_extension)[1]
 
-        print(f"File '{file_path}' compressed and saved to '{compressed_file_path}'")
+        logger.info("File '%s' compressed and saved to '%s'", file_path, compressed_file_path)
         return compressed_file_path, file_name, file_extension
     except FileNotFoundError:
-        print(f"Error: The file '{file_path}' was not found.")
+        logger.error("Error: The file '%s' was not found.", file_path)
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
 
 def decompress_file(compressed_file_path, file_name, file_extension):
     """
@@ -68,9 +77,168 @@ def decompress_file(compressed_file_path, file_name, file_extension):
         with open(original_file_path, 'wb') as f:
             f.write(decompressed_data)
 
-        print(f"File '{compressed_file_path}' decompressed and saved to '{original_file_path}'")
+        logger.info("File '%s' decompressed and saved to '%s'", compressed_file_path, original_file_path)
         return original_file_path
     except FileNotFoundError:
-        print(f"Error: The file '{compressed_file_path}' was not found.")
+        logger.error("Error: The file '%s' was not found.", compressed_file_path)
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
+
+# Size of the plaintext blocks the streaming pipeline reads a file in
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+def read_blocks(file_path, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Reads a file lazily in fixed size blocks.
+
+    Args:
+        file_path (str): The full path to the file to be read.
+        block_size (int): The number of bytes in each block (the last one may be shorter).
+
+    Yields:
+        bytes: The next block of the file.
+    """
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+def compress_block(block):
+    """
+    Compresses a single block in memory using LZO.
+
+    Args:
+        block (bytes): The block to be compressed.
+
+    Returns:
+        bytes: The compressed block.
+    """
+    return lzo.compress(block)
+
+def decompress_block(block):
+    """
+    Decompresses a single block in memory using LZO.
+
+    Args:
+        block (bytes): A block produced by `compress_block`.
+
+    Returns:
+        bytes: The original block.
+    """
+    return lzo.decompress(block)
+
+# Codecs a block can be stored with; the choice is recorded next to every block (see Container)
+CODEC_RAW = 0  # Stored as is: the block would not shrink
+CODEC_LZO = 1  # Fast, modest ratio
+CODEC_ZSTD = 2  # Slower, higher ratio (needs the optional zstandard package)
+
+# How much CPU to spend to save bandwidth, see choose_codec
+POLICIES = ('fast', 'balanced', 'small')
+DEFAULT_POLICY = 'balanced'
+
+# Sampled entropy (bits per byte) above which a block is taken to be already compressed or encrypted
+INCOMPRESSIBLE_ENTROPY = 7.5
+# Below this a block compresses so well that zstd pays off even under the 'balanced' policy
+ZSTD_ENTROPY = 6.0
+
+def estimate_entropy(block, sample_size=4096, samples=4):
+    """
+    Estimates the Shannon entropy of a block from a few evenly spaced samples.
+
+    Args:
+        block (bytes): The block to be sampled.
+        sample_size (int): The number of bytes in each sample.
+        samples (int): How many samples to take across the block.
+
+    Returns:
+        float: The estimated entropy in bits per byte, from 0 (constant) to 8 (random).
+    """
+    view = np.frombuffer(block, dtype=np.uint8)
+    if len(view) > sample_size * samples:
+        stride = (len(view) - sample_size) // (samples - 1) if samples > 1 else 0
+        view = np.concatenate([view[i * stride: i * stride + sample_size] for i in range(samples)])
+    if not len(view):
+        return 0.0
+
+    counts = np.bincount(view, minlength=256)
+    probabilities = counts[counts > 0] / len(view)
+    return abs(float((probabilities * np.log2(probabilities)).sum()))
+
+def choose_codec(block, policy=DEFAULT_POLICY):
+    """
+    Picks the codec for a block from its sampled entropy and the policy.
+
+    Policies:
+        'fast': raw for incompressible blocks, LZO for everything else.
+        'balanced': raw for incompressible blocks, zstd for highly compressible ones, LZO in between.
+        'small': zstd for everything but incompressible blocks, at a higher level.
+
+    Without the zstandard package, LZO is used wherever zstd would have been.
+
+    Args:
+        block (bytes): The block to be compressed.
+        policy (str): One of POLICIES.
+
+    Returns:
+        int: One of CODEC_RAW, CODEC_LZO or CODEC_ZSTD.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown codec policy {policy!r}")
+
+    entropy = estimate_entropy(block)
+    if entropy > INCOMPRESSIBLE_ENTROPY:
+        return CODEC_RAW
+    if policy == 'fast' or zstandard is None:
+        return CODEC_LZO
+    if policy == 'small' or entropy < ZSTD_ENTROPY:
+        return CODEC_ZSTD
+    return CODEC_LZO
+
+def encode_block(block, policy=DEFAULT_POLICY, zstd_level=None):
+    """
+    Compresses a single block with the codec that suits it (see choose_codec).
+    A block that would not get smaller is stored raw.
+
+    Args:
+        block (bytes): The block to be compressed.
+        policy (str): One of POLICIES.
+        zstd_level (int): The zstd level; defaults to 3, or 19 under the 'small' policy.
+
+    Returns:
+        tuple: The codec used and the encoded block.
+    """
+    codec = choose_codec(block, policy)
+    if codec == CODEC_LZO:
+        encoded = lzo.compress(block)
+    elif codec == CODEC_ZSTD:
+        level = zstd_level if zstd_level is not None else (19 if policy == 'small' else 3)
+        encoded = zstandard.ZstdCompressor(level=level).compress(block)
+    else:
+        return CODEC_RAW, bytes(block)
+
+    if len(encoded) >= len(block):
+        return CODEC_RAW, bytes(block)
+    return codec, encoded
+
+def decode_block(codec, block):
+    """
+    Decompresses a single block produced by `encode_block`.
+
+    Args:
+        codec (int): The codec recorded for the block.
+        block (bytes): The encoded block.
+
+    Returns:
+        bytes: The original block.
+    """
+    if codec == CODEC_RAW:
+        return bytes(block)
+    if codec == CODEC_LZO:
+        return lzo.decompress(block)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("Block is zstd compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(block)
+    raise ValueError(f"Unknown codec {codec}")
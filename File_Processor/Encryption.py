@@ -1,5 +1,7 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
+import hashlib
+import hmac
 import os
 
 # Function to generate a random symmetric AES key for CTR mode encryption
@@ -42,8 +44,10 @@ def encrypt(data, key):
     cipher = Cipher(algorithms.AES(key), modes.CTR(nonce), backend=default_backend())
     encryptor = cipher.encryptor()  # Create an encryptor object from the cipher.
 
-    # Encrypt the file data (convert string data to bytes before encryption)
-    encrypted_data = encryptor.update(file_data.encode('utf-8')) + encryptor.finalize()
+    # Encrypt the file data (convert string data to bytes before encryption).
+    # CTR is a stream mode, so finalize() never returns data and nothing needs to be appended.
+    encrypted_data = encryptor.update(file_data.encode('utf-8'))
+    encryptor.finalize()
 
     # Return the encrypted data as a tuple containing the nonce, encrypted data, file name, and extension.
     encrypted_tuple = (nonce, encrypted_data, file_name, file_extension)
@@ -76,7 +80,92 @@ def decrypt(encrypted_tuple, key):
     decryptor = cipher.decryptor()  # Create a decryptor object from the cipher.
 
     # Decrypt the encrypted data (the data is in bytes and will be decrypted back to the original data)
-    decrypted_data = decryptor.update(encrypted_data) + decryptor.finalize()
+    decrypted_data = decryptor.update(encrypted_data)
+    decryptor.finalize()  # Returns nothing in CTR mode
 
     # Decode the decrypted data back into a string and return the decrypted content with the file name and extension.
     return decrypted_data.decode('utf-8'), file_name, file_extension
+
+
+# Function to generate a random nonce for a stream of CTR encrypted blocks
+def generate_nonce():
+    '''
+    Generates a random 16-byte nonce for AES in CTR mode.
+    - No parameters are required.
+    - Returns the nonce (bytes); a new one must be used for every file.
+    '''
+    return os.urandom(16)  # AES block size for CTR is 16 bytes (128-bit).
+
+
+# Function to find where a block starts in the CTR counter space
+def counter_block(nonce, block_index):
+    '''
+    Returns the initial counter block for the block at `block_index`.
+    - Parameters:
+      - nonce (bytes): The 16-byte nonce of the stream.
+      - block_index (int): The position of the block in the stream.
+
+    - Returns:
+      - The 16-byte counter block. Every block owns a window of 2**32 AES blocks
+        (64 GiB) of the counter space, so blocks never share keystream and any
+        of them can be encrypted or decrypted on its own.
+    '''
+    counter = (int.from_bytes(nonce, 'big') + (block_index << 32)) % (1 << 128)
+    return counter.to_bytes(16, 'big')
+
+
+# Function to encrypt a single block of a stream using AES in CTR mode
+def encrypt_block(block, key, nonce, block_index):
+    '''
+    Encrypts one block of a stream using AES in CTR mode.
+    - Parameters:
+      - block (bytes): The data to encrypt.
+      - key (bytes): The AES encryption key (256-bit).
+      - nonce (bytes): The 16-byte nonce shared by every block of the stream.
+      - block_index (int): The position of the block in the stream.
+
+    - Returns:
+      - The encrypted block (bytes), the same length as the input.
+    '''
+    cipher = Cipher(algorithms.AES(key), modes.CTR(counter_block(nonce, block_index)), backend=default_backend())
+    encryptor = cipher.encryptor()
+    encrypted_block = encryptor.update(block)  # Accepts memoryviews, so shards need not be copied first
+    encryptor.finalize()  # Returns nothing in CTR mode, so there is nothing to concatenate
+    return encrypted_block
+
+
+# Function to decrypt a single block of a stream using AES in CTR mode
+def decrypt_block(block, key, nonce, block_index):
+    '''
+    Decrypts one block of a stream encrypted with `encrypt_block`.
+    - Parameters:
+      - block (bytes): The data to decrypt.
+      - key (bytes): The AES key (256-bit) used for encryption.
+      - nonce (bytes): The 16-byte nonce shared by every block of the stream.
+      - block_index (int): The position of the block in the stream.
+
+    - Returns:
+      - The decrypted block (bytes).
+    '''
+    cipher = Cipher(algorithms.AES(key), modes.CTR(counter_block(nonce, block_index)), backend=default_backend())
+    decryptor = cipher.decryptor()
+    decrypted_block = decryptor.update(block)
+    decryptor.finalize()  # Returns nothing in CTR mode
+    return decrypted_block
+
+
+# Function to derive a deterministic nonce for content-addressed chunks
+def derive_nonce(key, data):
+    '''
+    Derives a 16-byte CTR nonce from the key and the plaintext it will encrypt.
+    - Parameters:
+      - key (bytes): The AES encryption key (256-bit).
+      - data (bytes): The plaintext the nonce is for.
+
+    - Returns:
+      - The nonce (bytes). The same data under the same key always gets the same
+        nonce, and so the same ciphertext, which is what lets an unchanged chunk be
+        recognised and skipped on re-upload. Different data never shares a nonce
+        (short of an HMAC-SHA256 collision), so the keystream is never reused.
+    '''
+    return hmac.new(key, data, hashlib.sha256).digest()[:16]
@@ -1,5 +1,11 @@
+import asyncio
+import io
+import time
+
+import Container
 import Encoder
 import Encryption
+import Parallel
 import Sharding
 
 '''
@@ -7,22 +13,30 @@ Uploads a file by compressing, encrypting, and sharding the data.
 
 Parameters:
     - file_path (str): The path to the file that needs to be uploaded.
+    - shard_size (int): The size of each shard in bytes.
+    - chunking (str): 'fixed' to cut the encoded file into shards of shard_size bytes (see Upload_Stream),
+      or 'cdc' to cut the file at content-defined boundaries and encode each chunk on its own (see
+      Upload_Chunks). A chunk that did not change since the last upload under the same key comes out
+      as the same shard, so a content-addressed store (Shard_Store) already holds it and
+      DataChain.send_shards skips it.
+    - key (bytes): The symmetric key to encrypt with; a new one if None. Pass the last upload's key
+      to re-upload an edited file with 'cdc'.
 
 Returns:
     - Shards (list of bytes): A list of shards representing the encrypted, compressed data split into chunks.
 '''
-def Upload(file_path):
-    # Step 1: Compress the file using the Encoder module.
-    compressed_data = Encoder.compress_file(file_path)
-    
-    # Step 2: Generate a symmetric key for encryption.
-    key = Encryption.generate_symmetric_key()
-    
-    # Step 3: Encrypt the compressed data using the generated symmetric key.
-    encrypted_data = Encryption.encrypt(compressed_data, key)
-    
-    # Step 4: Shard the encrypted data into chunks of size 1024 bytes using the Sharding module.
-    Shards = Sharding.shard_data(encrypted_data, 1024)
+def Upload(file_path, shard_size=1024, chunking='fixed', key=None):
+    # Step 1: Generate a symmetric key for encryption, unless we are re-uploading under an earlier one.
+    if key is None:
+        key = Encryption.generate_symmetric_key()
+
+    # Step 2: Compress, encrypt and shard the file into chunks of shard_size bytes, or into content-defined chunks.
+    if chunking == 'cdc':
+        Shards = [payload for _, payload in Upload_Chunks(file_path, key)]
+    elif chunking == 'fixed':
+        Shards = list(Upload_Stream(file_path, key, shard_size=shard_size))
+    else:
+        raise ValueError(f"Unknown chunking {chunking!r}")
     # Return the list of shards for storage or transmission.
     return Shards,key
 
@@ -32,19 +46,328 @@ Downloads a file by reconstructing, decrypting, and decompressing the data.
 Parameters:
     - Shards (list of bytes): The list of shards representing the encrypted, compressed data.
     - key (bytes): The symmetric key used for decryption.
+    - erasure (tuple): (data_shards, parity_shards) if the shards were erasure coded; lost shards are then None.
+    - range (tuple): (start, end) to download only bytes start..end-1 of the file. Shards must then be
+      a sequence, and only the shards holding the trailer, the block index and the blocks that cover
+      the range are indexed, so a lazy sequence that fetches shards on access transfers just those.
+      With erasure, the stripes of those shards are read instead, and a stripe is decoded only if one
+      of the shards needed from it was lost.
+    - fetcher (ShardFetcher): A Distributor Fetcher.ShardFetcher to pull the shards from their holders.
+      Shards is then the manifest (the shard IDs in order). A full download fetches every shard in
+      parallel; a range download fetches only the shards it reads. The fetcher's transport connections
+      are closed once the download is done.
+    - shard_table (dict): With a fetcher, maps each shard ID to the IPs of its holders (like Node.shard_table).
+    - chunking (str): How the file was uploaded, 'fixed' or 'cdc' (see Upload). Content-defined chunks
+      carry no block index or parity, so they are always downloaded whole and without erasure coding.
 
 Returns:
-    - decompressed_data (bytes): The original file data after decompression.
-'''
-def Download(Shards, key):
-    # Step 1: Reconstruct the encrypted data from the shards using the Sharding module.
-    encrypted_data = Sharding.reconstruct_data(Shards)
-    
-    # Step 2: Decrypt the reconstructed encrypted data using the provided symmetric key.
-    compressed_data = Encryption.decrypt(encrypted_data, key)
-    
-    # Step 3: Decompress the decrypted data to restore the original file data.
-    decompressed_data = Encoder.decompress_file(compressed_data)
-    
+    - decompressed_data (bytes): The original file data (or the requested range of it) after decompression.
+'''
+def Download(Shards, key, erasure=None, range=None, fetcher=None, shard_table=None, chunking='fixed'):
+    if chunking not in ('fixed', 'cdc'):
+        raise ValueError(f"Unknown chunking {chunking!r}")
+    if chunking == 'cdc' and (erasure or range is not None):
+        raise ValueError("Content-defined chunks are downloaded whole and without erasure coding")
+
+    # Pull the shards from their holders if we were given their IDs.
+    if fetcher is not None:
+        fetched = _FetchedShards(Shards, shard_table, fetcher, erasure)
+        try:
+            Shards = fetched if range is not None else fetched.fetch_all()
+            return Download(Shards, key, erasure, range, chunking=chunking)
+        finally:
+            fetched.close()
+
+    # Content-defined chunks are decoded one by one, each under its own nonce.
+    if chunking == 'cdc':
+        return b''.join(_decode_chunk(payload, key) for payload in Shards)
+
+    # Fetch and decode only the blocks that cover the range, recovering only the stripes they lie in.
+    if range is not None:
+        if erasure:
+            Shards = Sharding.ErasureShards(Shards, *erasure)
+        return _decode_range(Shards, key, *range)
+
+    # Recover lost shards first if the upload carried parity.
+    if erasure:
+        Shards = Sharding.erasure_decode_stream(Shards, *erasure)
+
+    # Decrypt and decompress every block, then join them to restore the original file data.
+    decompressed_data = b''.join(_decode_stream(Shards, key))
+
     # Return the decompressed data, which is the original file content.
     return decompressed_data
+
+'''
+Uploads a file as a stream: the file is read in fixed size blocks, and each block is
+compressed, encrypted and cut into shards before the next one is read. Memory use
+stays around one block no matter how large the file is, and nothing is written to disk.
+
+Parameters:
+    - file_path (str): The path to the file that needs to be uploaded.
+    - key (bytes): The symmetric key to encrypt with (see Encryption.generate_symmetric_key).
+    - block_size (int): The size of the plaintext blocks the file is read in.
+    - shard_size (int): The size of each shard in bytes.
+    - workers (int): How many blocks to compress and encrypt in parallel (defaults to the core count).
+    - use_processes (bool): Run the workers as processes (True) or threads (False).
+    - erasure (tuple): (data_shards, parity_shards) to add Reed-Solomon parity shards, so any
+      data_shards out of every data_shards + parity_shards consecutive shards are enough to download.
+    - codec_policy (str): How hard to compress each block: 'fast', 'balanced' or 'small'
+      (see Encoder.choose_codec). Blocks that are already compressed or encrypted are stored raw.
+    - zstd_level (int): The zstd level for blocks that get zstd (defaults to the policy's).
+    - metrics (Registry): A Session_Layer Metrics.Registry to record how long each block spends being
+      compressed and encrypted in (pipeline_compress_seconds, pipeline_encrypt_seconds).
+
+Returns:
+    - A generator of shards (bytes), yielded as soon as they are produced.
+'''
+def Upload_Stream(file_path, key, block_size=Encoder.DEFAULT_BLOCK_SIZE, shard_size=1024, workers=None, use_processes=True, erasure=None,
+                  codec_policy=Encoder.DEFAULT_POLICY, zstd_level=None, metrics=None):
+    # Every block is encrypted at its own offset under this nonce.
+    nonce = Encryption.generate_nonce()
+
+    # Cut the encoded stream into shards as it is produced.
+    encoded = _encode_stream(file_path, key, nonce, block_size, workers, use_processes, codec_policy, zstd_level, metrics)
+    Shards = Sharding.shard_stream(encoded, shard_size)
+
+    # Add parity stripe by stripe, so losing a holder does not lose the file.
+    if erasure:
+        Shards = Sharding.erasure_code_stream(Shards, shard_size, *erasure)
+    return Shards
+
+'''
+Downloads a file as a stream: shards are consumed as they arrive, and each block is
+decrypted, decompressed and written out as soon as all of its shards have been read.
+
+Parameters:
+    - Shards (iterable of bytes): The shards produced by Upload_Stream, in order.
+    - key (bytes): The symmetric key used for encryption.
+    - output_path (str): Where to write the restored file.
+    - workers (int): How many blocks to decrypt and decompress in parallel (defaults to the core count).
+    - use_processes (bool): Run the workers as processes (True) or threads (False).
+    - erasure (tuple): (data_shards, parity_shards) if the shards were erasure coded; lost shards are then None.
+    - metrics (Registry): A Session_Layer Metrics.Registry to record how long each block spends being
+      decrypted and decompressed in (pipeline_decrypt_seconds, pipeline_decompress_seconds).
+
+Returns:
+    - output_path (str): The path of the restored file.
+'''
+def Download_Stream(Shards, key, output_path, workers=None, use_processes=True, erasure=None, metrics=None):
+    # Recover lost shards stripe by stripe as they arrive.
+    if erasure:
+        Shards = Sharding.erasure_decode_stream(Shards, *erasure)
+
+    with open(output_path, 'wb') as f:
+        for block in _decode_stream(Shards, key, workers, use_processes, metrics):
+            f.write(block)
+    return output_path
+
+'''
+Uploads a file in content-defined chunks, for files that are uploaded again after small edits.
+Chunk boundaries are picked by the content (see Sharding.cdc_shard_data), and each chunk is
+compressed and encrypted deterministically, so an unchanged chunk produces the same payload
+and the same chunk ID as last time and does not have to be sent again.
+
+Parameters:
+    - file_path (str): The path to the file that needs to be uploaded.
+    - key (bytes): The symmetric key to encrypt with; reuse it across uploads of the same file.
+    - known (set of str): IDs of chunks the holders already have, typically the previous manifest.
+    - min_size, avg_size, max_size (int): Chunk size bounds, see Sharding.cdc_shard_data.
+    - workers (int): How many chunks to compress and encrypt in parallel (defaults to the core count).
+    - use_processes (bool): Run the workers as processes (True) or threads (False).
+    - codec_policy (str): How hard to compress each chunk: 'fast', 'balanced' or 'small'
+      (see Encoder.choose_codec). The codec is a function of the chunk, so payloads stay deterministic.
+    - zstd_level (int): The zstd level for chunks that get zstd (defaults to the policy's).
+
+Returns:
+    - A generator of (chunk_id, payload) in file order, where payload is None for known chunks.
+      The chunk IDs, in order, are the manifest Download_Chunks needs.
+'''
+def Upload_Chunks(file_path, key, known=frozenset(), min_size=Sharding.CDC_MIN_SIZE, avg_size=Sharding.CDC_AVG_SIZE,
+                  max_size=Sharding.CDC_MAX_SIZE, workers=None, use_processes=True, codec_policy=Encoder.DEFAULT_POLICY,
+                  zstd_level=None):
+    # Step 1: Cut the file at content-defined boundaries, straight from the page cache.
+    chunks = Sharding.cdc_shard_file(file_path, min_size, avg_size, max_size)
+
+    # Step 2: Compress and encrypt every chunk in parallel, then skip the ones already held.
+    tasks = ((bytes(chunk), key, codec_policy, zstd_level) for chunk in chunks)
+    for chunk_id, payload in Parallel.ordered_map(_encode_chunk, tasks, workers, use_processes):
+        yield chunk_id, (None if chunk_id in known else payload)
+
+'''
+Downloads a file uploaded with Upload_Chunks, writing each chunk out as it is decoded.
+
+Parameters:
+    - manifest (list of str): The chunk IDs of the file, in order.
+    - chunks: A mapping from chunk ID to payload (anything that supports chunks[chunk_id]).
+    - key (bytes): The symmetric key used for encryption.
+    - output_path (str): Where to write the restored file.
+
+Returns:
+    - output_path (str): The path of the restored file.
+'''
+def Download_Chunks(manifest, chunks, key, output_path):
+    with open(output_path, 'wb') as f:
+        for chunk_id in manifest:
+            payload = chunks[chunk_id]
+
+            # Chunk IDs are content addresses, so a corrupted or substituted payload is caught here.
+            if Sharding.shard_id(payload) != chunk_id:
+                raise ValueError(f"Chunk {chunk_id} does not match its contents")
+            f.write(_decode_chunk(payload, key))
+    return output_path
+
+def _encode_stream(file_path, key, nonce, block_size, workers=None, use_processes=True,
+                   codec_policy=Encoder.DEFAULT_POLICY, zstd_level=None, metrics=None):
+    # Header first, so the reader knows the nonce before any block arrives.
+    header = Container.pack_header(nonce, block_size)
+    yield header
+
+    offset = len(header)  # Position in the stream, for the block index
+    index = []  # (offset, length, codec) of every payload
+    plaintext_size = 0
+
+    # Blocks are independent, so they are encoded in parallel and come back in upload order.
+    tasks = ((block, key, nonce, i, codec_policy, zstd_level)
+             for i, block in enumerate(Encoder.read_blocks(file_path, block_size)))
+    for payload, block_length, codec, timings in Parallel.ordered_map(_encode_block, tasks, workers, use_processes):
+        _record(metrics, ('compress', 'encrypt'), timings)
+
+        # Frame the payload so the reader knows where it ends and how to decompress it.
+        yield Container.pack_frame_header(payload, codec)
+        yield payload
+
+        index.append((offset + Container.FRAME_HEADER.size, len(payload), codec))
+        offset += Container.FRAME_HEADER.size + len(payload)
+        plaintext_size += block_length
+
+    yield Container.END_FRAME
+    offset += len(Container.END_FRAME)
+
+    # The index and trailer come last, since they are only known once every block is encoded.
+    yield Container.pack_index(index)
+    yield Container.pack_trailer(plaintext_size, offset, len(index))
+
+def _decode_stream(Shards, key, workers=None, use_processes=True, metrics=None):
+    # Read the stream back out of the shards as they come in.
+    reader = Sharding.ShardReader(Shards)
+    nonce, block_size = Container.read_header(reader)
+
+    # Frames are split off in order here and decoded in parallel.
+    tasks = ((payload, key, nonce, index, codec) for index, (codec, payload) in enumerate(Container.iter_frames(reader)))
+    for block, timings in Parallel.ordered_map(_decode_block, tasks, workers, use_processes):
+        _record(metrics, ('decrypt', 'decompress'), timings)
+        yield block
+
+def _decode_range(Shards, key, start, end):
+    # Step 1: Read the header (which checks the layout version) and the trailer to find the block size and the index.
+    nonce, block_size = Container.read_header(io.BytesIO(Sharding.read_range(Shards, 0, Container.HEADER.size)))
+    trailer_offset = Sharding.stream_size(Shards) - Container.TRAILER.size
+    plaintext_size, index_offset, block_count = Container.read_trailer(
+        Sharding.read_range(Shards, trailer_offset, Container.TRAILER.size))
+
+    # Step 2: Read the index entries of the blocks that cover the range.
+    start, end = max(start, 0), min(end, plaintext_size)
+    if start >= end:
+        return b''
+    first, last = start // block_size, (end - 1) // block_size
+    index = Container.unpack_index(
+        Sharding.read_range(Shards, index_offset + first * Container.INDEX_ENTRY.size,
+                            (last - first + 1) * Container.INDEX_ENTRY.size),
+        last - first + 1)
+
+    # Step 3: Decrypt and decompress just those blocks, each at its own counter offset.
+    blocks = []
+    for block_index, (offset, length, codec) in enumerate(index, first):
+        payload = Sharding.read_range(Shards, offset, length)
+        blocks.append(_decode_block(payload, key, nonce, block_index, codec)[0])
+
+    # Step 4: Trim the first and last block to the range.
+    data = b''.join(blocks)
+    return data[start - first * block_size: end - first * block_size]
+
+def _encode_block(block, key, nonce, index, codec_policy=Encoder.DEFAULT_POLICY, zstd_level=None):
+    # Step 1: Compress the block with the codec that suits its contents.
+    start = time.perf_counter()
+    codec, compressed_block = Encoder.encode_block(block, codec_policy, zstd_level)
+    compressed = time.perf_counter()
+
+    # Step 2: Encrypt the compressed block at its own offset in the CTR counter space.
+    payload = Encryption.encrypt_block(compressed_block, key, nonce, index)
+
+    # Step 3: Return the stage timings with the payload, since the block may have been encoded in another process.
+    return payload, len(block), codec, (compressed - start, time.perf_counter() - compressed)
+
+def _decode_block(payload, key, nonce, index, codec):
+    # Step 1: Decrypt the block using the provided symmetric key.
+    start = time.perf_counter()
+    compressed_block = Encryption.decrypt_block(payload, key, nonce, index)
+    decrypted = time.perf_counter()
+
+    # Step 2: Decompress the block with the codec recorded in its frame header.
+    block = Encoder.decode_block(codec, compressed_block)
+    return block, (decrypted - start, time.perf_counter() - decrypted)
+
+def _record(metrics, stages, timings):
+    # Records how long one block spent in each pipeline stage, if a metrics registry was given.
+    if metrics is not None:
+        for stage, seconds in zip(stages, timings):
+            metrics.histogram(f'pipeline_{stage}_seconds', f'Time to {stage} one block').observe(seconds)
+
+def _encode_chunk(chunk, key, codec_policy=Encoder.DEFAULT_POLICY, zstd_level=None):
+    # Step 1: Compress the chunk with the codec that suits its contents.
+    codec, compressed_chunk = Encoder.encode_block(chunk, codec_policy, zstd_level)
+
+    # Step 2: Encrypt it under a nonce derived from its contents, so the payload is deterministic.
+    nonce = Encryption.derive_nonce(key, chunk)
+    payload = Container.CHUNK_HEADER.pack(nonce, codec) + Encryption.encrypt_block(compressed_chunk, key, nonce, 0)
+
+    # Step 3: Name the payload by its contents.
+    return Sharding.shard_id(payload), payload
+
+def _decode_chunk(payload, key):
+    # The nonce and the codec travel in front of the encrypted chunk.
+    nonce, codec = Container.CHUNK_HEADER.unpack_from(payload)
+    compressed_chunk = Encryption.decrypt_block(payload[Container.CHUNK_HEADER.size:], key, nonce, 0)
+    return Encoder.decode_block(codec, compressed_chunk)
+
+class _FetchedShards:
+    # The shards of a manifest, pulled from their holders through a ShardFetcher. Indexing fetches one
+    # shard (as the range reader needs); fetch_all() fetches them all in parallel. Every fetch runs on
+    # this object's own event loop, so the transport's pooled connections last the whole download.
+    # With erasure coding a shard no holder supplied is None, for the decoder to recover.
+
+    def __init__(self, manifest, shard_table, fetcher, erasure=None):
+        self.manifest = manifest
+        self.shard_table = shard_table
+        self.fetcher = fetcher
+        self.erasure = erasure
+        self._loop = asyncio.new_event_loop()
+        self._shards = {}  # Index -> shard, for the shards fetched on access
+
+    def fetch_all(self):
+        # Every shard in manifest order.
+        shards = [None] * len(self.manifest)
+        fetch = self.fetcher.fetch(self.manifest, self.shard_table, shards.__setitem__)
+        missing = self._loop.run_until_complete(fetch)
+        if missing and not self.erasure:
+            raise ValueError(f"No holder supplied shards {missing}")
+        return shards
+
+    def close(self):
+        self._loop.run_until_complete(self.fetcher.transport.close())
+        self._loop.close()
+
+    def __len__(self):
+        return len(self.manifest)
+
+    def __getitem__(self, index):
+        index = range(len(self.manifest))[index]  # Negative indexes count from the end
+        if index not in self._shards:
+            shard_id = self.manifest[index]
+            fetch = self.fetcher.fetch_shard(shard_id, self.shard_table.get(shard_id, ()))
+            shard = self._loop.run_until_complete(fetch)
+            if shard is None and not self.erasure:
+                raise ValueError(f"No holder supplied shard {index}")
+            self._shards[index] = shard
+        return self._shards[index]
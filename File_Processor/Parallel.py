@@ -0,0 +1,54 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+
+def default_workers():
+    """
+    Returns the number of workers to use when none is configured.
+
+    Returns:
+        int: The number of CPU cores available to this process.
+    """
+    try:
+        return len(os.sched_getaffinity(0))  # Respects CPU pinning where supported
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def ordered_map(function, arguments, workers=None, use_processes=True):
+    """
+    Runs `function` over a stream of argument tuples in a worker pool and yields
+    the results in input order.
+
+    Only about two tasks per worker are in flight at any time, so a long input is
+    never read far ahead of the consumer and memory stays bounded.
+
+    Args:
+        function (callable): A module level function (it must be picklable for process pools).
+        arguments (iterable of tuple): The positional arguments for each call.
+        workers (int): The number of workers; defaults to the number of CPU cores.
+            With a single worker everything runs in the calling thread.
+        use_processes (bool): Use a process pool (True) or a thread pool (False).
+
+    Yields:
+        The result of each call, in the same order as `arguments`.
+    """
+    workers = workers or default_workers()
+    if workers == 1:
+        for args in arguments:
+            yield function(*args)
+        return
+
+    Executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    pool = Executor(max_workers=workers)
+    try:
+        pending = deque()  # Futures in submission order
+        for args in arguments:
+            pending.append(pool.submit(function, *args))
+            if len(pending) >= workers * 2:  # Window is full, wait for the oldest task
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Also reached when the consumer stops early; drop whatever has not started yet.
+        pool.shutdown(wait=True, cancel_futures=True)
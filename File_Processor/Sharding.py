@@ -1,4 +1,42 @@
+from functools import lru_cache
+import hashlib
 import math
+import mmap
+
+import numpy as np
+
+# Arithmetic in GF(2^8) with the polynomial x^8 + x^4 + x^3 + x^2 + 1 (0x11d),
+# used by the Reed-Solomon erasure coding below. Addition is XOR; multiplication
+# goes through a full 256 x 256 table so a whole array of bytes can be multiplied
+# by a constant with one NumPy indexing operation.
+_GF_EXP = np.zeros(512, dtype=np.uint8)
+_GF_LOG = np.zeros(256, dtype=np.int32)
+_value = 1
+for _power in range(255):
+    _GF_EXP[_power] = _value
+    _GF_LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x11d
+_GF_EXP[255:510] = _GF_EXP[:255]  # So the sum of two logs never needs a modulo
+_GF_MUL = _GF_EXP[_GF_LOG[:, None] + _GF_LOG[None, :]]
+_GF_MUL[0, :] = 0
+_GF_MUL[:, 0] = 0
+
+# Number of stripes erasure coded together in one vectorized call when streaming
+ERASURE_BATCH = 64
+
+# Content-defined chunking (FastCDC). A Gear rolling hash is computed at every
+# byte and a chunk ends wherever the hash matches a mask, so boundaries depend
+# only on the bytes around them and survive insertions and deletions elsewhere.
+# The Gear table is derived from SHA-256 so every node cuts the same way.
+_GEAR = np.array([int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)],
+                 dtype=np.uint64)
+CDC_WINDOW = 64  # Bytes that feed the hash at each position (all 64 bits of the Gear hash)
+CDC_SEGMENT = 64 * 1024  # Bytes hashed per vectorized pass; small enough for the hashes to stay in cache
+CDC_MIN_SIZE = 2 * 1024
+CDC_AVG_SIZE = 8 * 1024
+CDC_MAX_SIZE = 64 * 1024
 
 # Function to shard data into smaller chunks
 def shard_data(data, shard_size=1024):
@@ -10,27 +48,642 @@ def shard_data(data, shard_size=1024):
         - shard_size (int): The size of each shard in bytes (default is 1024 bytes).
         
     Returns:
-        - List of shards, each a byte string representing a chunk of the original data.
+        - List of shards, each a memoryview over a chunk of the original data (no bytes are copied).
     """
     # Calculate the total number of shards required
     total_size = len(data)
     num_shards = math.ceil(total_size / shard_size)
 
-    # Use a list comprehension to split the data into shards efficiently
-    shards = [data[i * shard_size: (i + 1) * shard_size] for i in range(num_shards)]
+    # Slice a memoryview rather than the data itself, so every shard shares the original buffer
+    view = memoryview(data)
+    shards = [view[i * shard_size: (i + 1) * shard_size] for i in range(num_shards)]
     return shards
 
 
+# Function to shard a file straight from the page cache
+def shard_file(file_path, shard_size=1024):
+    """
+    Shards a file without reading it into memory, by slicing a read-only mmap of it.
+
+    Parameters:
+        - file_path (str): The path to the file to be split into shards.
+        - shard_size (int): The size of each shard in bytes (default is 1024 bytes).
+
+    Returns:
+        - List of shards, each a memoryview over the mapped file; the mapping stays
+          open for as long as any shard is referenced.
+    """
+    return shard_data(_map_file(file_path), shard_size)
+
+
 # Function to reconstruct data from shards
-def reconstruct_data(shards):
+def reconstruct_data(shards, data_shards=None, parity_shards=0, data_size=None):
     """
     Reconstructs the original data from the shards.
 
     Parameters:
-        - shards (list of bytes): The list of byte strings representing the shards.
-        
+        - shards (list of bytes): The list of byte strings representing the shards, or a dict
+          mapping each shard's index to it when they arrived out of order (`data_size` is then required).
+        - data_shards (int): For shards made by `erasure_shard_data`, the number of data shards per stripe.
+          Lost shards are then given as None, and any `data_shards` survivors of each stripe are enough.
+        - parity_shards (int): For erasure coded shards, the number of parity shards per stripe.
+        - data_size (int): The length of the original data. With a dict it says how many shards there
+          should be, so a missing one is caught even at the end; for erasure coded shards it drops the padding.
+
+    Returns:
+        - The original data as bytes after reconstructing from the shards
+          (a bytearray, filled in place, when the shards were given as a dict).
+    """
+    if isinstance(shards, dict):
+        if data_size is None:
+            # Without it a missing last shard would just look like a shorter file
+            raise ValueError("Reconstructing from a dict of shards needs data_size")
+        # Place each shard straight at its offset in one preallocated buffer
+        shard_size = max(len(shard) for shard in shards.values()) if shards else 1
+        assembler = ShardAssembler(data_size, shard_size)
+        for index, shard in shards.items():
+            assembler.write(index, shard)
+        if not assembler.complete:
+            raise ValueError(f"Shards {assembler.missing()} are missing")
+        return assembler.close()
+
+    if data_shards is None:
+        # Join the shards back into the original data using a single operation for efficiency
+        return b''.join(shards)
+
+    # Recover every stripe and drop the zero padding of the last one
+    data = b''.join(erasure_decode_stream(shards, data_shards, parity_shards))
+    return data[:data_size] if data_size is not None else data
+
+
+# Function to shard a stream of data without holding all of it in memory
+def shard_stream(chunks, shard_size=1024):
+    """
+    Re-buffers an iterable of byte chunks into shards of a fixed size.
+
+    Parameters:
+        - chunks (iterable of bytes): The data to be sharded, in order, in chunks of any size.
+        - shard_size (int): The size of each shard in bytes (default is 1024 bytes).
+
+    Yields:
+        - Each shard as soon as it is full; only the last one may be shorter than `shard_size`.
+    """
+    pending = bytearray()  # Tail of the previous chunks that did not fill a whole shard
+    for chunk in chunks:
+        view = memoryview(chunk)
+        start = 0
+        if pending:
+            # Top up the partial shard first; only these few bytes are ever copied
+            start = shard_size - len(pending)
+            pending += view[:start]
+            if len(pending) < shard_size:
+                continue
+            yield bytes(pending)
+            pending = bytearray()
+
+        # Whole shards are yielded as views into the chunk itself
+        end = start + (len(view) - start) // shard_size * shard_size
+        for offset in range(start, end, shard_size):
+            yield view[offset: offset + shard_size]
+        pending += view[end:]
+
+    if pending:
+        yield bytes(pending)
+
+
+# Function to read part of a sharded stream
+def read_range(shards, offset, length):
+    """
+    Reads a range of bytes out of a sharded stream, touching only the shards that cover it.
+
+    Parameters:
+        - shards (sequence of bytes): The shards of the stream, all the same size but the last.
+          Only the shards covering the range are indexed, so this can be a lazy sequence
+          that fetches each shard from its holder on access.
+        - offset (int): Where the range starts in the stream.
+        - length (int): The number of bytes to read.
+
+    Returns:
+        - The bytes of the range.
+    """
+    if length <= 0:
+        return b''
+
+    shard_size = len(shards[0])
+    first = offset // shard_size
+    last = (offset + length - 1) // shard_size
+    data = b''.join(shards[i] for i in range(first, last + 1))
+
+    start = offset - first * shard_size
+    if len(data) < start + length:
+        raise ValueError("Range runs past the end of the shards")
+    return data[start: start + length]
+
+
+# Function to find the length of a sharded stream without reading it
+def stream_size(shards):
+    """
+    Returns the length of a sharded stream from its first and last shard only.
+
+    Parameters:
+        - shards (sequence of bytes): The shards of the stream, all the same size but the last.
+
     Returns:
-        - The original data as bytes after reconstructing from the shards.
+        - The total number of bytes in the shards.
+    """
+    if not len(shards):
+        return 0
+    return (len(shards) - 1) * len(shards[0]) + len(shards[-1])
+
+
+class ShardReader:
+    """
+    File-like reader over an iterable of shards, used to parse a stream back out
+    of its shards while they are still arriving.
+    """
+
+    def __init__(self, shards):
+        """
+        Parameters:
+            - shards (iterable of bytes): The shards of the stream, in order.
+        """
+        self._shards = iter(shards)
+        self._current = b''  # Unread part of the current shard
+
+    def read(self, size):
+        """
+        Reads up to `size` bytes, pulling in as many shards as needed.
+
+        Parameters:
+            - size (int): The number of bytes to read.
+
+        Returns:
+            - The bytes read; shorter than `size` only once the shards run out.
+        """
+        parts = []
+        while size > 0:
+            if not self._current:
+                self._current = next(self._shards, b'')
+                if not self._current:  # No shards left
+                    break
+            part = self._current[:size]
+            self._current = self._current[size:]
+            parts.append(part)
+            size -= len(part)
+        return b''.join(parts)
+
+
+class ShardAssembler:
+    """
+    Reassembles data by writing each shard straight to its offset in one
+    preallocated buffer, in whatever order the shards arrive.
     """
-    # Join the shards back into the original data using a single operation for efficiency
-    return b''.join(shards)
+
+    def __init__(self, size, shard_size=1024, output_path=None):
+        """
+        Parameters:
+            - size (int): The total size of the data being reassembled.
+            - shard_size (int): The size of every shard but the last.
+            - output_path (str): If given, the buffer is an mmap of this file (created or truncated),
+              so the data goes straight to the page cache instead of the heap.
+        """
+        self.size = size
+        self.shard_size = shard_size
+        self.num_shards = math.ceil(size / shard_size)
+        self._received = set()  # Indexes of the shards written so far
+        self._file = None
+
+        if output_path is None or size == 0:  # Empty files cannot be mapped
+            self.buffer = bytearray(size)
+            if output_path is not None:
+                open(output_path, 'wb').close()
+        else:
+            self._file = open(output_path, 'w+b')
+            self._file.truncate(size)
+            self.buffer = mmap.mmap(self._file.fileno(), size)
+        self._view = memoryview(self.buffer)
+
+    def write(self, index, shard):
+        """
+        Copies one shard into its place in the buffer.
+
+        Parameters:
+            - index (int): The position of the shard in the data.
+            - shard (bytes-like): The shard itself.
+        """
+        if not 0 <= index < self.num_shards:
+            raise IndexError(f"Shard index {index} is out of range")
+        offset = index * self.shard_size
+        expected = min(self.shard_size, self.size - offset)
+        if len(shard) != expected:
+            raise ValueError(f"Shard {index} should be {expected} bytes, got {len(shard)}")
+
+        self._view[offset: offset + expected] = shard
+        self._received.add(index)
+
+    @property
+    def complete(self):
+        """True once every shard has been written."""
+        return len(self._received) == self.num_shards
+
+    def missing(self):
+        """
+        Returns:
+            - The indexes of the shards that have not been written yet, in order.
+        """
+        return [i for i in range(self.num_shards) if i not in self._received]
+
+    def close(self):
+        """
+        Releases the buffer; for a file-backed buffer the data is flushed to disk.
+
+        Returns:
+            - The in-memory bytearray, or None when writing to a file.
+        """
+        self._view.release()
+        if self._file is None:
+            return self.buffer
+
+        self.buffer.flush()
+        self.buffer.close()
+        self._file.close()
+        return None
+
+
+class ErasureShards:
+    """
+    Lazy sequence of the data shards of an erasure coded stream, for `read_range`.
+
+    Only the stripes holding the shards that are indexed are read. A data shard
+    that survived is returned as is, and a lost one is recovered from the rest of
+    its stripe, so a range costs the stripes that cover it and not the whole
+    stream. The zero padding `erasure_code_stream` adds to the last stripe is
+    dropped, which assumes the stream does not end in a zero byte (a D_Net stream
+    ends with its trailer's magic).
+    """
+
+    def __init__(self, shards, data_shards=4, parity_shards=2):
+        """
+        Parameters:
+            - shards (sequence of bytes or None): The shards of every stripe in order, None for each lost shard.
+              Only the shards of the stripes that are read are indexed, so this can be a lazy sequence.
+            - data_shards (int): Data shards per stripe (k).
+            - parity_shards (int): Parity shards per stripe (n - k).
+        """
+        if len(shards) % (data_shards + parity_shards):
+            raise ValueError("Shard sequence ends in the middle of a stripe")
+        self._shards = shards
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        self._recovered = {}  # Stripe -> its data shards, for the stripes that had to be decoded
+
+        # The last stripe ends in padding; find the last shard with stream data in it
+        self._count = len(shards) // (data_shards + parity_shards) * data_shards
+        self._last = b''
+        while self._count:
+            self._last = bytes(self._data_shard(self._count - 1)).rstrip(b'\0')
+            if self._last:
+                break
+            self._count -= 1
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        index = range(self._count)[index]  # Negative indexes count from the end
+        if index == self._count - 1:
+            return self._last
+        return self._data_shard(index)
+
+    def _data_shard(self, index):
+        stripe, position = divmod(index, self.data_shards)
+        width = self.data_shards + self.parity_shards
+        shard = self._shards[stripe * width + position]
+        if shard is not None:
+            return shard
+        if stripe not in self._recovered:
+            shards = [self._shards[i] for i in range(stripe * width, (stripe + 1) * width)]
+            self._recovered[stripe] = _recover_stripe(shards, self.data_shards, self.parity_shards)
+        return self._recovered[stripe][position]
+
+
+# Function to name a shard by its contents
+def shard_id(shard):
+    """
+    Returns the content address of a shard.
+
+    Parameters:
+        - shard (bytes): The shard.
+
+    Returns:
+        - The hex SHA-256 digest of the shard, so identical shards always get the same ID.
+    """
+    return hashlib.sha256(shard).hexdigest()
+
+
+# Function to shard data at content-defined boundaries
+def cdc_shard_data(data, min_size=CDC_MIN_SIZE, avg_size=CDC_AVG_SIZE, max_size=CDC_MAX_SIZE):
+    """
+    Shards the data into variable sized chunks whose boundaries are picked by the content (FastCDC).
+
+    An edit only changes the chunks around it: the boundaries before and after it
+    are found again at the same bytes, so re-uploading a modified file only sends
+    the chunks that changed.
+
+    Parameters:
+        - data (bytes): The original data to be split into chunks (any buffer, including an mmap).
+        - min_size (int): The smallest chunk, except for the last one.
+        - avg_size (int): The chunk size aimed for; a power of two.
+        - max_size (int): The largest chunk; a boundary is forced here if the content gives none.
+
+    Returns:
+        - List of chunks, each a memoryview over the original data.
+    """
+    view = memoryview(data)
+    start = 0
+    chunks = []
+    for end in cdc_boundaries(data, min_size, avg_size, max_size):
+        chunks.append(view[start:end])
+        start = end
+    return chunks
+
+
+# Function to shard a file at content-defined boundaries straight from the page cache
+def cdc_shard_file(file_path, min_size=CDC_MIN_SIZE, avg_size=CDC_AVG_SIZE, max_size=CDC_MAX_SIZE):
+    """
+    Like `cdc_shard_data`, over a read-only mmap of the file.
+
+    Parameters:
+        - file_path (str): The path to the file to be split into chunks.
+        - min_size, avg_size, max_size (int): As for `cdc_shard_data`.
+
+    Returns:
+        - List of chunks, each a memoryview over the mapped file.
+    """
+    return cdc_shard_data(_map_file(file_path), min_size, avg_size, max_size)
+
+
+# Function to find the content-defined chunk boundaries of some data
+def cdc_boundaries(data, min_size=CDC_MIN_SIZE, avg_size=CDC_AVG_SIZE, max_size=CDC_MAX_SIZE):
+    """
+    Finds where the content-defined chunks of the data end.
+
+    Uses FastCDC's normalized chunking: before `avg_size` a boundary needs a
+    hash matching a stricter mask, after it a looser one, which pulls chunk
+    sizes towards the average.
+
+    Parameters:
+        - data (bytes): The data to be chunked.
+        - min_size, avg_size, max_size (int): As for `cdc_shard_data`.
+
+    Returns:
+        - List of the end offsets of the chunks, in order; the last one is `len(data)`.
+    """
+    if not 0 < min_size <= avg_size <= max_size:
+        raise ValueError("Chunk sizes must satisfy 0 < min_size <= avg_size <= max_size")
+
+    size = len(data)
+    bits = max(avg_size.bit_length() - 1, 3)
+    strict, loose = _cdc_candidates(data, _cdc_mask(bits + 2), _cdc_mask(bits - 2))
+
+    boundaries = []
+    start = 0
+    while start < size:
+        if size - start <= min_size:
+            end = size
+        else:
+            # First strict match between min and avg, else the first loose match up to max
+            end = (_first_between(strict, start + min_size, min(start + avg_size, size))
+                   or _first_between(loose, start + avg_size, min(start + max_size, size))
+                   or min(start + max_size, size))
+        boundaries.append(end)
+        start = end
+    return boundaries
+
+
+# Function to shard data with Reed-Solomon parity
+def erasure_shard_data(data, shard_size=1024, data_shards=4, parity_shards=2):
+    """
+    Shards the data with k-of-n Reed-Solomon erasure coding.
+
+    The data is cut into stripes of `data_shards` shards, and each stripe gets
+    `parity_shards` parity shards, so it survives the loss of any `parity_shards`
+    of its shards.
+
+    Parameters:
+        - data (bytes): The original data to be split into shards.
+        - shard_size (int): The size of each shard in bytes (default is 1024 bytes).
+        - data_shards (int): Data shards per stripe (k).
+        - parity_shards (int): Parity shards per stripe (n - k).
+
+    Returns:
+        - List of shards; each consecutive group of `data_shards + parity_shards` is one stripe,
+          data shards first. The last stripe is zero padded, so keep `len(data)` for `reconstruct_data`.
+    """
+    stripe_size = data_shards * shard_size
+    num_stripes = max(1, math.ceil(len(data) / stripe_size))
+
+    # Lay the data out as (stripe, shard, byte) so each stripe can be encoded at once
+    stripes = np.zeros(num_stripes * stripe_size, dtype=np.uint8)
+    stripes[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    stripes = stripes.reshape(num_stripes, data_shards, shard_size)
+
+    parity = _gf_matmul(_parity_matrix(data_shards, parity_shards), stripes)
+    encoded = np.concatenate([stripes, parity], axis=1)
+    return [shard.tobytes() for stripe in encoded for shard in stripe]
+
+
+# Function to erasure code a stream of shards
+def erasure_code_stream(shards, shard_size=1024, data_shards=4, parity_shards=2):
+    """
+    Adds Reed-Solomon parity to a stream of shards, such as the one from `shard_stream`.
+
+    Parameters:
+        - shards (iterable of bytes): The data shards, in order; short shards are zero padded.
+        - shard_size (int): The size of each shard in bytes.
+        - data_shards (int): Data shards per stripe (k).
+        - parity_shards (int): Parity shards per stripe (n - k).
+
+    Yields:
+        - The shards of each stripe, data shards first and then parity shards.
+    """
+    matrix = _parity_matrix(data_shards, parity_shards)
+    batch = np.zeros((ERASURE_BATCH, data_shards, shard_size), dtype=np.uint8)
+    filled = 0  # Data shards placed in the current batch
+
+    for shard in shards:
+        stripe, index = divmod(filled, data_shards)
+        batch[stripe, index, :len(shard)] = np.frombuffer(shard, dtype=np.uint8)
+        batch[stripe, index, len(shard):] = 0
+        filled += 1
+        if filled == ERASURE_BATCH * data_shards:
+            yield from _emit_stripes(batch, matrix)
+            filled = 0
+
+    if filled:
+        # Pad out the last stripe with empty shards
+        stripes = math.ceil(filled / data_shards)
+        batch.reshape(-1, shard_size)[filled: stripes * data_shards] = 0
+        yield from _emit_stripes(batch[:stripes], matrix)
+
+
+# Function to recover the data shards of a stream of erasure coded shards
+def erasure_decode_stream(shards, data_shards=4, parity_shards=2):
+    """
+    Recovers the data shards from a stream of erasure coded shards.
+
+    Parameters:
+        - shards (iterable of bytes or None): The shards of every stripe in order, None for each lost shard.
+        - data_shards (int): Data shards per stripe (k).
+        - parity_shards (int): Parity shards per stripe (n - k).
+
+    Yields:
+        - The data shards of each stripe, in order (including the padding of the last stripe).
+    """
+    stripe = []
+    for shard in shards:
+        stripe.append(shard)
+        if len(stripe) == data_shards + parity_shards:
+            yield from _recover_stripe(stripe, data_shards, parity_shards)
+            stripe = []
+
+    if stripe:
+        raise ValueError("Shard stream ended in the middle of a stripe")
+
+
+def _emit_stripes(stripes, matrix):
+    # Yields the data and parity shards of a batch of stripes
+    parity = _gf_matmul(matrix, stripes)
+    for data, checks in zip(stripes, parity):
+        for shard in data:
+            yield shard.tobytes()
+        for shard in checks:
+            yield shard.tobytes()
+
+
+def _recover_stripe(stripe, data_shards, parity_shards):
+    # Returns the data shards of one stripe, solving for any that were lost
+    missing = [i for i in range(data_shards) if stripe[i] is None]
+    if not missing:
+        return stripe[:data_shards]
+
+    present = [i for i, shard in enumerate(stripe) if shard is not None]
+    if len(present) < data_shards:
+        raise ValueError(f"Only {len(present)} shards of a stripe survived, {data_shards} are needed")
+
+    chosen = tuple(present[:data_shards])
+    survivors = np.stack([np.frombuffer(stripe[i], dtype=np.uint8) for i in chosen])
+
+    # Only solve for the rows that were actually lost
+    decode = _decode_matrix(data_shards, parity_shards, chosen)
+    recovered = _gf_matmul(decode[missing], survivors)
+
+    data = list(stripe[:data_shards])
+    for row, index in enumerate(missing):
+        data[index] = recovered[row].tobytes()
+    return data
+
+
+def _map_file(file_path):
+    # Read-only mmap of a whole file (an empty bytes object for an empty file, which cannot be mapped)
+    with open(file_path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _gear_hashes(data):
+    # Gear hash at every position of a uint8 array: h[i] = sum(GEAR[data[i - j]] << j for j < 64),
+    # the same value the byte-at-a-time FastCDC loop reaches, built in log2(64) vectorized passes
+    # by doubling the window: h_2w[i] = h_w[i] + (h_w[i - w] << w).
+    hashes = _GEAR[data]
+    width = 1
+    while width < CDC_WINDOW:
+        # The shifted copy is taken before the add, so the add reads only the old values
+        hashes[width:] += hashes[:-width] << np.uint64(width)  # Wraps modulo 2**64 like the scalar hash
+        width *= 2
+    return hashes
+
+
+def _cdc_mask(bits):
+    # Mask with `bits` ones spread evenly over the top 48 bits of the hash, so every
+    # boundary decision depends on a window of bytes rather than just the last few
+    bits = min(max(bits, 1), 48)
+    mask = 0
+    for i in range(bits):
+        mask |= 1 << (63 - i * 48 // bits)
+    return np.uint64(mask)
+
+
+def _cdc_candidates(data, strict_mask, loose_mask):
+    # Positions just after every byte whose hash matches each mask, hashed a segment at a time
+    # (each segment starts with the window of bytes before it, so results match hashing it all)
+    view = np.frombuffer(data, dtype=np.uint8) if len(data) else np.zeros(0, dtype=np.uint8)
+    strict, loose = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for segment in range(0, len(view), CDC_SEGMENT):
+        lead = min(segment, CDC_WINDOW - 1)
+        hashes = _gear_hashes(view[segment - lead: segment + CDC_SEGMENT])[lead:]
+        strict.append(np.flatnonzero((hashes & strict_mask) == 0) + segment + 1)
+        loose.append(np.flatnonzero((hashes & loose_mask) == 0) + segment + 1)
+    return np.concatenate(strict), np.concatenate(loose)
+
+
+def _first_between(positions, low, high):
+    # Smallest position in the sorted array within [low, high], or None
+    i = np.searchsorted(positions, low)
+    if i < len(positions) and positions[i] <= high:
+        return int(positions[i])
+    return None
+
+
+def _gf_inverse(value):
+    # Multiplicative inverse of a non-zero field element
+    return int(_GF_EXP[255 - _GF_LOG[value]])
+
+
+@lru_cache(maxsize=None)
+def _parity_matrix(data_shards, parity_shards):
+    # Cauchy matrix: every square submatrix of [identity; parity matrix] is invertible,
+    # which is what makes any `data_shards` surviving shards enough.
+    if data_shards + parity_shards > 256:
+        raise ValueError("GF(256) supports at most 256 shards per stripe")
+    rows = [[_gf_inverse((data_shards + i) ^ j) for j in range(data_shards)] for i in range(parity_shards)]
+    return np.array(rows, dtype=np.uint8).reshape(parity_shards, data_shards)
+
+
+@lru_cache(maxsize=256)
+def _decode_matrix(data_shards, parity_shards, chosen):
+    # Inverse of the rows of the encoding matrix for the surviving shards in `chosen`
+    encode = np.concatenate([np.identity(data_shards, dtype=np.uint8), _parity_matrix(data_shards, parity_shards)])
+    return _gf_invert_matrix(encode[list(chosen)])
+
+
+def _gf_matmul(matrix, shards):
+    # Multiplies an (r, k) matrix with shards of shape (..., k, size) over GF(256).
+    # The loops only run over the matrix; every step works on all the bytes at once.
+    out = np.zeros(shards.shape[:-2] + (matrix.shape[0], shards.shape[-1]), dtype=np.uint8)
+    for row in range(matrix.shape[0]):
+        acc = out[..., row, :]
+        for col in range(matrix.shape[1]):
+            coefficient = matrix[row, col]
+            if coefficient == 1:
+                acc ^= shards[..., col, :]
+            elif coefficient:
+                acc ^= _GF_MUL[coefficient][shards[..., col, :]]
+    return out
+
+
+def _gf_invert_matrix(matrix):
+    # Gauss-Jordan elimination over GF(256)
+    size = matrix.shape[0]
+    work = np.concatenate([matrix, np.identity(size, dtype=np.uint8)], axis=1)
+    for col in range(size):
+        pivot = next((r for r in range(col, size) if work[r, col]), None)
+        if pivot is None:
+            raise ValueError("Matrix is singular")
+        work[[col, pivot]] = work[[pivot, col]]
+        work[col] = _GF_MUL[_gf_inverse(work[col, col])][work[col]]
+        for r in range(size):
+            if r != col and work[r, col]:
+                work[r] ^= _GF_MUL[work[r, col]][work[col]]
+    return work[:, size:]
@@ -0,0 +1,147 @@
+from collections import deque
+import math
+import threading
+import time
+
+ALIVE = 'alive'
+SUSPECT = 'suspect'  # Late, but possibly just a lost packet or a slow link
+DEAD = 'dead'
+
+
+class HealthTable:
+    """
+    Per-peer health, from a phi accrual failure detector.
+
+    Every answered probe is a heartbeat. For each peer the table keeps the
+    recent intervals between heartbeats, and the longer a peer has been silent
+    compared to that history, the higher its suspicion level phi: phi = 1 means
+    about a 10% chance the peer is still up and the next heartbeat is just late,
+    phi = 2 about 1%, and so on. A peer is alive below `suspect_phi`, suspect
+    below `dead_phi` and dead above it, so one lost packet makes a peer suspect
+    for a moment instead of evicting it, and a slow but regular peer stays alive.
+
+    Lookups only read the recorded heartbeats and never touch the network.
+    """
+
+    def __init__(self, suspect_phi=3.0, dead_phi=8.0, window=100, min_std=0.5,
+                 acceptable_pause=1.0, first_interval=1.0, clock=time.monotonic):
+        """
+        :param suspect_phi: Suspicion level at which a peer becomes suspect.
+        :param dead_phi: Suspicion level at which a peer is considered dead.
+        :param window: How many recent heartbeat intervals to keep per peer.
+        :param min_std: Lower bound on the interval deviation, so very regular peers are not judged too harshly.
+        :param acceptable_pause: Seconds of extra silence tolerated on top of the mean interval (e.g. one missed sweep).
+        :param first_interval: Interval assumed for a peer with only one heartbeat so far, in seconds.
+        :param clock: Returns the current time in seconds; a simulator can pass its own.
+        """
+        self.suspect_phi = suspect_phi
+        self.dead_phi = dead_phi
+        self.window = window
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self.first_interval = first_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self._last = {}  # Peer -> time of its last heartbeat (see `clock`)
+        self._intervals = {}  # Peer -> deque of recent intervals between heartbeats
+
+    def track(self, peer, now=None):
+        """
+        Starts judging a peer that has not answered yet, as if it had just answered,
+        so that one which never answers ends up dead too.
+
+        :param peer: The peer's IP.
+        :param now: When tracking starts (see `clock`), now by default.
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            if peer not in self._last:
+                self._last[peer] = now
+                self._intervals[peer] = deque(maxlen=self.window)
+
+    def heartbeat(self, peer, now=None):
+        """
+        Records that a peer answered.
+
+        :param peer: The peer's IP.
+        :param now: When it answered (see `clock`), now by default.
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            intervals = self._intervals.setdefault(peer, deque(maxlen=self.window))
+            intervals.append(now - self._last[peer] if intervals else self.first_interval)
+            self._last[peer] = now
+
+    def phi(self, peer, now=None):
+        """
+        :param peer: The peer's IP.
+        :param now: The time to judge at (see `clock`), now by default.
+        :return: The peer's suspicion level, or None if it is not tracked.
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            last = self._last.get(peer)
+            if last is None:
+                return None
+            intervals = self._intervals[peer] or (self.first_interval,)
+            mean = sum(intervals) / len(intervals)
+            variance = sum((interval - mean) ** 2 for interval in intervals) / len(intervals)
+        std = max(math.sqrt(variance), self.min_std)
+        return _phi(now - last, mean + self.acceptable_pause, std)
+
+    def state(self, peer, now=None):
+        """
+        :param peer: The peer's IP.
+        :param now: The time to judge at (see `clock`), now by default.
+        :return: ALIVE, SUSPECT or DEAD. A peer the table knows nothing about is SUSPECT.
+        """
+        phi = self.phi(peer, now)
+        if phi is None:
+            return SUSPECT
+        if phi >= self.dead_phi:
+            return DEAD
+        if phi >= self.suspect_phi:
+            return SUSPECT
+        return ALIVE
+
+    def alive(self, peers, now=None):
+        """
+        :param peers: Peer IPs.
+        :param now: The time to judge at (see `clock`), now by default.
+        :return: The peers that are alive, in the order given.
+        """
+        now = self.clock() if now is None else now
+        return [peer for peer in peers if self.state(peer, now) == ALIVE]
+
+    def states(self, now=None):
+        """
+        :param now: The time to judge at (see `clock`), now by default.
+        :return: A dict from every tracked peer to its (state, phi).
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            peers = list(self._last)
+        return {peer: (self.state(peer, now), self.phi(peer, now)) for peer in peers}
+
+    def forget(self, peer):
+        """
+        Drops a peer's history, e.g. once it has been removed from the neighbour list.
+
+        :param peer: The peer's IP.
+        """
+        with self.lock:
+            self._last.pop(peer, None)
+            self._intervals.pop(peer, None)
+
+
+def _phi(elapsed, mean, std):
+    # -log10 of the probability that a heartbeat comes even later than `elapsed`,
+    # with intervals normally distributed (logistic approximation of the normal CDF)
+    y = (elapsed - mean) / std
+    exponent = -y * (1.5976 + 0.070566 * y * y)
+    if exponent > 700:  # Far earlier than expected
+        return 0.0
+    e = math.exp(exponent)
+    if elapsed > mean:
+        return -math.log10(e / (1.0 + e)) if e > 0 else float('inf')
+    return -math.log10(1.0 - 1.0 / (1.0 + e))
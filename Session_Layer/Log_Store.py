@@ -0,0 +1,345 @@
+import mmap
+import os
+import shutil
+import struct
+import threading
+
+# Segment file layout:
+#
+#   RECORD + data | RECORD | RECORD + data | ... | FOOTER_ENTRY * n | FOOTER_TAIL
+#
+# Records are only ever appended. A PUT record carries a new shard (which starts
+# with one reference), a REFS record a shard's new reference count, and a DELETE
+# record marks a shard as gone. When a segment fills up it is sealed with a
+# footer listing every record in it, so on startup the index is rebuilt from the
+# footers alone. Only the one unsealed segment left by a crash has to be scanned,
+# and even then only the record headers are read.
+
+RECORD = struct.Struct('>B32sI')  # record type, raw shard digest, data length (or reference count)
+FOOTER_ENTRY = struct.Struct('>B32sQI')  # record type, raw shard digest, data offset, data length (or reference count)
+FOOTER_TAIL = struct.Struct('>QI4s')  # footer offset, number of entries, magic
+SEGMENT_MAGIC = b'DSEG'
+
+PUT = 1  # A new shard
+DELETE = 2  # A shard was deleted
+REFS = 3  # A shard's reference count changed
+
+
+class LogStore:
+    """
+    Persistent, log-structured storage backend for `Shard_Store.ShardStore`.
+
+    Shards are appended to segment files and indexed in memory by shard ID as
+    (segment, offset, length). Reads are served as memoryviews over an mmap of the
+    segment, so no bytes are copied. A background thread compacts segments that
+    are mostly deleted shards by moving their live shards to the active segment
+    and removing the file.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, compaction_ratio=0.5, compaction_interval=30):
+        """
+        :param directory: Where the segment files live (created if needed).
+        :param segment_size: Size at which the active segment is sealed and a new one started.
+        :param compaction_ratio: Segments whose live bytes fall below this fraction are compacted.
+        :param compaction_interval: Seconds between compaction passes, or None for no background thread.
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.compaction_ratio = compaction_ratio
+        self.lock = threading.RLock()  # Serialises appends, compaction and index updates
+
+        self._index = {}  # Shard ID -> (segment number, data offset, data length)
+        self._refs = {}  # Shard ID -> reference count
+        self._segments = {}  # Segment number -> _Segment
+        self._active = None  # The segment being appended to
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+        self.compaction_thread_running = False  # To check if the compaction thread is running
+        self._stop = threading.Event()  # Set by close(); wakes the compaction thread and stops it
+        if compaction_interval:
+            self.start_compaction_thread(compaction_interval)
+
+    def start_compaction_thread(self, interval):
+        """Starts the compaction thread to periodically reclaim space from deleted shards."""
+        if not self.compaction_thread_running:
+            self.compaction_thread_running = True
+            self._stop.clear()
+            self.CompactionThread = threading.Thread(target=self._compaction_loop, args=(interval,))
+            self.CompactionThread.daemon = True  # Daemon thread: it will exit when the program exits
+            self.CompactionThread.start()
+
+    def load_refs(self):
+        """
+        :return: The reference count of every shard in the store, as rebuilt on startup.
+        """
+        with self.lock:
+            return dict(self._refs)
+
+    def write(self, shard_id, shard):
+        """
+        Appends a new shard with one reference.
+
+        :param shard_id: The shard ID (a hex SHA-256 digest).
+        :param shard: The shard data.
+        """
+        with self.lock:
+            self._put(shard_id, shard)
+            self._refs[shard_id] = 1
+
+    def read(self, shard_id):
+        """
+        :param shard_id: The shard ID.
+        :return: A memoryview of the shard over the mapped segment, or None if it is not stored.
+        """
+        with self.lock:
+            location = self._index.get(shard_id)
+            if location is None:
+                return None
+            number, offset, length = location
+            return self._segments[number].view(offset, length)
+
+    def delete(self, shard_id):
+        """
+        Deletes a shard; its space is reclaimed when its segment is compacted.
+
+        :param shard_id: The shard ID.
+        """
+        with self.lock:
+            location = self._index.pop(shard_id, None)
+            if location is None:
+                return
+            self._segments[location[0]].live_bytes -= location[2]
+            self._refs.pop(shard_id, None)
+            self._append(DELETE, shard_id)
+
+    def set_refs(self, shard_id, count):
+        """
+        Records a shard's new reference count.
+
+        :param shard_id: The shard ID.
+        :param count: The new reference count.
+        """
+        with self.lock:
+            self._refs[shard_id] = count
+            self._append(REFS, shard_id, count=count)
+
+    def free_space(self):
+        """
+        :return: The free space on the disk holding the segments, in bytes.
+        """
+        return shutil.disk_usage(self.directory).free
+
+    def compact(self):
+        """
+        Rewrites every sealed segment whose live fraction is below `compaction_ratio`.
+
+        :return: The number of bytes reclaimed on disk.
+        """
+        with self.lock:
+            candidates = [number for number, segment in self._segments.items()
+                          if segment is not self._active
+                          and segment.live_bytes < segment.data_size * self.compaction_ratio]
+
+        reclaimed = 0
+        for number in candidates:  # One segment per lock hold, so reads are not starved
+            with self.lock:
+                if self._stop.is_set():
+                    break  # close() is under way; leave the segments to it
+                reclaimed += self._compact_segment(number)
+        return reclaimed
+
+    def close(self):
+        """Stops compaction and seals the active segment, so the next start only reads footers."""
+        self._stop.set()
+        if self.compaction_thread_running and self.CompactionThread is not threading.current_thread():
+            self.CompactionThread.join()  # Waits out a pass that is already running
+        self.compaction_thread_running = False
+        with self.lock:
+            if self._active.entries:
+                self._active.seal()
+            for segment in self._segments.values():
+                segment.close()
+
+    def __contains__(self, shard_id):
+        return shard_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def _compaction_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.compact()
+
+    def _compact_segment(self, number):
+        # Moves the live shards and current reference counts out of a segment, then removes it
+        segment = self._segments[number]
+        has_older = any(other < number for other in self._segments)
+        for shard_id in segment.ids:
+            location = self._index.get(shard_id)
+            if location is not None:
+                moved = location[0] == number
+                if moved:
+                    self._put(shard_id, bytes(segment.view(location[1], location[2])))
+                # Re-record the current count, since the latest REFS record may be in this segment.
+                # A freshly written PUT already implies one reference.
+                if not moved or self._refs[shard_id] != 1:
+                    self._append(REFS, shard_id, count=self._refs[shard_id])
+            elif has_older:
+                # The shard may still have a PUT in an older segment; keep it deleted after a restart
+                self._append(DELETE, shard_id)
+
+        del self._segments[number]
+        segment.close()
+        os.remove(segment.path)
+        return segment.file_size
+
+    def _put(self, shard_id, shard):
+        # Appends a PUT record and points the index at it
+        if self._active.file_size >= self.segment_size:
+            self._roll()
+        offset = self._append(PUT, shard_id, shard)
+
+        previous = self._index.get(shard_id)
+        if previous is not None:
+            self._segments[previous[0]].live_bytes -= previous[2]
+        self._index[shard_id] = (self._active.number, offset, len(shard))
+        self._active.live_bytes += len(shard)
+
+    def _append(self, kind, shard_id, data=b'', count=0):
+        # Appends one record to the active segment and returns the offset of its data
+        return self._active.append(kind, bytes.fromhex(shard_id), data, count)
+
+    def _roll(self):
+        # Seals the active segment and starts a new one
+        self._active.seal()
+        self._new_segment(self._active.number + 1)
+
+    def _new_segment(self, number):
+        path = os.path.join(self.directory, f"segment-{number:08d}.log")
+        self._active = _Segment(number, path)
+        self._active.open_for_append()
+        self._segments[number] = self._active
+
+    def _load(self):
+        # Rebuilds the index from the segments on disk, oldest first
+        numbers = sorted(int(name[8:16]) for name in os.listdir(self.directory)
+                         if name.startswith('segment-') and name.endswith('.log'))
+        for number in numbers:
+            segment = _Segment(number, os.path.join(self.directory, f"segment-{number:08d}.log"))
+            segment.load()
+            self._segments[number] = segment
+            for kind, digest, offset, value in segment.entries:
+                self._apply(segment, kind, digest.hex(), offset, value)
+
+        if numbers and not self._segments[numbers[-1]].sealed:
+            self._active = self._segments[numbers[-1]]  # Carry on where the last run stopped
+            self._active.open_for_append()
+        else:
+            self._new_segment(numbers[-1] + 1 if numbers else 1)
+
+    def _apply(self, segment, kind, shard_id, offset, value):
+        # Replays one record into the index
+        segment.ids.add(shard_id)
+        previous = self._index.get(shard_id)
+        if kind == PUT:
+            if previous is not None:
+                self._segments[previous[0]].live_bytes -= previous[2]
+            self._index[shard_id] = (segment.number, offset, value)
+            self._refs[shard_id] = 1
+            segment.live_bytes += value
+        elif kind == DELETE:
+            if previous is not None:
+                self._segments[previous[0]].live_bytes -= previous[2]
+                del self._index[shard_id]
+            self._refs.pop(shard_id, None)
+        elif kind == REFS and shard_id in self._index:
+            self._refs[shard_id] = value
+
+
+class _Segment:
+    # One segment file: its records, its live byte count and its read mapping
+
+    def __init__(self, number, path):
+        self.number = number
+        self.path = path
+        self.entries = []  # (type, raw digest, data offset, length or count) of every record
+        self.ids = set()  # Shard IDs with a record in this segment
+        self.live_bytes = 0  # Bytes of shards whose current copy is in this segment
+        self.data_size = 0  # Bytes of records (excluding the footer)
+        self.file_size = 0
+        self.sealed = False
+        self._file = None  # Append handle, only for the active segment
+        self._map = None
+        self._mapped_size = 0
+
+    def load(self):
+        # Reads the footer if the segment is sealed, otherwise scans the record headers
+        with open(self.path, 'rb') as f:
+            self.file_size = f.seek(0, 2)
+            if self.file_size >= FOOTER_TAIL.size:
+                f.seek(self.file_size - FOOTER_TAIL.size)
+                footer_offset, count, magic = FOOTER_TAIL.unpack(f.read(FOOTER_TAIL.size))
+                if magic == SEGMENT_MAGIC:
+                    f.seek(footer_offset)
+                    self.entries = list(FOOTER_ENTRY.iter_unpack(f.read(count * FOOTER_ENTRY.size)))
+                    self.data_size = footer_offset
+                    self.sealed = True
+                    return
+
+            offset = 0
+            while offset + RECORD.size <= self.file_size:
+                f.seek(offset)
+                kind, digest, value = RECORD.unpack(f.read(RECORD.size))
+                length = value if kind == PUT else 0
+                if offset + RECORD.size + length > self.file_size:
+                    break  # Torn write at the end
+                self.entries.append((kind, digest, offset + RECORD.size, value))
+                offset += RECORD.size + length
+
+        if offset != self.file_size:
+            os.truncate(self.path, offset)  # Drop the torn record
+        self.data_size = self.file_size = offset
+
+    def open_for_append(self):
+        self._file = open(self.path, 'ab')
+
+    def append(self, kind, digest, data, count):
+        value = len(data) if kind == PUT else count
+        self._file.write(RECORD.pack(kind, digest, value))
+        if kind == PUT:
+            self._file.write(data)
+        self._file.flush()  # Make the record visible to the read mapping
+
+        offset = self.file_size + RECORD.size
+        self.entries.append((kind, digest, offset, value))
+        self.ids.add(digest.hex())
+        self.file_size = self.data_size = offset + (len(data) if kind == PUT else 0)
+        return offset
+
+    def seal(self):
+        # Writes the footer so the segment never has to be scanned again
+        footer = b''.join(FOOTER_ENTRY.pack(*entry) for entry in self.entries)
+        self._file.write(footer + FOOTER_TAIL.pack(self.data_size, len(self.entries), SEGMENT_MAGIC))
+        self._file.close()
+        self._file = None
+        self.file_size += len(footer) + FOOTER_TAIL.size
+        self.sealed = True
+
+    def view(self, offset, length):
+        # Zero-copy view of some bytes of the segment; remaps when the segment has grown since
+        if self._mapped_size < offset + length:
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = len(self._map)
+        return memoryview(self._map)[offset: offset + length]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # The mapping is not closed explicitly: views handed out may still be in use,
+        # and it is unmapped once the last of them is released.
+        self._map = None
+        self._mapped_size = 0
@@ -0,0 +1,330 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+# Latency bucket upper bounds in seconds: 1, 2.5 and 5 per decade from 10 µs to 100 s
+LATENCY_BUCKETS = tuple(round(mantissa * 10.0 ** exponent, 9)
+                        for exponent in range(-5, 2) for mantissa in (1, 2.5, 5)) + (100.0,)
+
+
+class Counter:
+    """
+    A count that only goes up, e.g. pings sent.
+
+    With `function`, the value is read from it at scrape time instead, so a counter
+    an object already keeps (e.g. `Transport.ShardTransport.shards_sent`) costs nothing extra.
+    """
+
+    def __init__(self, name, help='', function=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        :param amount: How much to add.
+        """
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self._value
+
+
+class Gauge:
+    """
+    A value that goes up and down, e.g. the number of neighbours.
+
+    With `function`, the value is read from it at scrape time instead.
+    """
+
+    def __init__(self, name, help='', function=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self._value = 0
+
+    def set(self, value):
+        """
+        :param value: The new value.
+        """
+        self._value = value
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self._value
+
+
+class Histogram:
+    """
+    Distribution of observed values, e.g. ping RTTs, in fixed buckets.
+
+    Observing a value is a binary search over the bucket bounds and three
+    additions, whatever has been observed before, so it can sit on hot paths.
+    Quantiles are estimated from the buckets.
+    """
+
+    def __init__(self, name, help='', buckets=LATENCY_BUCKETS):
+        """
+        :param name: The metric name.
+        :param help: What it measures.
+        :param buckets: Sorted upper bounds of the buckets; values above the last go in an overflow bucket.
+        """
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        :param value: The value to record, e.g. a latency in seconds.
+        """
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def time(self):
+        """
+        :return: A context manager that observes how long its block takes, in seconds.
+        """
+        return _Timer(self)
+
+    def quantile(self, q):
+        """
+        :param q: The quantile, between 0 and 1 (e.g. 0.99).
+        :return: An estimate of it, interpolated within its bucket, or None if nothing was observed.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]  # Overflow bucket: only a lower bound is known
+                low = self.bounds[index - 1] if index else 0.0
+                return low + (self.bounds[index] - low) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def snapshot(self):
+        """
+        :return: A dict of the count, sum, mean, median, 90th and 99th percentiles, and the cumulative
+                 count at each bucket bound.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total, value_sum = self._count, self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.bounds, counts):
+            running += count
+            cumulative[bound] = running
+        return {
+            'count': total,
+            'sum': value_sum,
+            'mean': value_sum / total if total else None,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': cumulative,
+        }
+
+
+class TimedLock:
+    """
+    A threading.Lock that records how long it is waited for and held.
+
+    It can replace the lock of an object as is (`with lock:`, acquire, release),
+    which shows whether that lock is what threads queue on.
+    """
+
+    def __init__(self, hold, wait=None):
+        """
+        :param hold: Histogram for how long the lock is held, in seconds.
+        :param wait: Histogram for how long acquiring it takes, in seconds; None to skip.
+        """
+        self.hold = hold
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._acquired = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired = time.perf_counter()
+            if self.wait is not None:
+                self.wait.observe(self._acquired - start)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired
+        self._lock.release()
+        self.hold.observe(held)
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class Registry:
+    """
+    The metrics of one node, by name.
+
+    Metrics are created on first use and then updated in place, so a component
+    keeps a reference to each of its metrics and updating one is a lock and an
+    addition; nothing is formatted or written until someone reads them. Read
+    them with `snapshot()`, scrape them over HTTP with `serve()` (Prometheus text
+    on /metrics, JSON on /metrics.json), or have them handed to a callback
+    periodically with `start_reporting()`.
+    """
+
+    def __init__(self):
+        self._metrics = {}  # Name -> Counter, Gauge or Histogram, in creation order
+        self.lock = threading.Lock()
+
+    def counter(self, name, help='', function=None):
+        """
+        :return: The counter with this name, created if it does not exist yet.
+        """
+        return self._get(name, Counter, help, function=function)
+
+    def gauge(self, name, help='', function=None):
+        """
+        :return: The gauge with this name, created if it does not exist yet.
+        """
+        return self._get(name, Gauge, help, function=function)
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS):
+        """
+        :return: The histogram with this name, created if it does not exist yet.
+        """
+        return self._get(name, Histogram, help, buckets=buckets)
+
+    def snapshot(self):
+        """
+        :return: A dict from each metric name to its value (a number, or a dict for histograms).
+        """
+        with self.lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() if isinstance(metric, Histogram) else metric.value
+                for metric in metrics}
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            kind = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}[type(metric)]
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            if kind != 'histogram':
+                lines.append(f"{metric.name} {metric.value}")
+                continue
+            snapshot = metric.snapshot()
+            for bound, count in snapshot['buckets'].items():
+                lines.append(f'{metric.name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{metric.name}_bucket{{le="+Inf"}} {snapshot["count"]}')
+            lines.append(f"{metric.name}_sum {snapshot['sum']}")
+            lines.append(f"{metric.name}_count {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host='127.0.0.1', port=0):
+        """
+        Serves the metrics over HTTP from a daemon thread.
+
+        :param host: The IP address to bind; loopback by default, so only local scrapers can read them.
+        :param port: The port to bind (0 picks a free one, see the server's `server_port`).
+        :return: The server; call its shutdown() to stop it.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.render().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.snapshot()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # One line per scrape is noise
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True  # Daemon thread: it will exit when the program exits
+        thread.start()
+        return server
+
+    def start_reporting(self, interval, report):
+        """
+        Hands a snapshot to `report` every `interval` seconds from a daemon thread.
+
+        :param interval: Seconds between snapshots.
+        :param report: Called as report(snapshot), e.g. to log it or append it to a file.
+        :return: A threading.Event; set it to stop reporting.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                report(self.snapshot())
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return stop
+
+    def _get(self, name, kind, help, **options):
+        with self.lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = kind(name, help, **options)
+            elif not isinstance(metric, kind):
+                raise ValueError(f"{name} is already a {type(metric).__name__}")
+        return metric
+
+
+class _Timer:
+    # Context manager behind Histogram.time()
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
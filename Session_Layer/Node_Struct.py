@@ -1,21 +1,40 @@
-import Protocols
+import Health
+import Metrics
+import Probe
+import Routing
+import Shard_Cache
+import Shard_Store
+import logging
 import threading
 import time
 import uuid
 
+logger = logging.getLogger(__name__)
+
 class Node:
-    def __init__(self):
+    def __init__(self, backend=None, cache_size=64 * 1024 * 1024, start_threads=True, clock=time.monotonic,
+                 metrics=None):
         # Initialize the node with various attributes
+        # backend: where shards are kept, e.g. a Log_Store.LogStore to persist them (in memory by default)
+        # cache_size: bytes of hot shards to keep in memory in front of the backend
+        # start_threads: False to open no sockets and start no threads, for a runtime that drives the
+        #   node itself (e.g. Distributor.Simulator) by calling apply_sweep and load_status
+        # clock: returns the current time in seconds; a simulator passes its own
+        # metrics: the Metrics.Registry to record into (a new one by default), e.g. shared with the DataChain
         self.prev = None  # Previous node in the chain (could be None if no previous node exists)
         self.next = None  # Next node in the chain (could be None if no next node exists)
-        self.neighbour = []  # List to store neighbors' IP addresses
         self.Head = None  # Head node in the chain (could be None if no head node exists)
         self.Tail = None  # Tail node in the chain (could be None if no tail node exists)
-        self.shards = {}  # A dictionary holding shard IDs and their corresponding shard data
+        # Content-addressed store of the shards this node holds, behind a cache of the hot ones
+        self.shards = Shard_Cache.ShardCache(Shard_Store.ShardStore(backend), cache_size)
         self.shard_table = {}  # A dictionary mapping shard IDs to the IP addresses of their holders
+        self.queue_depth = 0  # Shard requests waiting to be served, reported to pingers
         self.Session_Port = 5000  # Port used for session communication
         self.Data_Port = 5001  # Port used for data communication
-        self.id = uuid.uuid4
+        self.Metrics_Port = 5009  # Local HTTP port the metrics are scraped from (see serve_metrics)
+        self.id = uuid.uuid4()
+        # Kademlia k-buckets of the nodes this node knows (its neighbours), keyed on XOR distance from its ID
+        self.routing = Routing.RoutingTable(self.id.int)
         self.ip = None #For now will retreive the public ip 
         
         # Flags to manage the status of various threads
@@ -23,15 +42,30 @@ class Node:
         self.data_pong_thread_running = False  # To check if the data pong thread is running
         self.ping_thread_running = False  # To check if the ping thread is running
         
-        self.failed_neighbors = []  # List to store neighbors that failed the ping check
+        self.failed_neighbors = set()  # Neighbours that are currently suspect
+        self.probe = Probe.ProbeEngine() if start_threads else None  # Pings every peer at once from one UDP socket
+        self.health = Health.HealthTable(clock=clock)  # Alive/suspect/dead state of every peer, from the probe sweeps
+
+        # Counters, gauges and latency histograms, read through serve_metrics() or metrics.snapshot()
+        self.metrics = metrics if metrics is not None else Metrics.Registry()
+        self.ping_rtt = self.metrics.histogram('ping_rtt_seconds', 'RTT of answered pings')
+        self.sweep_time = self.metrics.histogram('probe_sweep_seconds', 'Time to probe every peer once')
+        self.pings_answered = self.metrics.counter('pings_answered_total', 'Pings that got a pong in time')
+        self.pings_lost = self.metrics.counter('pings_lost_total', 'Pings that got no pong in time')
+        self.metrics.gauge('neighbours', 'Nodes in the routing table', function=lambda: len(self.routing))
+        self.metrics.gauge('failed_neighbours', 'Neighbours currently suspect',
+                           function=lambda: len(self.failed_neighbors))
+        self.metrics.gauge('queue_depth', 'Shard requests waiting to be served', function=lambda: self.queue_depth)
 
-        # Lock for thread synchronization to avoid race conditions
-        self.lock = threading.Lock()
+        # Lock for thread synchronization to avoid race conditions; records how long it is waited for and held
+        self.lock = Metrics.TimedLock(self.metrics.histogram('node_lock_hold_seconds', 'Time Node.lock is held'),
+                                      self.metrics.histogram('node_lock_wait_seconds', 'Time spent waiting for Node.lock'))
 
         # Start all necessary threads for maintaining node connectivity and health
-        self.start_session_ping_thread()
-        self.start_session_pong_thread()
-        self.start_data_pong_thread()
+        if start_threads:
+            self.start_session_ping_thread()
+            self.start_session_pong_thread()
+            self.start_data_pong_thread()
 
     def start_session_ping_thread(self):
         """Starts the session ping thread to periodically ping neighbors and other connected nodes."""
@@ -66,59 +100,74 @@ class Node:
     def session_ping(self):
         """Periodically ping each neighbor, prev, next, head, and tail every 1 second to check for their status."""
         while self.ping_thread_running:
-            with self.lock:  # Synchronize access to self.neighbour and self.failed_neighbors
-                # Ping each neighbor in the neighbor list and dynamically update the failed_neighbors list
-                for ip in self.neighbour[:]:  # Iterate over a copy to avoid modifying the list while iterating
-                    if Protocols.Ping(ip, self.Data_Port):  # Ping the neighbor's IP and check if successful
-                        print(f"Successfully pinged neighbor {ip}")
-                        if ip in self.failed_neighbors:  # If the neighbor had failed before, remove it from failed list
-                            self.failed_neighbors.remove(ip)
-                            print(f"Removed {ip} from failed_neighbors list")
-                    else:  # If ping fails, add the neighbor to the failed_neighbors list
-                        print(f"Failed to ping neighbor {ip}")
-                        if ip not in self.failed_neighbors:
-                            self.failed_neighbors.append(ip)
-                            print(f"Added {ip} to failed_neighbors list")
-
-                # Retry failed neighbors dynamically within the same loop
-                for ip in self.failed_neighbors[:]:  # Iterate over the failed_neighbors list
-                    retry_count = 3  # Number of retry attempts for failed neighbors
-                    failed = False
-                    for attempt in range(retry_count):
-                        # Try pinging the failed neighbor up to 'retry_count' times
-                        if not Protocols.Ping(ip, self.Data_Port):
-                            failed = True
-                            print(f"Failed to ping {ip} on attempt {attempt + 1}")
-                        else:
-                            failed = False
-                            break  # Stop retrying if the ping is successful
-
-                    if failed:  # If still failed after retries, remove from neighbor list
-                        with self.lock:
-                            if ip in self.neighbour:
-                                self.neighbour.remove(ip)
-                                print(f"Removed {ip} from neighbour list")
-                    print(f"{ip} is still in failed_neighbors list after {retry_count} attempts")
-
-                # Check prev, next, head, tail nodes (no removal from neighbor list for these)
-                check_nodes = [self.prev, self.next, self.Head, self.Tail]
-                for node in check_nodes:
-                    if node is not None:  # Only ping nodes that are not None
-                        if Protocols.Ping(node, self.Data_Port):  # Ping the node and check for success
-                            print(f"Successfully pinged node {node}")
-                        else:
-                            print(f"Failed to ping node {node}")
+            # Snapshot who to ping, then probe everyone at once without holding the lock
+            with self.lock:
+                neighbours = list(self.neighbour)
+                check_nodes = [node for node in (self.prev, self.next, self.Head, self.Tail) if node is not None]
+            with self.sweep_time.time():
+                results = self.probe.sweep(set(neighbours + check_nodes), self.Data_Port)
+
+            next_dead = self.apply_sweep(neighbours, results)
+
+            # Check prev, next, head, tail nodes (no removal from neighbor list for these)
+            for node in check_nodes:
+                if results[node] is None:
+                    logger.warning("Failed to ping node %s", node)
+            if next_dead:  # Repair the chain around a dead next node
+                logger.warning("Next node %s is dead", self.next)
+                self.get_next_alive()
 
             time.sleep(1)  # Sleep for 1 second to avoid overwhelming the system with constant pings
 
+    def apply_sweep(self, neighbours, results):
+        """
+        Updates the health table and the neighbour list from the outcome of one probe sweep.
+
+        :param neighbours: The neighbour IPs that were probed.
+        :param results: A dict from each probed IP to its RTT in seconds, or None if it did not answer.
+        :return: True if the next node in the chain is now considered dead.
+        """
+        for ip in neighbours:
+            self.health.track(ip)  # No-op unless it just moved in from a bucket's replacement cache
+        for ip, rtt in results.items():
+            if rtt is not None:  # Every answer is a heartbeat for the failure detector
+                self.health.heartbeat(ip)
+                self.ping_rtt.observe(rtt)
+                self.pings_answered.inc()
+            else:
+                self.pings_lost.inc()
+
+        # Only the state update needs the lock
+        with self.lock:
+            for ip in neighbours:
+                state = self.health.state(ip)
+                if state == Health.ALIVE:
+                    if ip in self.failed_neighbors:  # If the neighbor had failed before, remove it from failed list
+                        self.failed_neighbors.discard(ip)
+                        logger.info("Removed %s from failed_neighbors list", ip)
+                elif state == Health.SUSPECT:
+                    # Late, maybe just a lost packet: keep it, but do not pick it for new work
+                    if ip not in self.failed_neighbors:
+                        self.failed_neighbors.add(ip)
+                        logger.info("Added %s to failed_neighbors list", ip)
+                elif ip in self.routing:  # Dead: drop it from the routing table (a replacement takes its slot)
+                    self.routing.remove_ip(ip)
+                    self.failed_neighbors.discard(ip)
+                    self.health.forget(ip)
+                    logger.info("Removed %s from neighbour list", ip)
+            return self.next is not None and self.health.state(self.next) == Health.DEAD
+
     def data_pong(self):
         """Pong function that runs forever if prev is None. Otherwise, stops and restarts the thread."""
         while self.data_pong_thread_running:
             if self.prev is None:
                 try:
-                    Protocols.Pong(self, self.Data_Port)  # Respond to pings with pong message
+                    # Respond to pings with a pong carrying this node's load
+                    # and answer node lookups from the routing table
+                    Probe.PongResponder(self.ip or '', self.Data_Port, self.load_status,
+                                        answer=self.answer_find_node).serve_forever()
                 except Exception as e:
-                    print(f"Error in Pong: {e}")
+                    logger.error("Error in Pong: %s", e)
             else:
                 # If prev is set (i.e., no longer the head node), stop the thread and restart it
                 self.data_pong_thread_running = False
@@ -129,24 +178,87 @@ class Node:
         """
         Finds and returns the next alive node from the neighbor list.
         Updates `self.next` with the first alive node found.
+
+        Reads the health table kept up to date by the ping thread, so it never waits on the network.
         """
         with self.lock:  # Ensure thread-safe access to the neighbor list
-            for n in self.neighbour:  # Check each neighbor in the list
-                if Protocols.Ping(n, self.Data_Port):  # Ping the neighbor and check if it is alive
+            for _, n in self.routing.closest(self.id.int, len(self.routing)):  # Nearest neighbours first
+                if self.health.state(n) == Health.ALIVE:  # Only nodes that have been answering recently
                     self.next = n  # Update the next node if this one is alive
-                    print(f"{n} is now the next node")
+                    logger.info("%s is now the next node", n)
                     return n
         return None  # Return None if no alive neighbors are found
 
-    def add_neighbour(self, ip_address):
+    def load_status(self):
+        """
+        Returns this node's load, as reported in its pongs.
+
+        :return: (free storage in bytes, shards held, queued shard requests).
+        """
+        return self.shards.free_space(), len(self.shards), self.queue_depth
+
+    def alive_neighbours(self):
+        """
+        Returns the neighbours that are currently alive, e.g. to place new shards on.
+
+        :return: A list of neighbour IPs, in neighbour list order.
+        """
+        with self.lock:
+            neighbours = list(self.neighbour)
+        return self.health.alive(neighbours)
+
+    @property
+    def neighbour(self):
+        """The IPs of the nodes in the routing table (O(log n) of the network), which are the ones pinged."""
+        return self.routing.ips()
+
+    def add_neighbour(self, ip_address, node_id=None):
         """
-        Adds a new neighbor by their IP address to the neighbor list.
+        Adds a new neighbor by their IP address to the routing table.
         
         :param ip_address: IP address of the new neighbor to add
+        :param node_id: The neighbour's node ID (a uuid.UUID or its integer value); until it is known, an ID
+                        derived from the IP stands in, and it is replaced once that node sends a lookup of its own
         """
+        if node_id is None:
+            node_id = uuid.uuid5(uuid.NAMESPACE_URL, ip_address)
+        if isinstance(node_id, uuid.UUID):
+            node_id = node_id.int
         with self.lock:  # Synchronize access to the neighbor list
-            if ip_address not in self.neighbour:
-                self.neighbour.append(ip_address)  # Add the new neighbor if not already present
-                print(f"Added neighbour with IP: {ip_address}")
+            if ip_address in self.routing and self.routing.node_id_of(ip_address) == node_id:
+                logger.debug("Neighbour with IP: %s already exists.", ip_address)
+            elif self.routing.update(node_id, ip_address):  # Add the new neighbor if its bucket has room
+                self.health.track(ip_address)  # Judge it from now on, so it ends up dead if it never answers
+                logger.info("Added neighbour with IP: %s", ip_address)
             else:
-                print(f"Neighbour with IP: {ip_address} already exists.")  # Print message if the neighbor already exists
+                logger.debug("Bucket for %s is full, keeping it as a replacement", ip_address)
+
+    def lookup(self, node_id):
+        """
+        Finds the nodes closest to an ID in O(log n) hops, learning about them along the way.
+
+        :param node_id: The ID to look for (a uuid.UUID or its integer value).
+        :return: Up to k (node ID, IP) pairs, closest first; the first is the node itself if it is up.
+        """
+        if isinstance(node_id, uuid.UUID):
+            node_id = node_id.int
+        return self.routing.lookup(
+            node_id, lambda ip, target: Routing.find_node(ip, self.Data_Port, target, self.id.int))
+
+    def answer_find_node(self, data, addr):
+        """
+        Answers another node's lookup request (called by the pong responder).
+
+        :param data: The request datagram.
+        :param addr: The (IP, port) it came from.
+        :return: The reply datagram, or None if it was not a lookup request.
+        """
+        return Routing.answer_find_node(self.routing, data, addr)
+
+    def serve_metrics(self):
+        """
+        Serves this node's metrics on `Metrics_Port`, on loopback only.
+
+        :return: The HTTP server (see Metrics.Registry.serve); call its shutdown() to stop it.
+        """
+        return self.metrics.serve('127.0.0.1', self.Metrics_Port)
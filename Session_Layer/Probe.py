@@ -0,0 +1,246 @@
+import itertools
+import select
+import socket
+import struct
+import time
+
+# A probe is a PING byte followed by a sequence number and the send time:
+#
+#   PING | PROBE
+#
+# and the pong echoes the probe back, followed by the responder's load:
+#
+#   PONG | PROBE | LOAD
+#
+# so replies can be matched to their probe, the RTT read straight off them, and
+# placement decided from the same round trip. Protocols.Pong sends no LOAD.
+PING = (63).to_bytes(1, 'big')  # ASCII for ? (same as Protocols.Ping)
+PONG = (1).to_bytes(1, 'big')
+PROBE = struct.Struct('>Id')  # sequence number, send time (time.monotonic())
+LOAD = struct.Struct('>QII')  # free storage in bytes, shards held, queued requests
+
+
+class ProbeEngine:
+    """
+    Pings many peers at once from a single UDP socket.
+
+    A sweep sends one probe to every peer up front and then collects replies
+    until each peer has answered or run out of time, so it takes about one
+    timeout however many peers there are. Each peer's timeout adapts to its RTT
+    history (smoothed RTT plus four deviations, as TCP does) instead of a fixed
+    2 seconds. Each probe a peer lets expire doubles its timeout, up to
+    `max_timeout`, until it answers again (RFC 6298 backoff), so retries to a
+    congested peer do not pile on at the same rate.
+    """
+
+    def __init__(self, initial_timeout=1.0, min_timeout=0.05, max_timeout=2.0):
+        """
+        :param initial_timeout: Timeout for peers with no RTT history yet, in seconds.
+        :param min_timeout: Lower bound for the adaptive timeout.
+        :param max_timeout: Upper bound for the adaptive timeout.
+        """
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._rtt = {}  # Peer -> (smoothed RTT, RTT deviation)
+        self._load = {}  # Peer -> (free storage, shards held, queued requests) from its last pong
+        self._backoff = {}  # Peer -> probes it has let expire since it last answered
+        self._sequence = itertools.count(1)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # One socket for every probe
+        self.sock.bind(('', 0))
+        self.sock.setblocking(False)
+
+    def timeout_for(self, peer):
+        """
+        :param peer: A peer IP.
+        :return: How long to wait for the peer's pong, in seconds.
+        """
+        history = self._rtt.get(peer)
+        timeout = self.initial_timeout if history is None else history[0] + 4 * history[1]
+        timeout *= 2 ** self._backoff.get(peer, 0)
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def rtt(self, peer):
+        """
+        :param peer: A peer IP.
+        :return: The peer's smoothed RTT in seconds, or None if it never answered.
+        """
+        history = self._rtt.get(peer)
+        return history[0] if history else None
+
+    def load(self, peer):
+        """
+        :param peer: A peer IP.
+        :return: The (free storage in bytes, shards held, queued requests) the peer last
+                 reported, or None if it never has.
+        """
+        return self._load.get(peer)
+
+    def sweep(self, peers, port, retries=0):
+        """
+        Probes every peer concurrently.
+
+        :param peers: The peer IPs to probe.
+        :param port: The port their Pong responders listen on.
+        :param retries: How many times to re-probe peers that have not answered (each adds a timeout).
+        :return: A dict from each peer to its RTT in seconds, or None if it did not answer.
+        """
+        results = {peer: None for peer in peers}
+        outstanding = {}  # Sequence number -> (peer, deadline)
+
+        for attempt in range(retries + 1):
+            for peer, rtt in results.items():
+                if rtt is None:
+                    self._send(peer, port, outstanding)
+            self._collect(results, outstanding)
+            if all(rtt is not None for rtt in results.values()):
+                break
+        return results
+
+    def _send(self, peer, port, outstanding):
+        sequence = next(self._sequence) & 0xFFFFFFFF
+        now = time.monotonic()
+        try:
+            self.sock.sendto(PING + PROBE.pack(sequence, now), (peer, port))
+        except OSError:
+            return  # Unresolvable or unreachable, counts as no answer
+        outstanding[sequence] = (peer, now + self.timeout_for(peer))
+
+    def _collect(self, results, outstanding):
+        # Reads pongs until every outstanding probe has been answered or has expired
+        while outstanding:
+            now = time.monotonic()
+            for sequence in [s for s, (_, deadline) in outstanding.items() if deadline <= now]:
+                peer, _ = outstanding.pop(sequence)  # Expired, wait twice as long next time
+                self._backoff[peer] = min(self._backoff.get(peer, 0) + 1, 16)
+            if not outstanding:
+                return
+
+            wait = min(deadline for _, deadline in outstanding.values()) - now
+            readable, _, _ = select.select([self.sock], [], [], wait)
+            if not readable:
+                continue
+
+            while True:  # Drain every datagram that has arrived
+                try:
+                    data, addr = self.sock.recvfrom(1024)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    continue  # e.g. an ICMP port unreachable surfaced as an error
+                self._receive(data, results, outstanding)
+
+    def _receive(self, data, results, outstanding):
+        if data[:1] != PONG or len(data) < 1 + PROBE.size:
+            return
+        sequence, sent = PROBE.unpack_from(data, 1)
+        entry = outstanding.pop(sequence, None)
+        if entry is None:
+            return  # Late reply to an expired probe or an earlier sweep
+
+        peer = entry[0]
+        rtt = time.monotonic() - sent
+        results[peer] = rtt
+        self._update_rtt(peer, rtt)
+        self._backoff.pop(peer, None)
+        if len(data) >= 1 + PROBE.size + LOAD.size:
+            self._load[peer] = LOAD.unpack_from(data, 1 + PROBE.size)
+
+    def _update_rtt(self, peer, rtt):
+        # RFC 6298 smoothing
+        history = self._rtt.get(peer)
+        if history is None:
+            self._rtt[peer] = (rtt, rtt / 2)
+            return
+        srtt, rttvar = history
+        rttvar = 0.75 * rttvar + 0.25 * abs(srtt - rtt)
+        srtt = 0.875 * srtt + 0.125 * rtt
+        self._rtt[peer] = (srtt, rttvar)
+
+    def close(self):
+        """Closes the probe socket."""
+        self.sock.close()
+
+
+class PongResponder:
+    """
+    Answers pings without printing and in batches: after each wait for the socket
+    it drains every datagram that has arrived, so one node can keep up with tens
+    of thousands of pings a second.
+
+    Every pong carries the responder's load. It is read from `status` at most
+    once every `refresh` seconds and the packed bytes are reused in between, so
+    answering a ping costs one recvfrom and one sendto.
+    """
+
+    def __init__(self, host, port, status, refresh=0.1, answer=None):
+        """
+        :param host: The IP address to bind.
+        :param port: The port to bind (0 picks a free one, see `port`).
+        :param status: Called with no arguments; returns (free storage in bytes, shards held, queued requests).
+        :param refresh: Seconds a reading of `status` is reused for.
+        :param answer: Called as answer(data, addr) for datagrams that are not pings (e.g. Routing FIND
+                       requests); returns the reply to send, or None.
+        """
+        self.status = status
+        self.answer = answer
+        self.refresh = refresh
+        self.pongs = 0  # Pings answered
+        self.running = False
+        self._load = b''
+        self._load_time = None
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Answers pings until close() is called.
+
+        :param poll_interval: How often to check whether to stop, in seconds.
+        """
+        self.running = True
+        sock = self.sock
+        try:
+            while self.running:
+                readable, _, _ = select.select([sock], [], [], poll_interval)
+                if not readable:
+                    continue
+                load = self._current_load()
+                while True:  # Drain every datagram that has arrived
+                    try:
+                        data, addr = sock.recvfrom(64)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        continue  # e.g. an ICMP port unreachable from a pinger that has gone away
+                    try:
+                        if data[:1] != PING:
+                            reply = self.answer(data, addr) if self.answer is not None else None
+                            if reply is not None:
+                                sock.sendto(reply, addr)
+                            continue
+                        if len(data) < 1 + PROBE.size:
+                            sock.sendto(PONG, addr)  # A bare Protocols.Ping
+                        else:
+                            sock.sendto(PONG + data[1: 1 + PROBE.size] + load, addr)
+                    except OSError:
+                        continue  # Send buffer full; the pinger treats it as a lost packet
+                    self.pongs += 1
+        finally:
+            sock.close()
+
+    def close(self):
+        """Stops serve_forever() within one poll interval."""
+        self.running = False
+
+    def _current_load(self):
+        now = time.monotonic()
+        if self._load_time is None or now - self._load_time >= self.refresh:
+            free, shards, queued = self.status()
+            self._load = LOAD.pack(min(free, 2 ** 64 - 1), min(shards, 2 ** 32 - 1), min(queued, 2 ** 32 - 1))
+            self._load_time = now
+        return self._load
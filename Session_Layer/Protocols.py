@@ -1,6 +1,8 @@
+import logging
 import socket
 import time
-from .Node_Struct import Node
+
+logger = logging.getLogger(__name__)  # Per-packet messages are DEBUG, so they cost nothing unless enabled
 '''
 Ping(IP, Port) ping a node and expect a pong back to make sure the node is Alive 
 (Later on we can specifiy port so each port supports specific activites and also how to handle packets)
@@ -12,15 +14,15 @@ def Ping(IP, Port):
   sock.settimeout(2)  # Set timeout to 2 seconds for waiting for PONG
   try:
     sock.sendto((63).to_bytes(1, 'big'), (IP, Port))  # 63 is the ASCII for ? (PING)
-    print(f"Ping sent to {IP}")  # For testing purposes onlY
+    logger.debug("Ping sent to %s", IP)
     # Wait for PONG (PONG = 1)
     try:
       data, addr = sock.recvfrom(1024)  # Listens for connection
       if data == (1).to_bytes(1, 'big'):  # PONG is represented by 1
-          print(f"{IP} replied")  # For testing purposes only
+          logger.debug("%s replied", IP)
           return True  # If you receive the PONG
     except socket.timeout:
-        print(f"Timeout: No response from {IP} within 2 seconds.")
+        logger.info("Timeout: No response from %s within 2 seconds.", IP)
         return False  # If no PONG is received within the timeout
   finally:
     sock.close()  # Ensure the socket is closed no matter what
@@ -38,8 +40,10 @@ def Pong(self, port):
   #try:
   while True:
     data, addr = sock.recvfrom(1024)  # Listens for connection
-    if data == (63).to_bytes(1, 'big'):
-      print(f"Received Ping from {addr}")  # For testing purposes only
-      sock.sendto((1).to_bytes(1, 'big'), addr)  # Rather than sending PING(4 bytes) send just one
+    if data[:1] == (63).to_bytes(1, 'big'):
+      logger.debug("Received Ping from %s", addr)
+      # Rather than sending PING(4 bytes) send just one, followed by whatever came after the PING
+      # (the sequence number and timestamp of a Probe, so the pinger can match the reply)
+      sock.sendto((1).to_bytes(1, 'big') + data[1:], addr)
   #finally:
     #sock.close()  # Ensure the socket is closed when done
\ No newline at end of file
@@ -0,0 +1,231 @@
+from collections import OrderedDict, deque
+import socket
+import struct
+import threading
+import time
+
+# Node lookups ride on the same UDP port as pings (see Probe.PongResponder):
+#
+#   FIND | FIND_REQUEST             -> asks for the contacts closest to a target ID
+#   NODES | CONTACT * n             <- the answer
+#
+# The request carries the asker's own ID, so the answering node learns about it.
+FIND = b'F'
+NODES = b'N'
+FIND_REQUEST = struct.Struct('>16s16s')  # target ID, asker's ID
+CONTACT = struct.Struct('>16s4s')  # node ID, IPv4 address
+
+ID_BITS = 128  # Node IDs are UUIDs
+
+
+class RoutingTable:
+    """
+    Kademlia routing table: who a node knows, arranged by XOR distance.
+
+    Contacts go into one of 128 k-buckets by the length of the common prefix of
+    their ID and ours, so the table holds up to k contacts at each distance
+    range and only O(k log n) in total, mostly nearby ones. Any node can still
+    be found in O(log n) hops (see `lookup`), because each hop at least halves
+    the distance to the target.
+
+    Each bucket keeps its contacts least recently seen first. When a bucket is
+    full, newcomers wait in a replacement cache and only get in when a contact
+    is removed (e.g. once the health table declares it dead), so long-lived
+    contacts, which are the most likely to stay up, are kept.
+    """
+
+    def __init__(self, node_id, k=20):
+        """
+        :param node_id: This node's ID as an integer (e.g. `uuid.uuid4().int`).
+        :param k: Contacts per bucket.
+        """
+        self.node_id = node_id
+        self.k = k
+        self._buckets = [OrderedDict() for _ in range(ID_BITS)]  # Node ID -> IP, least recently seen first
+        self._replacements = [deque(maxlen=k) for _ in range(ID_BITS)]  # (node ID, IP) waiting for room
+        self._ids = {}  # IP -> node ID of every contact
+        self.lock = threading.RLock()  # The ping, pong and lookup threads all use the table
+
+    def update(self, node_id, ip):
+        """
+        Records that a node was seen.
+
+        :param node_id: The node's ID as an integer.
+        :param ip: The node's IP.
+        :return: True if the node is in the table, False if its bucket is full and it was put in the replacement cache.
+        """
+        if node_id == self.node_id:
+            return False
+        with self.lock:
+            previous = self._ids.get(ip)
+            if previous is not None and previous != node_id:
+                self.remove(previous)  # The node at this IP has a new ID (e.g. it restarted)
+
+            index = self.bucket_index(node_id)
+            bucket = self._buckets[index]
+            if node_id in bucket:
+                bucket.move_to_end(node_id)
+                self._ids.pop(bucket[node_id], None)
+                bucket[node_id] = ip
+                self._ids[ip] = node_id
+                return True
+            if len(bucket) < self.k:
+                bucket[node_id] = ip
+                self._ids[ip] = node_id
+                return True
+
+            replacements = self._replacements[index]
+            if (node_id, ip) not in replacements:
+                replacements.append((node_id, ip))
+            return False
+
+    def remove(self, node_id):
+        """
+        Removes a node, moving the most recently seen replacement into its place.
+
+        :param node_id: The node's ID as an integer.
+        """
+        with self.lock:
+            index = self.bucket_index(node_id)
+            ip = self._buckets[index].pop(node_id, None)
+            if ip is None:
+                return
+            if self._ids.get(ip) == node_id:
+                del self._ids[ip]
+            while self._replacements[index]:
+                replacement_id, replacement_ip = self._replacements[index].pop()
+                if replacement_ip not in self._ids:  # Not already in under another ID
+                    self._buckets[index][replacement_id] = replacement_ip
+                    self._ids[replacement_ip] = replacement_id
+                    return
+
+    def remove_ip(self, ip):
+        """
+        Removes the node with a given IP.
+
+        :param ip: The node's IP.
+        """
+        with self.lock:
+            node_id = self._ids.get(ip)
+            if node_id is not None:
+                self.remove(node_id)
+
+    def closest(self, target_id, count=None):
+        """
+        :param target_id: An ID as an integer.
+        :param count: How many contacts to return; defaults to k.
+        :return: Up to `count` (node ID, IP) pairs, closest to the target first.
+        """
+        count = self.k if count is None else count
+        with self.lock:
+            contacts = [(node_id, ip) for bucket in self._buckets for node_id, ip in bucket.items()]
+        contacts.sort(key=lambda contact: contact[0] ^ target_id)
+        return contacts[:count]
+
+    def lookup(self, target_id, find_node, alpha=3):
+        """
+        Iteratively finds the k nodes closest to an ID.
+
+        Asks the `alpha` closest contacts not yet asked for their own closest
+        contacts, merges the answers, and repeats until the k closest known
+        nodes have all been asked.
+
+        :param target_id: The ID to look for, as an integer.
+        :param find_node: Called as find_node(ip, target_id); returns the (node ID, IP) pairs
+                          that node knows closest to the target, or None if it did not answer.
+        :param alpha: How many nodes to ask per round.
+        :return: Up to k (node ID, IP) pairs, closest to the target first.
+        """
+        known = dict(self.closest(target_id))  # Node ID -> IP
+        asked = set()
+        failed = set()
+        while True:
+            candidates = sorted((node_id for node_id in known if node_id not in failed),
+                                key=lambda node_id: node_id ^ target_id)[:self.k]
+            to_ask = [node_id for node_id in candidates if node_id not in asked][:alpha]
+            if not to_ask:
+                return [(node_id, known[node_id]) for node_id in candidates]
+
+            for node_id in to_ask:
+                asked.add(node_id)
+                answer = find_node(known[node_id], target_id)
+                if answer is None:
+                    failed.add(node_id)
+                    continue
+                self.update(node_id, known[node_id])
+                for contact_id, contact_ip in answer:
+                    if contact_id != self.node_id:
+                        known.setdefault(contact_id, contact_ip)
+
+    def bucket_index(self, node_id):
+        """
+        :param node_id: A node ID as an integer.
+        :return: The index of the bucket it belongs in (0 for the farthest half of the ID space).
+        """
+        return ID_BITS - (node_id ^ self.node_id).bit_length()
+
+    def node_id_of(self, ip):
+        """
+        :param ip: A contact's IP.
+        :return: Its node ID, or None if it is not in the table.
+        """
+        return self._ids.get(ip)
+
+    def ips(self):
+        """
+        :return: The IPs of every contact, nearest buckets last.
+        """
+        with self.lock:
+            return [ip for bucket in self._buckets for ip in bucket.values()]
+
+    def __contains__(self, ip):
+        return ip in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def answer_find_node(table, data, addr):
+    """
+    Answers a FIND request, learning the asker along the way.
+
+    :param table: This node's RoutingTable.
+    :param data: The request datagram.
+    :param addr: The (IP, port) it came from.
+    :return: The reply datagram, or None if the request is malformed.
+    """
+    if data[:1] != FIND or len(data) < 1 + FIND_REQUEST.size:
+        return None
+    target, asker = FIND_REQUEST.unpack_from(data, 1)
+    contacts = table.closest(int.from_bytes(target, 'big'))
+    table.update(int.from_bytes(asker, 'big'), addr[0])
+    return NODES + b''.join(CONTACT.pack(node_id.to_bytes(16, 'big'), socket.inet_aton(ip))
+                            for node_id, ip in contacts)
+
+
+def find_node(ip, port, target_id, own_id, timeout=0.5):
+    """
+    Asks one node for its contacts closest to an ID.
+
+    :param ip: The node's IP.
+    :param port: The port its Probe.PongResponder listens on.
+    :param target_id: The ID to look for, as an integer.
+    :param own_id: This node's ID as an integer, so the other node can add it to its table.
+    :param timeout: How long to wait for the answer, in seconds.
+    :return: A list of (node ID, IP) pairs, or None if the node did not answer.
+    """
+    request = FIND + FIND_REQUEST.pack(target_id.to_bytes(16, 'big'), own_id.to_bytes(16, 'big'))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        deadline = time.monotonic() + timeout
+        try:
+            sock.sendto(request, (ip, port))
+            while True:
+                data, addr = sock.recvfrom(65536)
+                if addr[0] == ip and data[:1] == NODES:
+                    break
+                sock.settimeout(max(deadline - time.monotonic(), 0.001))  # Something else; keep waiting
+        except OSError:  # Includes socket.timeout
+            return None
+    return [(int.from_bytes(node_id, 'big'), socket.inet_ntoa(address))
+            for node_id, address in CONTACT.iter_unpack(data[1: 1 + (len(data) - 1) // CONTACT.size * CONTACT.size])]
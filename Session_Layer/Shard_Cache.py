@@ -0,0 +1,241 @@
+from collections import OrderedDict
+import hashlib
+import threading
+
+class ShardCache:
+    """
+    Byte-budgeted cache of hot shards in front of a `Shard_Store.ShardStore`.
+
+    Shards are kept in LRU order and the least recently used ones are evicted
+    once the budget is exceeded. With the 'tinylfu' policy a new shard only gets
+    in if it has been asked for more often than the shard it would evict, so a
+    scan over cold shards cannot flush the hot ones. Concurrent misses for the
+    same shard are collapsed into a single load from the store.
+
+    Everything else (put, claim, release, ...) is passed through to the store, so
+    the cache can stand in for it as `Node.shards`. It is safe to use from all of
+    the node's threads.
+    """
+
+    def __init__(self, store, capacity=64 * 1024 * 1024, policy='lru'):
+        """
+        :param store: The ShardStore to cache.
+        :param capacity: The most bytes of shard data to keep cached.
+        :param policy: 'lru' to admit every shard, or 'tinylfu' to admit by access frequency.
+        """
+        if policy not in ('lru', 'tinylfu'):
+            raise ValueError(f"Unknown cache policy {policy!r}")
+        self.store = store
+        self.capacity = capacity
+        self.policy = policy
+        self.lock = threading.Lock()  # Guards the entries, the counters and the in-flight loads
+
+        self._entries = OrderedDict()  # Shard ID -> shard data, least recently used first
+        self._size = 0  # Bytes currently cached
+        self._loading = {}  # Shard ID -> _Load for misses being served right now
+        self._sketch = _FrequencySketch() if policy == 'tinylfu' else None
+
+        # Counters, see stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.collapsed = 0
+
+    def get(self, shard_id):
+        """
+        Returns a shard, from the cache if possible and from the store otherwise.
+
+        :param shard_id: The shard ID.
+        :return: The shard data, or None if it is not stored.
+        """
+        with self.lock:
+            if self._sketch is not None:
+                self._sketch.increment(shard_id)
+
+            shard = self._entries.get(shard_id)
+            if shard is not None:
+                self._entries.move_to_end(shard_id)
+                self.hits += 1
+                return shard
+
+            self.misses += 1
+            load = self._loading.get(shard_id)
+            if load is not None:  # Someone is already loading it, wait for their result
+                self.collapsed += 1
+                owner = False
+            else:
+                load = self._loading[shard_id] = _Load()
+                owner = True
+
+        if not owner:
+            return load.wait()
+
+        try:
+            shard = self.store.get(shard_id)
+            if shard is not None:
+                shard = bytes(shard)  # Detach from the backend's buffer so the cache owns its memory
+        except BaseException as error:
+            with self.lock:
+                del self._loading[shard_id]
+            load.fail(error)
+            raise
+
+        with self.lock:
+            del self._loading[shard_id]
+            if shard is not None and not load.invalidated:  # Not deleted while we were reading it
+                self._admit(shard_id, shard)
+        load.finish(shard)
+        return shard
+
+    def invalidate(self, shard_id):
+        """
+        Drops a shard from the cache. A load of it that is still in flight is not
+        cached when it finishes, since it may have read the shard before it changed.
+
+        :param shard_id: The shard ID.
+        """
+        with self.lock:
+            load = self._loading.get(shard_id)
+            if load is not None:
+                load.invalidated = True
+            shard = self._entries.pop(shard_id, None)
+            if shard is not None:
+                self._size -= len(shard)
+
+    def release(self, shard_id):
+        """
+        Drops one reference to a shard in the store, and the shard from the cache if it was deleted.
+
+        :param shard_id: The shard ID.
+        :return: True if the shard was deleted.
+        """
+        deleted = self.store.release(shard_id)
+        if deleted:
+            self.invalidate(shard_id)
+        return deleted
+
+    def remove(self, shard_id):
+        """
+        Deletes a shard from the store whatever its reference count, and from the cache.
+
+        :param shard_id: The shard ID.
+        :return: True if the shard was stored.
+        """
+        removed = self.store.remove(shard_id)
+        self.invalidate(shard_id)
+        return removed
+
+    def stats(self):
+        """
+        :return: A dict of the hit, miss, eviction, rejection (by the admission policy) and
+                 collapsed-miss counters, plus the number of shards and bytes cached.
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'rejections': self.rejections,
+                'collapsed': self.collapsed,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+    def _admit(self, shard_id, shard):
+        # Caches a freshly loaded shard, evicting from the LRU end to stay within budget
+        if len(shard) > self.capacity:
+            self.rejections += 1
+            return
+
+        # Pick every victim needed to make room before evicting any, so a rejected shard costs nothing
+        victims = []
+        freed = 0
+        for victim_id, victim in self._entries.items():
+            if self._size - freed + len(shard) <= self.capacity:
+                break
+            victims.append(victim_id)
+            freed += len(victim)
+
+        if victims and self._sketch is not None:
+            frequency = self._sketch.estimate(shard_id)
+            if any(frequency <= self._sketch.estimate(victim_id) for victim_id in victims):
+                self.rejections += 1  # A victim is used at least as often; keep them all
+                return
+
+        for victim_id in victims:
+            self._size -= len(self._entries.pop(victim_id))
+            self.evictions += 1
+
+        self._entries[shard_id] = shard
+        self._size += len(shard)
+
+    def __getitem__(self, shard_id):
+        shard = self.get(shard_id)
+        if shard is None:
+            raise KeyError(shard_id)
+        return shard
+
+    def __getattr__(self, name):
+        # put, claim, has_shards, ref_count, close, ... go straight to the store
+        return getattr(self.store, name)
+
+    def __contains__(self, shard_id):
+        return shard_id in self.store
+
+    def __len__(self):
+        return len(self.store)
+
+
+class _Load:
+    # One in-flight load from the store, which concurrent misses for the same shard wait on
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._shard = None
+        self._error = None
+        self.invalidated = False  # Set under the cache's lock by invalidate()
+
+    def finish(self, shard):
+        self._shard = shard
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._shard
+
+
+class _FrequencySketch:
+    # Count-min sketch of recent access counts for TinyLFU admission. Counts are
+    # halved every `sample_size` increments, so old popularity fades away.
+
+    def __init__(self, width=1 << 16, depth=4, sample_size=1 << 18):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size
+        self._rows = [bytearray(width) for _ in range(depth)]  # Counters saturate at 255
+        self._additions = 0
+
+    def _slots(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4 * i: 4 * i + 4], 'big') % self.width for i in range(self.depth)]
+
+    def increment(self, key):
+        for row, slot in zip(self._rows, self._slots(key)):
+            if row[slot] < 255:
+                row[slot] += 1
+
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._additions = 0
+            for row in self._rows:
+                row[:] = bytes(count >> 1 for count in row)
+
+    def estimate(self, key):
+        return min(row[slot] for row, slot in zip(self._rows, self._slots(key)))
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import threading
+
+class ShardStore:
+    """
+    Content-addressed shard store.
+
+    Shards are keyed by the SHA-256 digest of their contents, so identical data is
+    stored once no matter how many files or uploads it belongs to. Every upload
+    that relies on a shard holds a reference to it, and the shard is only dropped
+    once the last reference is released.
+
+    Where the bytes live is up to the backend: `MemoryBackend` (the default) or a
+    persistent one such as `Log_Store.LogStore`.
+    """
+
+    def __init__(self, backend=None):
+        """
+        :param backend: The storage backend; defaults to an in-memory one.
+        """
+        self.backend = backend if backend is not None else MemoryBackend()
+        self._refs = self.backend.load_refs()  # Shard ID -> number of uploads referencing the shard
+        self.lock = threading.Lock()  # Stores are shared between the node's threads
+
+    @staticmethod
+    def shard_id(shard):
+        """
+        Returns the content address of a shard (the same as File_Processor's Sharding.shard_id).
+
+        :param shard: The shard data.
+        :return: The hex SHA-256 digest of the shard.
+        """
+        return hashlib.sha256(shard).hexdigest()
+
+    def put(self, shard, shard_id=None):
+        """
+        Stores a shard, or takes another reference to it if it is already stored.
+
+        :param shard: The shard data.
+        :param shard_id: The ID the sender claims for the shard; checked against its contents.
+        :return: The shard ID.
+        """
+        digest = self.shard_id(shard)
+        if shard_id is not None and shard_id != digest:
+            raise ValueError(f"Shard {shard_id} does not match its contents")
+
+        with self.lock:
+            if digest in self._refs:
+                self._refs[digest] += 1  # Already stored, nothing to write
+                self.backend.set_refs(digest, self._refs[digest])
+            else:
+                self.backend.write(digest, shard)  # New shards start with one reference
+                self._refs[digest] = 1
+        return digest
+
+    def get(self, shard_id):
+        """
+        Returns the data of a stored shard, or None if it is not stored.
+
+        :param shard_id: The shard ID.
+        """
+        return self.backend.read(shard_id)
+
+    def has_shards(self, shard_ids):
+        """
+        Answers a batched has-shards query.
+
+        :param shard_ids: The shard IDs to look up.
+        :return: The IDs among them that are stored here, in the order given.
+        """
+        return [shard_id for shard_id in shard_ids if shard_id in self._refs]
+
+    def claim(self, shard_ids):
+        """
+        Takes a reference to every shard in the batch that is stored here, for an
+        uploader that skips sending shards the holder already has.
+
+        :param shard_ids: The shard IDs the uploader needs kept.
+        :return: The IDs that were stored (and are now referenced); the rest must be sent.
+        """
+        held = []
+        with self.lock:
+            for shard_id in shard_ids:
+                if shard_id in self._refs:
+                    self._refs[shard_id] += 1
+                    self.backend.set_refs(shard_id, self._refs[shard_id])
+                    held.append(shard_id)
+        return held
+
+    def release(self, shard_id):
+        """
+        Drops one reference to a shard, deleting it when no references remain.
+
+        :param shard_id: The shard ID.
+        :return: True if the shard was deleted.
+        """
+        with self.lock:
+            if shard_id not in self._refs:
+                return False
+            self._refs[shard_id] -= 1
+            if self._refs[shard_id] > 0:
+                self.backend.set_refs(shard_id, self._refs[shard_id])
+                return False
+            del self._refs[shard_id]
+            self.backend.delete(shard_id)
+            return True
+
+    def adopt(self, shard_id, count, shard=None):
+        """
+        Takes over a shard, with its reference count, from a node that is no longer one
+        of its holders, e.g. after a placement change.
+
+        Every holder of a shard keeps the same count, and several of them may hand the
+        same shard over, so the count is raised to the one given rather than added to.
+
+        :param shard_id: The shard ID.
+        :param count: The number of references the old holder had.
+        :param shard: The shard data, or None if the sender knows it is already stored here.
+        :return: False if the data was left out but the shard is not stored here.
+        """
+        if shard is not None and self.shard_id(shard) != shard_id:
+            raise ValueError(f"Shard {shard_id} does not match its contents")
+
+        with self.lock:
+            if shard_id not in self._refs:
+                if shard is None:
+                    return False
+                self.backend.write(shard_id, shard)  # New shards start with one reference
+                self._refs[shard_id] = 1
+            if count > self._refs[shard_id]:
+                self._refs[shard_id] = count
+                self.backend.set_refs(shard_id, count)
+        return True
+
+    def remove(self, shard_id):
+        """
+        Deletes a shard whatever its reference count, e.g. once it has been handed over to
+        its new holders; the references go with it.
+
+        :param shard_id: The shard ID.
+        :return: True if the shard was stored.
+        """
+        with self.lock:
+            if self._refs.pop(shard_id, None) is None:
+                return False
+            self.backend.delete(shard_id)
+            return True
+
+    def shard_ids(self):
+        """
+        :return: The IDs of every stored shard.
+        """
+        with self.lock:
+            return list(self._refs)
+
+    def ref_count(self, shard_id):
+        """
+        :param shard_id: The shard ID.
+        :return: The number of references to the shard (0 if it is not stored).
+        """
+        return self._refs.get(shard_id, 0)
+
+    def free_space(self):
+        """
+        :return: How many more bytes of shards the backend has room for.
+        """
+        return self.backend.free_space()
+
+    def close(self):
+        """Closes the backend."""
+        self.backend.close()
+
+    def __getitem__(self, shard_id):
+        shard = self.get(shard_id)
+        if shard is None:
+            raise KeyError(shard_id)
+        return shard
+
+    def __contains__(self, shard_id):
+        return shard_id in self._refs
+
+    def __len__(self):
+        return len(self._refs)
+
+
+class MemoryBackend:
+    """
+    Storage backend that keeps shards in a dict: fast, but bounded by RAM and lost on restart.
+
+    Every backend offers the same methods; the ShardStore serialises calls that change state.
+    """
+
+    def __init__(self):
+        self._shards = {}  # Shard ID -> shard data
+
+    def load_refs(self):
+        """
+        :return: The reference count of every shard already stored (always empty here).
+        """
+        return {}
+
+    def write(self, shard_id, shard):
+        """
+        Stores a new shard with one reference.
+
+        :param shard_id: The shard ID.
+        :param shard: The shard data.
+        """
+        self._shards[shard_id] = bytes(shard)
+
+    def read(self, shard_id):
+        """
+        :param shard_id: The shard ID.
+        :return: The shard data, or None if it is not stored.
+        """
+        return self._shards.get(shard_id)
+
+    def delete(self, shard_id):
+        """
+        Deletes a shard.
+
+        :param shard_id: The shard ID.
+        """
+        self._shards.pop(shard_id, None)
+
+    def set_refs(self, shard_id, count):
+        """
+        Records a shard's new reference count (nothing to do in memory).
+
+        :param shard_id: The shard ID.
+        :param count: The new reference count.
+        """
+
+    def free_space(self):
+        """
+        :return: The physical memory still available, in bytes.
+        """
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+    def close(self):
+        """Releases the backend's resources (nothing to do in memory)."""
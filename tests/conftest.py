@@ -0,0 +1,20 @@
+"""
+Puts the repository on sys.path the way Benchmarks/suite.py does, once for every test.
+
+File_Processor and Session_Layer modules import their siblings directly, so tests
+import them the same way (`from Shard_Store import ShardStore`). Distributor modules
+import Session_Layer relative to the repository package, so tests load them through
+it: `importlib.import_module(f'{PACKAGE}.Distributor.Transport')`.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)  # The repository directory, imported as a package
+
+for path in (os.path.dirname(ROOT), os.path.join(ROOT, 'Session_Layer'), os.path.join(ROOT, 'File_Processor')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+HAVE_LZO = importlib.util.find_spec('lzo') is not None  # File_Processor's Encoder, and so Main, needs python-lzo
@@ -0,0 +1,23 @@
+import io
+import os
+import unittest
+
+import Container
+
+
+class HeaderTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        nonce = os.urandom(16)
+        header = Container.pack_header(nonce, 4096)
+        self.assertEqual(Container.read_header(io.BytesIO(header)), (nonce, 4096))
+
+    def test_other_versions_are_rejected(self):
+        for version in (1, 2, Container.VERSION + 1):
+            header = Container.HEADER.pack(Container.MAGIC, version, bytes(16), 4096)
+            with self.assertRaises(ValueError):
+                Container.read_header(io.BytesIO(header))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import importlib
+import os
+import socket
+import time
+import unittest
+
+from conftest import PACKAGE
+from Shard_Store import ShardStore
+
+Data_Chain = importlib.import_module(f'{PACKAGE}.Distributor.Data_Chain')
+Placement = importlib.import_module(f'{PACKAGE}.Distributor.Placement')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TwoNodes(unittest.TestCase):
+
+    def setUp(self):
+        # Two nodes on loopback addresses sharing one transfer port number, as real nodes share 5006
+        port = free_port()
+        self.chains = []
+        for ip in ('127.0.0.1', '127.0.0.2'):
+            chain = Data_Chain.DataChain(ip, ShardStore())
+            chain.Transfer_Port = port
+            chain.serve_transfers()
+            self.chains.append(chain)
+
+    def tearDown(self):
+        for chain in self.chains:
+            chain.close()
+
+
+class SendShardsTest(TwoNodes):
+
+    def test_held_shards_are_claimed_not_sent(self):
+        sender, target = self.chains
+        shards = {ShardStore.shard_id(shard): shard for shard in (os.urandom(1024) for _ in range(64))}
+        self.assertEqual(sender.send_shards(target.ip, shards), list(shards))
+        self.assertEqual(sender.send_shards(target.ip, shards), [])  # A second upload of the same data
+        self.assertEqual({target.store.ref_count(shard_id) for shard_id in shards}, {2})
+        self.assertEqual(target.transport.shards_received, len(shards))
+
+        self.assertEqual(sender.release_shards(target.ip, list(shards)), [])
+        self.assertEqual(sender.release_shards(target.ip, list(shards)), list(shards))
+        self.assertEqual(len(target.store), 0)
+        self.assertEqual(len(sender.transport._pools), 1)  # Every request went over the one pooled connection
+
+
+class RebalanceTest(TwoNodes):
+
+    def test_reference_counts_move_with_the_shards(self):
+        old, new = self.chains
+        old.placement = Placement.HashRing([old.ip], replicas=1)
+        shard_ids = []
+        for _ in range(32):
+            shard = os.urandom(256)
+            for _ in range(3):  # Three uploads reference it
+                shard_ids.append(old.store.put(shard))
+        shard_ids = list(dict.fromkeys(shard_ids))
+        self.assertEqual({old.store.ref_count(shard_id) for shard_id in shard_ids}, {3})
+
+        changes = old.rebalance(Placement.HashRing([old.ip, new.ip], replicas=1))
+        self.assertTrue(changes)
+        for shard_id in shard_ids:
+            holder, other = (new, old) if shard_id in changes else (old, new)
+            self.assertEqual(holder.store.ref_count(shard_id), 3)
+            self.assertNotIn(shard_id, other.store)
+
+        moved = next(iter(changes))
+        for _ in range(2):
+            self.assertFalse(new.store.release(moved))
+        self.assertTrue(new.store.release(moved))  # Deleted by the third release, as on the old holder
+
+    def test_handing_over_twice_keeps_the_count(self):
+        old, new = self.chains
+        shard = os.urandom(256)
+        shard_id = ShardStore.shard_id(shard)
+        for _ in range(2):  # E.g. two old holders of the same shard
+            old._run(old.transport.hand_over(new.ip, new.Transfer_Port, {shard_id: (shard, 3)}))
+        self.assertEqual(new.store.ref_count(shard_id), 3)
+
+
+class GossipMembershipTest(TwoNodes):
+
+    def test_join_by_gossip_hands_shards_over(self):
+        old, new = self.chains
+        old.placement = Placement.HashRing([old.ip], replicas=1)
+        shard_ids = [old.store.put(os.urandom(256)) for _ in range(32)]
+        expected = Placement.HashRing([old.ip, new.ip], replicas=1)
+        moved = [shard_id for shard_id in shard_ids if expected.primary(shard_id) == new.ip]
+        self.assertTrue(moved)
+
+        old._apply_gossip(f"member:{new.ip}", True)
+        deadline = time.monotonic() + 5
+        while new.ip not in old.placement.nodes and time.monotonic() < deadline:  # Swapped in last
+            time.sleep(0.01)
+        for shard_id in shard_ids:
+            holder, other = (new, old) if shard_id in moved else (old, new)
+            self.assertIn(shard_id, holder.store)
+            self.assertNotIn(shard_id, other.store)
+        self.assertEqual(set(old.placement.nodes), {old.ip, new.ip})
+
+
+if __name__ == '__main__':
+    unittest.main()
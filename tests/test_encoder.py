@@ -0,0 +1,82 @@
+import os
+import unittest
+
+from conftest import HAVE_LZO
+
+if HAVE_LZO:
+    import Encoder
+
+LOW_ENTROPY = b'abcd' * 64 * 1024  # 2 bits per byte
+TEXT_LIKE = bytes(i % 97 for i in range(256 * 1024))  # About 6.6 bits per byte
+RANDOM = os.urandom(256 * 1024)
+
+
+@unittest.skipUnless(HAVE_LZO, 'python-lzo is not installed')
+class EntropyTest(unittest.TestCase):
+
+    def test_estimates(self):
+        self.assertEqual(Encoder.estimate_entropy(b''), 0.0)
+        self.assertEqual(Encoder.estimate_entropy(bytes(100_000)), 0.0)
+        self.assertAlmostEqual(Encoder.estimate_entropy(LOW_ENTROPY), 2.0)
+        self.assertAlmostEqual(Encoder.estimate_entropy(bytes(range(256)) * 64), 8.0)
+        self.assertGreater(Encoder.estimate_entropy(RANDOM), Encoder.INCOMPRESSIBLE_ENTROPY)
+
+    def test_samples_cover_the_whole_block(self):
+        # Constant but for the last sample, which the strided samples still reach
+        block = bytes(1024 * 1024 - 4096) + bytes(range(256)) * 16
+        self.assertGreater(Encoder.estimate_entropy(block), 0.0)
+
+
+@unittest.skipUnless(HAVE_LZO, 'python-lzo is not installed')
+class ChooseCodecTest(unittest.TestCase):
+
+    def test_policies(self):
+        self.assertIn(Encoder.DEFAULT_POLICY, Encoder.POLICIES)
+        zstd = Encoder.CODEC_ZSTD if Encoder.zstandard is not None else Encoder.CODEC_LZO
+        expected = {
+            'fast': (Encoder.CODEC_RAW, Encoder.CODEC_LZO, Encoder.CODEC_LZO),
+            'balanced': (Encoder.CODEC_RAW, Encoder.CODEC_LZO, zstd),
+            'small': (Encoder.CODEC_RAW, zstd, zstd),
+        }
+        self.assertEqual(set(expected), set(Encoder.POLICIES))
+        for policy, codecs in expected.items():
+            with self.subTest(policy=policy):
+                chosen = tuple(Encoder.choose_codec(block, policy) for block in (RANDOM, TEXT_LIKE, LOW_ENTROPY))
+                self.assertEqual(chosen, codecs)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Encoder.choose_codec(LOW_ENTROPY, 'smallest')
+
+
+@unittest.skipUnless(HAVE_LZO, 'python-lzo is not installed')
+class EncodeBlockTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for policy in Encoder.POLICIES:
+            for block in (b'', RANDOM, TEXT_LIKE, LOW_ENTROPY):
+                with self.subTest(policy=policy, size=len(block)):
+                    codec, encoded = Encoder.encode_block(block, policy)
+                    self.assertEqual(Encoder.decode_block(codec, encoded), block)
+
+    def test_each_codec(self):
+        self.assertEqual(Encoder.encode_block(RANDOM)[0], Encoder.CODEC_RAW)
+        codec, encoded = Encoder.encode_block(LOW_ENTROPY, 'fast')
+        self.assertEqual(codec, Encoder.CODEC_LZO)
+        self.assertLess(len(encoded), len(LOW_ENTROPY) // 10)
+        if Encoder.zstandard is not None:
+            codec, encoded = Encoder.encode_block(LOW_ENTROPY, 'small', zstd_level=1)
+            self.assertEqual(codec, Encoder.CODEC_ZSTD)
+            self.assertEqual(Encoder.decode_block(codec, encoded), LOW_ENTROPY)
+
+    def test_block_that_would_grow_is_stored_raw(self):
+        # Below the entropy cut-off, but too short for any codec to shrink
+        self.assertEqual(Encoder.encode_block(b'ab', 'small'), (Encoder.CODEC_RAW, b'ab'))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            Encoder.decode_block(7, b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
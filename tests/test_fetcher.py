@@ -0,0 +1,130 @@
+import asyncio
+import importlib
+import os
+import tempfile
+import threading
+import unittest
+
+from conftest import HAVE_LZO, PACKAGE
+import Shard_Store
+
+Fetcher = importlib.import_module(f'{PACKAGE}.Distributor.Fetcher')
+Transport = importlib.import_module(f'{PACKAGE}.Distributor.Transport')
+
+
+class HedgedFetchTest(unittest.TestCase):
+
+    def test_first_fetch_from_cold_peers(self):
+        # Many shards at once, hedged across a live holder and one that refuses connections (nothing listens
+        # on 127.0.0.2)
+        async def run():
+            store = Shard_Store.ShardStore()
+            shards = [os.urandom(512) for _ in range(32)]
+            manifest = [store.put(shard) for shard in shards]
+            server = Transport.ShardTransport(store)
+            await server.start_server('127.0.0.1', 0)
+            client = Transport.ShardTransport(connections_per_peer=2)
+            fetcher = Fetcher.ShardFetcher(client, port=server.server_port, default_hedge_delay=0.001)
+            received = {}
+            try:
+                missing = await fetcher.fetch(manifest, {shard_id: ['127.0.0.2', '127.0.0.1'] for shard_id in manifest},
+                                              received.__setitem__)
+            finally:
+                await client.close()
+                await server.close()
+            self.assertEqual(missing, [])
+            self.assertEqual([received[i] for i in range(len(shards))], shards)
+
+        asyncio.run(run())
+
+
+class _CountingTransport:
+    # Answers GETs from a dict, counting the requests and the most in flight at once
+
+    def __init__(self, shards, held_by=None):
+        self.shards = shards
+        self.held_by = held_by or {}  # Host -> the IDs it holds, for hosts that lack some
+        self.requests = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def get_shards(self, host, port, shard_ids):
+        self.requests.append((host, list(shard_ids)))
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(0)
+        self.in_flight -= 1
+        held = self.held_by.get(host, self.shards)
+        return {shard_id: self.shards[shard_id] for shard_id in shard_ids if shard_id in held}
+
+
+class BatchedFetchTest(unittest.TestCase):
+
+    def test_shards_of_the_same_holders_share_a_get(self):
+        shards = {f'{i:064x}': os.urandom(64) for i in range(1000)}
+        manifest = list(shards)
+        shard_table = {shard_id: ['10.0.0.1', '10.0.0.2'] if i % 2 else ['10.0.0.3']
+                       for i, shard_id in enumerate(manifest)}
+        transport = _CountingTransport(shards)
+        fetcher = Fetcher.ShardFetcher(transport, concurrency=4, batch_size=50, default_hedge_delay=10)
+        received = {}
+
+        missing = asyncio.run(fetcher.fetch(manifest, shard_table, received.__setitem__))
+
+        self.assertEqual(missing, [])
+        self.assertEqual([received[i] for i in range(len(manifest))], list(shards.values()))
+        self.assertEqual(len(transport.requests), 1000 // 50)
+        self.assertLessEqual(transport.most_in_flight, 4)
+        for holder, shard_ids in transport.requests:  # Each GET went to a node holding all of its shards
+            self.assertTrue(all(holder in shard_table[shard_id] for shard_id in shard_ids))
+
+    def test_shards_a_holder_lacks_come_from_the_next(self):
+        shards = {f'{i:064x}': os.urandom(64) for i in range(10)}
+        transport = _CountingTransport(shards, held_by={'10.0.0.1': set(list(shards)[:5])})
+        fetcher = Fetcher.ShardFetcher(transport, default_hedge_delay=10)
+        fetcher.rank = sorted  # Ask 10.0.0.1 first
+
+        found = asyncio.run(fetcher.fetch_batch(list(shards), ['10.0.0.2', '10.0.0.1']))
+
+        self.assertEqual(found, shards)
+        self.assertEqual(transport.requests, [('10.0.0.1', list(shards)), ('10.0.0.2', list(shards)[5:])])
+
+
+@unittest.skipUnless(HAVE_LZO, 'python-lzo is not installed')
+class DownloadTest(unittest.TestCase):
+
+    def test_download_fetches_from_the_holders(self):
+        import Encryption
+        import Main
+
+        key = Encryption.generate_symmetric_key()
+        with tempfile.NamedTemporaryFile() as f:
+            data = os.urandom(40000) + bytes(20000)
+            f.write(data)
+            f.flush()
+            shards = list(Main.Upload_Stream(f.name, key, block_size=4096, shard_size=1024, use_processes=False))
+        store = Shard_Store.ShardStore()
+        manifest = [store.put(shard) for shard in shards]
+        shard_table = {shard_id: ['127.0.0.1'] for shard_id in manifest}
+
+        # The holder answers from its own loop, since Download runs one of its own
+        loop = asyncio.new_event_loop()
+        server = Transport.ShardTransport(store)
+        loop.run_until_complete(server.start_server('127.0.0.1', 0))
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            fetcher = Fetcher.ShardFetcher(Transport.ShardTransport(), port=server.server_port)
+            self.assertEqual(Main.Download(manifest, key, fetcher=fetcher, shard_table=shard_table), data)
+            fetcher = Fetcher.ShardFetcher(Transport.ShardTransport(), port=server.server_port)
+            self.assertEqual(Main.Download(manifest, key, range=(4000, 6000), fetcher=fetcher, shard_table=shard_table),
+                             data[4000:6000])
+            self.assertLess(fetcher.requests, len(manifest))  # Only the shards the range reads
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.run_until_complete(server.close())
+            loop.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import importlib
+import json
+import random
+import socket
+import time
+import unittest
+
+from conftest import PACKAGE
+
+Gossip = importlib.import_module(f'{PACKAGE}.Distributor.Gossip').Gossip
+
+
+class PublishTest(unittest.TestCase):
+
+    def test_publish_before_start_is_sent_on_start(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:  # A free UDP port for both nodes
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        sender = Gossip('127.0.0.1', lambda: ['127.0.0.2'], port=port, interval=3600)
+        receiver = Gossip('127.0.0.2', lambda: ['127.0.0.1'], port=port, interval=3600)
+        receiver.start('127.0.0.2')
+        try:
+            sender.publish('tail', '127.0.0.1')  # No socket yet
+            self.assertIsNone(receiver.get('tail'))
+            sender.start('127.0.0.1')
+            deadline = time.monotonic() + 5
+            while receiver.get('tail') is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(receiver.get('tail'), '127.0.0.1')
+        finally:
+            sender.stop()
+            receiver.stop()
+
+
+class LargeDigestTest(unittest.TestCase):
+    KEYS = 3000
+
+    def setUp(self):
+        self.nodes = {}
+        for ip, seed in (('127.0.0.1', 1), ('127.0.0.2', 2)):
+            peers = [other for other in ('127.0.0.1', '127.0.0.2') if other != ip]
+            self.nodes[ip] = Gossip(ip, lambda peers=peers: peers, rng=random.Random(seed))
+        self.a, self.b = self.nodes['127.0.0.1'], self.nodes['127.0.0.2']
+
+    def deliver(self, messages, sender):
+        # Runs messages and every reply they cause to completion, checking each would fit in a datagram
+        queue = [(sender, peer, message) for peer, message in messages]
+        while queue:
+            sender, peer, message = queue.pop()
+            self.assertLessEqual(len(json.dumps(message).encode()), self.nodes[peer].max_datagram)
+            queue.extend((peer, target, reply) for target, reply in self.nodes[peer].handle(message, sender))
+
+    def test_every_message_fits_in_a_datagram(self):
+        for i in range(self.KEYS):
+            self.a.set(f'member:10.0.{i // 256}.{i % 256}', True)
+        self.deliver(self.b.round(), self.b.origin)  # b's empty digest pulls everything a has
+        self.assertEqual(self.b.items(), self.a.items())
+        for _ in range(20):
+            self.deliver(self.a.round(), self.a.origin)
+
+    def test_digest_parts_repair_a_stale_key(self):
+        for i in range(self.KEYS):
+            self.a.set(f'member:10.0.{i // 256}.{i % 256}', True)
+        self.deliver(self.b.round(), self.b.origin)
+        self.b.set('member:10.0.5.5', False)  # The rumour it returns is dropped, so only anti-entropy can carry it
+        rounds = 0
+        while self.a.get('member:10.0.5.5') and rounds < 10000:
+            self.deliver(self.a.round(), self.a.origin)
+            rounds += 1
+        self.assertFalse(self.a.get('member:10.0.5.5'))
+        self.assertGreater(rounds, 1)  # Found by one part of the digest, not the whole digest at once
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from Health import ALIVE, DEAD, SUSPECT, HealthTable
+
+PEER = '10.0.0.9'
+
+
+class Clock:
+    # Time that only moves when a test says so
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class PhiAccrualTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.table = HealthTable(clock=self.clock)
+        for second in range(10):  # A heartbeat every second
+            self.clock.now = 100.0 + second
+            self.table.heartbeat(PEER)
+        self.last = self.clock.now
+
+    def test_alive_then_suspect_then_dead(self):
+        states = []
+        for silence in (0.5, 1.5, 4.0, 6.0, 60.0):
+            self.clock.now = self.last + silence
+            states.append(self.table.state(PEER))
+        self.assertEqual(states, [ALIVE, ALIVE, SUSPECT, DEAD, DEAD])
+        self.assertEqual(self.table.state(PEER, now=self.last + 1.0), ALIVE)  # An explicit time wins
+
+    def test_phi_grows_with_silence(self):
+        phis = []
+        for _ in range(6):
+            phis.append(self.table.phi(PEER))
+            self.clock.now += 1.0
+        self.assertEqual(phis, sorted(phis))
+        self.assertLess(phis[0], 1.0)
+
+    def test_heartbeat_brings_a_suspect_back(self):
+        self.clock.now += 4.0
+        self.assertEqual(self.table.state(PEER), SUSPECT)
+        self.table.heartbeat(PEER)
+        self.assertEqual(self.table.state(PEER), ALIVE)
+
+    def test_tracked_peer_that_never_answers_dies(self):
+        self.table.track('10.0.0.10')
+        self.assertEqual(self.table.state('10.0.0.10'), ALIVE)
+        self.clock.now += 10.0
+        self.assertEqual(self.table.state('10.0.0.10'), DEAD)
+        self.assertEqual(self.table.alive([PEER, '10.0.0.10']), [])
+
+    def test_unknown_and_forgotten_peers_are_suspect(self):
+        self.assertIsNone(self.table.phi('10.0.0.10'))
+        self.assertEqual(self.table.state('10.0.0.10'), SUSPECT)
+        self.table.forget(PEER)
+        self.assertEqual(self.table.state(PEER), SUSPECT)
+        self.assertEqual(self.table.states(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
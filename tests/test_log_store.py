@@ -0,0 +1,28 @@
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+
+from Log_Store import LogStore
+
+
+class CloseTest(unittest.TestCase):
+
+    def test_close_stops_the_compaction_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = LogStore(directory, compaction_interval=3600)
+            shard = os.urandom(1024)
+            store.write(hashlib.sha256(shard).hexdigest(), shard)
+            started = time.monotonic()
+            store.close()
+            self.assertLess(time.monotonic() - started, 5)  # Not held up by the interval
+            self.assertFalse(store.CompactionThread.is_alive())
+
+            reopened = LogStore(directory, compaction_interval=None)
+            self.assertEqual(bytes(reopened.read(hashlib.sha256(shard).hexdigest())), shard)
+            reopened.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
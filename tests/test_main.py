@@ -0,0 +1,79 @@
+import os
+import random
+import tempfile
+import unittest
+
+from conftest import HAVE_LZO
+
+if HAVE_LZO:
+    import Container
+    import Encoder
+    import Encryption
+    import Main
+
+
+def write_file(data):
+    f = tempfile.NamedTemporaryFile(delete=False)
+    f.write(data)
+    f.close()
+    return f.name
+
+
+@unittest.skipUnless(HAVE_LZO, 'python-lzo is not installed')
+class ChunkedUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.data = rng.randbytes(200_000) + bytes(200_000)  # Incompressible, then highly compressible
+        self.path = write_file(self.data)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        shards, key = Main.Upload(self.path, chunking='cdc')
+        self.assertEqual(Main.Download(shards, key, chunking='cdc'), self.data)
+
+    def test_reupload_after_an_edit_reuses_most_shards(self):
+        shards, key = Main.Upload(self.path, chunking='cdc')
+        edited = self.data[:1000] + b'x' + self.data[1000:]
+        with open(self.path, 'wb') as f:
+            f.write(edited)
+
+        new_shards, _ = Main.Upload(self.path, chunking='cdc', key=key)
+        self.assertEqual(Main.Download(new_shards, key, chunking='cdc'), edited)
+        self.assertLessEqual(len(set(new_shards) - set(shards)), 2)  # Only the chunks around the edit
+
+    def test_chunks_get_the_codec_their_contents_call_for(self):
+        shards, _ = Main.Upload(self.path, chunking='cdc')
+        codecs = [Container.CHUNK_HEADER.unpack_from(shard)[1] for shard in shards]
+        self.assertEqual(codecs[0], Encoder.CODEC_RAW)
+        self.assertNotEqual(codecs[-1], Encoder.CODEC_RAW)
+
+    def test_range_is_refused(self):
+        shards, key = Main.Upload(self.path, chunking='cdc')
+        with self.assertRaises(ValueError):
+            Main.Download(shards, key, range=(0, 10), chunking='cdc')
+
+
+@unittest.skipUnless(HAVE_LZO, 'python-lzo is not installed')
+class ErasureRangeDownloadTest(unittest.TestCase):
+
+    def test_range_of_an_erasure_coded_upload(self):
+        data = random.Random(0).randbytes(60_000)
+        path = write_file(data)
+        try:
+            key = Encryption.generate_symmetric_key()
+            shards = list(Main.Upload_Stream(path, key, block_size=4096, shard_size=1024, use_processes=False,
+                                             erasure=(4, 2)))
+        finally:
+            os.remove(path)
+        for stripe in range(0, len(shards), 6):  # Lose two shards of every stripe, data and parity
+            shards[stripe + 1] = shards[stripe + 4] = None
+
+        self.assertEqual(Main.Download(shards, key, erasure=(4, 2), range=(10_000, 30_000)), data[10_000:30_000])
+        self.assertEqual(Main.Download(shards, key, erasure=(4, 2), range=(59_000, 70_000)), data[59_000:])
+
+
+if __name__ == '__main__':
+    unittest.main()
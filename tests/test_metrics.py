@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+import unittest
+import urllib.request
+
+from Metrics import Histogram, Registry, TimedLock
+
+
+class HistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        self.histogram = Histogram('latency', buckets=(1, 2, 5))
+        for value in (0.5, 1, 1.5, 5, 7):
+            self.histogram.observe(value)
+
+    def test_bucket_counts(self):
+        # A value on a bound counts towards that bound's bucket ("le"); 7 only in the overflow
+        snapshot = self.histogram.snapshot()
+        self.assertEqual(snapshot['buckets'], {1: 2, 2: 3, 5: 4})
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['sum'], 15.0)
+        self.assertEqual(snapshot['mean'], 3.0)
+
+    def test_quantiles(self):
+        self.assertEqual(self.histogram.quantile(0.2), 0.5)  # Halfway into (0, 1]
+        self.assertEqual(self.histogram.quantile(0.5), 1.5)  # Halfway into (1, 2]
+        self.assertEqual(self.histogram.quantile(1.0), 5)  # Overflow: only the last bound is known
+        self.assertIsNone(Histogram('empty').quantile(0.5))
+
+    def test_time(self):
+        with self.histogram.time():
+            time.sleep(0.01)
+        self.assertEqual(self.histogram.snapshot()['count'], 6)
+        self.assertGreaterEqual(self.histogram.snapshot()['sum'], 15.01)
+
+
+class TimedLockTest(unittest.TestCase):
+
+    def test_hold_and_wait_are_observed(self):
+        hold, wait = Histogram('hold'), Histogram('wait')
+        lock = TimedLock(hold, wait)
+        locked = threading.Event()
+
+        def holder():
+            with lock:
+                locked.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        locked.wait(5)
+        with lock:  # Waits for the holder
+            self.assertTrue(lock.locked())
+        thread.join()
+
+        self.assertEqual(hold.snapshot()['count'], 2)
+        self.assertGreaterEqual(hold.snapshot()['sum'], 0.05)
+        self.assertEqual(wait.snapshot()['count'], 2)
+        self.assertGreater(wait.snapshot()['sum'], 0.02)
+        self.assertFalse(lock.locked())
+
+    def test_failed_acquire_is_not_observed(self):
+        hold, wait = Histogram('hold'), Histogram('wait')
+        lock = TimedLock(hold, wait)
+        self.assertTrue(lock.acquire())
+        self.assertFalse(lock.acquire(blocking=False))
+        lock.release()
+        self.assertEqual(wait.snapshot()['count'], 1)
+        self.assertEqual(hold.snapshot()['count'], 1)
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.counter('pings_sent_total', 'Pings sent').inc(3)
+        self.registry.gauge('neighbours', function=lambda: 4)
+        histogram = self.registry.histogram('rtt_seconds', 'Ping round trip time', buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(2)
+
+    def test_render(self):
+        self.assertEqual(self.registry.render(), (
+            '# HELP pings_sent_total Pings sent\n'
+            '# TYPE pings_sent_total counter\n'
+            'pings_sent_total 3\n'
+            '# TYPE neighbours gauge\n'
+            'neighbours 4\n'
+            '# HELP rtt_seconds Ping round trip time\n'
+            '# TYPE rtt_seconds histogram\n'
+            'rtt_seconds_bucket{le="0.1"} 1\n'
+            'rtt_seconds_bucket{le="1"} 2\n'
+            'rtt_seconds_bucket{le="+Inf"} 3\n'
+            'rtt_seconds_sum 2.55\n'
+            'rtt_seconds_count 3\n'))
+
+    def test_metrics_are_created_once(self):
+        self.assertIs(self.registry.counter('pings_sent_total'), self.registry.counter('pings_sent_total'))
+        self.assertEqual(self.registry.counter('pings_sent_total').value, 3)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('pings_sent_total')
+
+    def test_serve(self):
+        server = self.registry.serve()
+        try:
+            base = f'http://127.0.0.1:{server.server_port}'
+            with urllib.request.urlopen(f'{base}/metrics', timeout=5) as response:
+                self.assertEqual(response.read().decode(), self.registry.render())
+            with urllib.request.urlopen(f'{base}/metrics.json', timeout=5) as response:
+                self.assertEqual(json.loads(response.read())['neighbours'], 4)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
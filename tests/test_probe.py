@@ -0,0 +1,62 @@
+import time
+import unittest
+
+from Probe import PONG, PROBE, ProbeEngine
+
+PEER = '10.0.0.9'
+
+
+class RetransmissionTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = ProbeEngine(initial_timeout=1.0, min_timeout=0.05, max_timeout=2.0)
+
+    def tearDown(self):
+        self.engine.close()
+
+    def test_first_sample(self):
+        self.assertEqual(self.engine.timeout_for(PEER), 1.0)
+        self.engine._update_rtt(PEER, 0.1)
+        # SRTT = R, RTTVAR = R / 2, RTO = SRTT + 4 * RTTVAR
+        self.assertEqual(self.engine.rtt(PEER), 0.1)
+        self.assertAlmostEqual(self.engine.timeout_for(PEER), 0.3)
+
+    def test_later_samples(self):
+        self.engine._update_rtt(PEER, 0.1)
+        self.engine._update_rtt(PEER, 0.2)
+        # RTTVAR = 3/4 * 0.05 + 1/4 * |0.1 - 0.2|, SRTT = 7/8 * 0.1 + 1/8 * 0.2
+        rttvar = 0.75 * 0.05 + 0.25 * 0.1
+        srtt = 0.875 * 0.1 + 0.125 * 0.2
+        self.assertAlmostEqual(self.engine.rtt(PEER), srtt)
+        self.assertAlmostEqual(self.engine.timeout_for(PEER), srtt + 4 * rttvar)
+
+    def test_bounds(self):
+        self.engine._update_rtt(PEER, 0.001)
+        self.assertEqual(self.engine.timeout_for(PEER), 0.05)
+        self.engine._update_rtt('10.0.0.10', 5.0)
+        self.assertEqual(self.engine.timeout_for('10.0.0.10'), 2.0)
+
+    def test_backoff_until_the_peer_answers(self):
+        self.engine._update_rtt(PEER, 0.1)
+        timeouts = []
+        for sequence in range(1, 5):  # Each probe expires at once
+            self.engine._collect({PEER: None}, {sequence: (PEER, 0.0)})
+            timeouts.append(self.engine.timeout_for(PEER))
+        self.assertEqual([round(t, 6) for t in timeouts], [0.6, 1.2, 2.0, 2.0])  # Doubled, then capped
+
+        results = {PEER: None}
+        outstanding = {5: (PEER, time.monotonic() + 10)}
+        self.engine._receive(PONG + PROBE.pack(5, time.monotonic()), results, outstanding)
+        self.assertIsNotNone(results[PEER])
+        self.assertEqual(outstanding, {})
+        self.assertLess(self.engine.timeout_for(PEER), 0.6)  # Back to SRTT + 4 * RTTVAR
+
+    def test_late_pong_is_ignored(self):
+        results = {PEER: None}
+        self.engine._receive(PONG + PROBE.pack(7, time.monotonic()), results, {})
+        self.assertIsNone(results[PEER])
+        self.assertIsNone(self.engine.rtt(PEER))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import hashlib
+import importlib
+import os
+import unittest
+
+from conftest import PACKAGE
+from Shard_Store import ShardStore
+
+Replication = importlib.import_module(f'{PACKAGE}.Distributor.Replication')
+
+
+class OutOfStepTailTest(unittest.TestCase):
+
+    def test_acks_out_of_order_fail_the_writes(self):
+        async def tail(reader, writer):
+            # Stores nothing and acks every shard with the wrong digest
+            try:
+                await reader.readexactly(1)  # No further hops
+                while True:
+                    _, length = Replication.SHARD_HEADER.unpack(await reader.readexactly(Replication.SHARD_HEADER.size))
+                    await reader.readexactly(length)
+                    writer.write(Replication.ACK.pack(bytes(32), Replication.STORED))
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        async def run():
+            errors = []
+            store = ShardStore()
+            middle = Replication.ChainReplicator(store)
+            handle = middle._handle_connection
+
+            async def recorded(reader, writer):
+                try:
+                    await handle(reader, writer)
+                except Exception as error:
+                    errors.append(error)
+
+            middle._handle_connection = recorded
+            await middle.start_server('127.0.0.1', 0)
+            server = await asyncio.start_server(tail, '127.0.0.1', 0)
+            tail_port = server.sockets[0].getsockname()[1]
+            try:
+                shards = [os.urandom(4096) for _ in range(4)]
+                statuses = await Replication.ChainReplicator().replicate(
+                    [('127.0.0.1', middle.server_port), ('127.0.0.1', tail_port)], shards)
+                self.assertEqual(statuses, {hashlib.sha256(shard).hexdigest(): Replication.BROKEN for shard in shards})
+                self.assertEqual(errors, [])
+                self.assertEqual(middle.shards_stored, len(shards))  # Still stored on the middle node
+            finally:
+                await middle.close()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
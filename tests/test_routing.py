@@ -0,0 +1,102 @@
+import random
+import unittest
+
+from Routing import FIND, FIND_REQUEST, ID_BITS, RoutingTable, answer_find_node
+
+TOP = 1 << (ID_BITS - 1)  # IDs with this bit set are in the farthest half from ID 0
+
+
+def ip(i):
+    return f'10.0.{i // 256}.{i % 256}'
+
+
+class BucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = RoutingTable(0, k=3)
+
+    def test_bucket_index(self):
+        self.assertEqual(self.table.bucket_index(TOP | 5), 0)
+        self.assertEqual(self.table.bucket_index(1), ID_BITS - 1)
+        self.assertEqual(self.table.bucket_index(2), ID_BITS - 2)
+
+    def test_full_bucket_keeps_its_contacts_and_queues_newcomers(self):
+        for i in range(3):
+            self.assertTrue(self.table.update(TOP | i, ip(i)))
+        self.assertFalse(self.table.update(TOP | 3, ip(3)))
+        self.assertFalse(self.table.update(TOP | 4, ip(4)))
+        self.assertNotIn(ip(3), self.table)
+        self.assertEqual(self.table.ips(), [ip(0), ip(1), ip(2)])
+
+        self.assertTrue(self.table.update(TOP | 0, ip(0)))  # Seen again: now most recently seen
+        self.assertEqual(self.table.ips(), [ip(1), ip(2), ip(0)])
+
+    def test_removal_promotes_the_newest_replacement(self):
+        for i in range(5):
+            self.table.update(TOP | i, ip(i))
+        self.table.remove(TOP | 1)
+        self.assertEqual(self.table.ips(), [ip(0), ip(2), ip(4)])
+        self.table.remove_ip(ip(0))
+        self.assertEqual(self.table.ips(), [ip(2), ip(4), ip(3)])
+        self.table.remove(TOP | 2)
+        self.assertEqual(len(self.table), 2)  # No replacements left
+
+    def test_new_id_at_a_known_ip_replaces_the_old_one(self):
+        self.table.update(TOP | 1, ip(1))
+        self.table.update(2, ip(1))  # Restarted with a new ID
+        self.assertEqual(self.table.node_id_of(ip(1)), 2)
+        self.assertEqual(len(self.table), 1)
+
+    def test_own_id_is_never_added(self):
+        self.assertFalse(self.table.update(0, ip(0)))
+        self.assertEqual(len(self.table), 0)
+
+
+class ClosestTest(unittest.TestCase):
+
+    def test_sorted_by_xor_distance(self):
+        rng = random.Random(0)
+        table = RoutingTable(rng.getrandbits(ID_BITS), k=20)
+        ids = [rng.getrandbits(ID_BITS) for _ in range(500)]
+        for i, node_id in enumerate(ids):
+            table.update(node_id, ip(i))
+        contacts = {table.node_id_of(address): address for address in table.ips()}
+
+        target = rng.getrandbits(ID_BITS)
+        closest = table.closest(target, count=10)
+        expected = sorted(contacts, key=lambda node_id: node_id ^ target)[:10]
+        self.assertEqual([node_id for node_id, _ in closest], expected)
+        self.assertEqual([address for _, address in closest], [contacts[node_id] for node_id in expected])
+        self.assertEqual(len(table.closest(target)), 20)
+
+    def test_lookup_finds_the_closest_nodes(self):
+        # A network of 200 nodes whose full buckets each hold only k of the nodes in their range
+        rng = random.Random(1)
+        ids = [rng.getrandbits(ID_BITS) for _ in range(200)]
+        tables = {ip(i): RoutingTable(node_id, k=8) for i, node_id in enumerate(ids)}
+        for i in range(200):
+            for j in rng.sample(range(200), 200):
+                tables[ip(i)].update(ids[j], ip(j))
+        self.assertLess(len(tables[ip(0)]), 100)
+
+        def find_node(address, target_id):
+            return tables[address].closest(target_id)
+
+        target = rng.getrandbits(ID_BITS)
+        found = tables[ip(0)].lookup(target, find_node)
+        expected = sorted(ids[1:], key=lambda node_id: node_id ^ target)[:8]
+        self.assertEqual([node_id for node_id, _ in found], expected)
+
+    def test_find_request_is_answered_and_the_asker_learnt(self):
+        table = RoutingTable(0, k=3)
+        for i in range(1, 6):
+            table.update(i, ip(i))
+        request = FIND + FIND_REQUEST.pack((4).to_bytes(16, 'big'), (TOP | 9).to_bytes(16, 'big'))
+        reply = answer_find_node(table, request, ('10.1.0.1', 5000))
+        self.assertEqual(len(reply), 1 + 3 * 20)
+        self.assertEqual(table.node_id_of('10.1.0.1'), TOP | 9)
+        self.assertIsNone(answer_find_node(table, FIND, ('10.1.0.1', 5000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
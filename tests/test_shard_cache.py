@@ -0,0 +1,67 @@
+import os
+import threading
+import unittest
+
+from Shard_Cache import ShardCache
+from Shard_Store import ShardStore
+
+
+class TinyLfuAdmissionTest(unittest.TestCase):
+
+    def test_rejected_shard_evicts_nothing(self):
+        store = ShardStore()
+        cold = store.put(os.urandom(1000))
+        hot = store.put(os.urandom(1000))
+        large = store.put(os.urandom(2000))
+        cache = ShardCache(store, capacity=2000, policy='tinylfu')
+        cache.get(cold)
+        for _ in range(10):
+            cache.get(hot)
+        for _ in range(2):  # More often than the cold shard, less than the hot one
+            cache.get(large)
+
+        # Making room for the large shard would evict the hot one too, so it is not admitted at all
+        self.assertEqual(cache.stats()['evictions'], 0)
+        self.assertEqual(cache.stats()['entries'], 2)
+        cache.get(cold)
+        cache.get(hot)
+        self.assertEqual(cache.stats()['hits'], 9 + 2)  # Both still cached
+
+
+class _PausingStore(ShardStore):
+    # Holds each get() after it has read the shard until `resume` is set
+
+    def __init__(self):
+        super().__init__()
+        self.read = threading.Event()
+        self.resume = threading.Event()
+
+    def get(self, shard_id):
+        shard = super().get(shard_id)
+        self.read.set()
+        self.resume.wait(5)
+        return shard
+
+
+class InvalidateDuringLoadTest(unittest.TestCase):
+
+    def test_shard_deleted_during_load_is_not_cached(self):
+        store = _PausingStore()
+        shard_id = store.put(os.urandom(1000))
+        cache = ShardCache(store)
+        results = []
+        reader = threading.Thread(target=lambda: results.append(cache.get(shard_id)))
+        reader.start()
+        self.assertTrue(store.read.wait(5))
+
+        self.assertTrue(cache.release(shard_id))  # Deleted between the read and the admission
+        store.resume.set()
+        reader.join(5)
+
+        self.assertIsNotNone(results[0])  # The reader still gets what it read
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertIsNone(cache.get(shard_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import itertools
+import os
+import unittest
+
+import numpy as np
+
+import Sharding
+from Sharding import reconstruct_data, shard_data
+
+
+class ReconstructFromDictTest(unittest.TestCase):
+
+    def test_out_of_order_shards(self):
+        data = os.urandom(5000)
+        shards = dict(reversed(list(enumerate(shard_data(data, 1024)))))
+        self.assertEqual(bytes(reconstruct_data(shards, data_size=len(data))), data)
+
+    def test_gap_in_indexes(self):
+        shards = dict(enumerate(shard_data(os.urandom(4096), 1024)))
+        del shards[2]  # Every shard is full, so only the index check catches it
+        with self.assertRaises(ValueError):
+            reconstruct_data(shards, data_size=4096)
+
+    def test_missing_last_shard(self):
+        for size in (4096, 4000):  # The lost last shard full or short
+            shards = dict(enumerate(shard_data(os.urandom(size), 1024)))
+            del shards[3]
+            with self.subTest(size=size), self.assertRaises(ValueError):
+                reconstruct_data(shards, data_size=size)
+
+    def test_size_is_required(self):
+        with self.assertRaises(ValueError):
+            reconstruct_data(dict(enumerate(shard_data(os.urandom(4096), 1024))))
+
+
+class ErasureCodingTest(unittest.TestCase):
+    K, M, SHARD_SIZE = 4, 2, 256
+
+    def setUp(self):
+        self.data = os.urandom(3 * self.K * self.SHARD_SIZE + 700)  # The last stripe is not full
+        self.shards = Sharding.erasure_shard_data(self.data, self.SHARD_SIZE, self.K, self.M)
+
+    def lose(self, positions):
+        # The shards with the given positions lost from every stripe
+        n = self.K + self.M
+        return [None if i % n in positions else shard for i, shard in enumerate(self.shards)]
+
+    def test_round_trip_after_losing_up_to_m_shards(self):
+        self.assertEqual(len(self.shards), 4 * (self.K + self.M))
+        for lost in range(self.M + 1):
+            for positions in itertools.combinations(range(self.K + self.M), lost):  # Data, parity or both
+                with self.subTest(lost=positions):
+                    shards = self.lose(positions)
+                    self.assertEqual(reconstruct_data(shards, self.K, self.M, len(self.data)), self.data)
+
+    def test_losing_m_plus_one_shards_is_rejected(self):
+        for positions in itertools.combinations(range(self.K + self.M), self.M + 1):
+            with self.subTest(lost=positions), self.assertRaises(ValueError):
+                reconstruct_data(self.lose(positions), self.K, self.M, len(self.data))
+
+    def test_stream_matches_whole_data_coding(self):
+        # shard_stream leaves the last shard short; erasure_code_stream pads it like erasure_shard_data does
+        stream = list(Sharding.erasure_code_stream(
+            Sharding.shard_stream([self.data], self.SHARD_SIZE), self.SHARD_SIZE, self.K, self.M))
+        self.assertEqual(stream, self.shards)
+
+        decoded = b''.join(Sharding.erasure_decode_stream(self.lose((0, self.K)), self.K, self.M))
+        self.assertEqual(decoded[:len(self.data)], self.data)
+        self.assertEqual(decoded[len(self.data):], bytes(len(decoded) - len(self.data)))
+
+    def test_stream_cut_mid_stripe_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(Sharding.erasure_decode_stream(self.shards[:-1], self.K, self.M))
+
+    def test_invert_matrix(self):
+        for chosen in itertools.combinations(range(self.K + self.M), self.K):
+            encode = np.concatenate([np.identity(self.K, dtype=np.uint8), Sharding._parity_matrix(self.K, self.M)])
+            matrix = encode[list(chosen)]
+            inverse = Sharding._gf_invert_matrix(matrix)
+            self.assertTrue((Sharding._gf_matmul(inverse, matrix) == np.identity(self.K, dtype=np.uint8)).all())
+
+        with self.assertRaises(ValueError):
+            Sharding._gf_invert_matrix(np.array([[1, 2], [1, 2]], dtype=np.uint8))
+
+
+class _CountingShards(list):
+    # A shard list that records which indexes were read
+
+    def __init__(self, shards):
+        super().__init__(shards)
+        self.read = set()
+
+    def __getitem__(self, index):
+        self.read.add(index)
+        return super().__getitem__(index)
+
+
+class ErasureRangeTest(unittest.TestCase):
+    K, M, SHARD_SIZE = 4, 2, 256
+
+    def test_range_reads_only_the_stripes_it_needs(self):
+        data = os.urandom(20 * self.K * self.SHARD_SIZE + 300) + b'end'  # Ends in a non-zero byte
+        coded = list(Sharding.erasure_code_stream(
+            Sharding.shard_stream([data], self.SHARD_SIZE), self.SHARD_SIZE, self.K, self.M))
+        width = self.K + self.M
+        coded[5 * width + 1] = coded[5 * width + 2] = None  # Two data shards of the sixth stripe
+        shards = _CountingShards(coded)
+
+        view = Sharding.ErasureShards(shards, self.K, self.M)
+        self.assertEqual(Sharding.stream_size(view), len(data))
+        offset = 5 * self.K * self.SHARD_SIZE + 100
+        self.assertEqual(Sharding.read_range(view, offset, 600), data[offset: offset + 600])
+        self.assertEqual(Sharding.read_range(view, len(data) - 10, 10), data[-10:])
+
+        stripes = {index // width for index in shards.read}
+        self.assertEqual(stripes, {0, 5, 20})  # The first shard, the range and the last stripe
+
+
+if __name__ == '__main__':
+    unittest.main()
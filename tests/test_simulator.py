@@ -0,0 +1,49 @@
+import importlib
+import random
+import unittest
+
+from conftest import PACKAGE
+
+Simulator = importlib.import_module(f'{PACKAGE}.Distributor.Simulator')
+
+
+class RecoveryTest(unittest.TestCase):
+
+    def test_recovered_node_probes_and_gossips_again(self):
+        network = Simulator.SimNetwork(seed=1)
+        sim = Simulator.Simulation(20, network, seed=1)
+        sim.bootstrap()
+        sim.start_probing()
+        sim.start_gossip()
+        network.run(until=3)
+
+        ip = next(iter(sim.nodes))
+        network.crash(ip)
+        network.run(until=6)
+        network.recover(ip)
+
+        node, gossip = sim.nodes[ip], sim.gossip[ip]
+        calls = {'sweeps': 0, 'rounds': 0}
+        apply_sweep, gossip_round = node.apply_sweep, gossip.round
+
+        def counted_sweep(*args):
+            calls['sweeps'] += 1
+            return apply_sweep(*args)
+
+        def counted_round():
+            calls['rounds'] += 1
+            return gossip_round()
+
+        node.apply_sweep, gossip.round = counted_sweep, counted_round
+        network.run(until=9)
+        self.assertGreater(calls['sweeps'], 0)
+        self.assertGreater(calls['rounds'], 0)
+
+    def test_simulation_leaves_global_random_alone(self):
+        state = random.getstate()
+        Simulator.Simulation(5, seed=1)
+        self.assertEqual(random.getstate(), state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import asyncio
+import importlib
+import os
+import socket
+import unittest
+
+from conftest import PACKAGE
+from Shard_Store import ShardStore
+
+ShardTransport = importlib.import_module(f'{PACKAGE}.Distributor.Transport').ShardTransport
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_concurrent_requests_to_new_peer_share_one_pool(self):
+        async def run():
+            store = ShardStore()
+            shard_ids = [store.put(os.urandom(1024)) for _ in range(8)]
+            server = ShardTransport(store)
+            await server.start_server('127.0.0.1', 0)
+            client = ShardTransport(connections_per_peer=2)
+            try:
+                replies = await asyncio.gather(*(client.get_shards('127.0.0.1', server.server_port, [shard_id])
+                                                 for shard_id in shard_ids))
+                self.assertEqual([list(reply) for reply in replies], [[shard_id] for shard_id in shard_ids])
+                self.assertEqual(len(client._pools[('127.0.0.1', server.server_port)]), 2)
+            finally:
+                await client.close()
+                await server.close()
+
+        asyncio.run(run())
+
+    def test_failed_pool_leaves_nothing_registered(self):
+        async def run():
+            with socket.socket() as sock:  # A port nothing listens on
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+            client = ShardTransport()
+            for _ in range(2):
+                with self.assertRaises(OSError):
+                    await client.get_shards('127.0.0.1', port, ['00' * 32])
+            self.assertEqual(client._pools, {})
+            self.assertEqual(client._round_robin, {})
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()